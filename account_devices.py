@@ -0,0 +1,282 @@
+# account_devices.py
+#
+# Which devices each account has used. account_devices holds one row per
+# (account_id, device_id) with first_seen / last_seen / use_count, so the
+# NEW_DEVICE check is a primary-key probe instead of a scan over the
+# account's transaction history, and no history is forgotten (the Python
+# detectors used to look at the last 10 transactions only).
+#
+# Maintained on insert by the triggers fraud_detect.py installs: the row
+# trigger upserts as it scores, and in statement and off mode the
+# statement-level trg_txn_devices trigger folds each INSERT in.
+#
+# DeviceIndex is the in-memory side for the Python detectors (new_device
+# rules with "source": "account_devices" in rules.json): preloaded from the
+# table, a Bloom filter answers "never used" without a lookup, and a sorted
+# array of (account_id, device_id, first_seen) gives the exact answer.
+#
+#   python account_devices.py            # create table and functions, fill it once
+#   python account_devices.py --rebuild  # recompute the table from transactions
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import db
+
+BLOOM_BITS_PER_KEY = 12   # with 4 hashes: ~0.6% false positives, then the exact lookup decides
+BLOOM_HASHES = 4
+LOAD_CHUNK = 100_000   # rows per fetchmany in DeviceIndex.load
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# ---------------------------
+# 1️⃣ Table, functions and trigger
+# ---------------------------
+ACCOUNT_DEVICES_SQL = """
+CREATE TABLE IF NOT EXISTS account_devices (
+    account_id  BIGINT NOT NULL,
+    device_id   BIGINT NOT NULL,
+    first_seen  TIMESTAMPTZ NOT NULL,
+    last_seen   TIMESTAMPTZ NOT NULL,
+    use_count   BIGINT NOT NULL DEFAULT 1,
+    PRIMARY KEY (account_id, device_id)
+);
+
+-- Record p_count uses of a device; true when the account had never used it
+CREATE OR REPLACE FUNCTION account_devices_push(
+    p_account_id BIGINT,
+    p_device_id  BIGINT,
+    p_ts         TIMESTAMPTZ,
+    p_count      BIGINT DEFAULT 1
+) RETURNS BOOLEAN LANGUAGE plpgsql AS $$
+DECLARE
+    inserted BOOLEAN;
+BEGIN
+    INSERT INTO account_devices AS d (account_id, device_id, first_seen, last_seen, use_count)
+    VALUES (p_account_id, p_device_id, p_ts, p_ts, p_count)
+    ON CONFLICT (account_id, device_id) DO UPDATE SET
+        first_seen = LEAST(d.first_seen, EXCLUDED.first_seen),
+        last_seen  = GREATEST(d.last_seen, EXCLUDED.last_seen),
+        use_count  = d.use_count + EXCLUDED.use_count
+    RETURNING (xmax = 0) INTO inserted;   -- xmax is 0 for a fresh insert
+    RETURN inserted;
+END;
+$$;
+
+-- Statement-level maintenance: one upsert per INSERT statement. Key order
+-- keeps concurrent batches from deadlocking on each other's rows.
+CREATE OR REPLACE FUNCTION trg_account_devices()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO account_devices AS d (account_id, device_id, first_seen, last_seen, use_count)
+    SELECT account_id, device_id, MIN(txn_timestamp), MAX(txn_timestamp), COUNT(*)
+    FROM new_txns
+    WHERE device_id IS NOT NULL
+    GROUP BY account_id, device_id
+    ORDER BY account_id, device_id
+    ON CONFLICT (account_id, device_id) DO UPDATE SET
+        first_seen = LEAST(d.first_seen, EXCLUDED.first_seen),
+        last_seen  = GREATEST(d.last_seen, EXCLUDED.last_seen),
+        use_count  = d.use_count + EXCLUDED.use_count;
+    RETURN NULL;
+END;
+$$;
+
+-- Recompute the table from the transactions table
+CREATE OR REPLACE FUNCTION rebuild_account_devices()
+RETURNS BIGINT LANGUAGE plpgsql AS $$
+DECLARE
+    n BIGINT;
+BEGIN
+    LOCK TABLE account_devices IN EXCLUSIVE MODE;
+    DELETE FROM account_devices;
+
+    INSERT INTO account_devices (account_id, device_id, first_seen, last_seen, use_count)
+    SELECT account_id, device_id, MIN(txn_timestamp), MAX(txn_timestamp), COUNT(*)
+    FROM transactions
+    WHERE device_id IS NOT NULL
+    GROUP BY account_id, device_id;
+
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END;
+$$;
+"""
+
+# Named to sort after trg_check_txn_stmt: same-event triggers fire in name
+# order, so the statement-level check still sees the devices as they were
+DEVICES_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS trg_txn_devices ON transactions;
+CREATE TRIGGER trg_txn_devices
+AFTER INSERT ON transactions
+REFERENCING NEW TABLE AS new_txns
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_account_devices();
+"""
+
+
+def install_account_devices(cur):
+    # Create the table/functions; fill it if it is still empty
+    cur.execute(ACCOUNT_DEVICES_SQL)
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM account_devices)")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT rebuild_account_devices()")
+
+
+# ---------------------------
+# 2️⃣ In-memory index for the Python detectors
+# ---------------------------
+_M64 = (1 << 64) - 1
+
+
+def _mix(account_id, device_id):
+    # splitmix64 finaliser over both ids; Python ints, same result as _mix_array
+    h = (account_id * 0x9E3779B97F4A7C15 + device_id) & _M64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _M64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _M64
+    return h ^ (h >> 31)
+
+
+def _mix_array(account_ids, device_ids):
+    a, d = account_ids.astype(np.uint64), device_ids.astype(np.uint64)
+    with np.errstate(over="ignore"):
+        h = a * np.uint64(0x9E3779B97F4A7C15) + d
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def to_micros(ts):
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+class DeviceIndex:
+
+    def __init__(self, account_ids, device_ids, first_seen_us):
+        order = np.lexsort((device_ids, account_ids))
+        self.accounts = np.ascontiguousarray(account_ids[order])
+        self.devices = np.ascontiguousarray(device_ids[order])
+        self.first_seen = np.ascontiguousarray(first_seen_us[order])
+        # Bloom filter: bit i of self.bits, double hashing over one 64-bit mix
+        self.nbits = max(64, len(order) * BLOOM_BITS_PER_KEY)
+        self.bits = np.zeros((self.nbits + 7) // 8, dtype=np.uint8)
+        if len(order):
+            h = _mix_array(self.accounts, self.devices)
+            h1, h2 = h & np.uint64(0xFFFFFFFF), (h >> np.uint64(32)) | np.uint64(1)
+            for i in range(BLOOM_HASHES):
+                pos = (h1 + np.uint64(i) * h2) % np.uint64(self.nbits)
+                np.bitwise_or.at(self.bits, (pos >> np.uint64(3)).astype(np.int64),
+                                 (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8)))
+        self.bits = self.bits.tobytes()
+        # Per account: the earliest first_seen over all its devices
+        starts = np.flatnonzero(np.r_[True, self.accounts[1:] != self.accounts[:-1]]) if len(order) else order
+        self.account_ids = self.accounts[starts]
+        self.account_first = np.minimum.reduceat(self.first_seen, starts) if len(order) else self.first_seen
+        self.added = {}   # (account_id, device_id) -> first use seen by this process, not yet in the arrays
+        self.added_accounts = {}   # account_id -> earliest use in self.added
+        self._last = (None, None)   # last lookup: the rule check and observe() ask for the same pair
+        self.bloom_negatives = 0
+        self.exact_lookups = 0
+
+    @classmethod
+    def load(cls, cur, shard=None, num_shards=None):
+        # Preload account_devices (optionally the account_id % num_shards == shard part of it)
+        cur.execute("SELECT to_regclass('account_devices') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            raise SystemExit("account_devices does not exist: run python account_devices.py first")
+        # first_seen as epoch microseconds, so every column is a plain BIGINT
+        query = """
+            SELECT account_id, device_id, (extract(epoch FROM first_seen) * 1000000)::bigint
+            FROM account_devices
+        """
+        params = None
+        if num_shards and num_shards > 1:
+            query += " WHERE account_id %% %s = %s"
+            params = (num_shards, shard)
+        cur.execute(query, params)
+        chunks = []
+        while True:
+            rows = cur.fetchmany(LOAD_CHUNK)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+        table = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+        return cls(table[:, 0].copy(), table[:, 1].copy(), table[:, 2].copy())
+
+    def _maybe_known(self, account_id, device_id):
+        h = _mix(account_id, device_id)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits = self.bits
+        for i in range(BLOOM_HASHES):
+            pos = (h1 + i * h2) % self.nbits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def first_use(self, account_id, device_id):
+        # Epoch microseconds of the account's first use of the device, or None
+        key = (account_id, device_id)
+        if self._last[0] == key:
+            return self._last[1]
+        first = self.added.get(key)
+        if not self._maybe_known(account_id, device_id):
+            self.bloom_negatives += 1
+        else:
+            self.exact_lookups += 1
+            lo = np.searchsorted(self.accounts, account_id, "left")
+            hi = np.searchsorted(self.accounts, account_id, "right")
+            i = lo + np.searchsorted(self.devices[lo:hi], device_id)
+            if i < hi and self.devices[i] == device_id:
+                first = int(self.first_seen[i]) if first is None else min(int(self.first_seen[i]), first)
+        self._last = (key, first)
+        return first
+
+    def seen_before(self, account_id, device_id, ts):
+        # Did the account use this device before ts?
+        first = self.first_use(account_id, device_id)
+        return first is not None and first < to_micros(ts)
+
+    def account_seen_before(self, account_id, ts):
+        # Did the account use any device before ts?
+        t = to_micros(ts)
+        added = self.added_accounts.get(account_id)
+        if added is not None and added < t:
+            return True
+        i = np.searchsorted(self.account_ids, account_id)
+        return bool(i < len(self.account_ids) and self.account_ids[i] == account_id and self.account_first[i] < t)
+
+    def add(self, account_id, device_id, ts):
+        # A use this process saw (e.g. ingest_service scores before it inserts);
+        # only kept when it is earlier than anything the index knows
+        t = to_micros(ts)
+        first = self.first_use(account_id, device_id)   # usually cached by the check just before
+        if first is None or t < first:
+            self.added[(account_id, device_id)] = t
+            if t < self.added_accounts.get(account_id, t + 1):
+                self.added_accounts[account_id] = t
+            self._last = ((account_id, device_id), t)
+
+    def __len__(self):
+        return len(self.accounts) + len(self.added)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or rebuild the account/device membership table.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute account_devices from the transactions table")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    cur = conn.cursor()
+    cur.execute(ACCOUNT_DEVICES_SQL)
+    if args.rebuild:
+        cur.execute("SELECT rebuild_account_devices()")
+        print(f"Rebuilt {cur.fetchone()[0]} account/device pairs.")
+    else:
+        install_account_devices(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+    print("account_devices is ready.")
@@ -0,0 +1,137 @@
+# account_state.py
+#
+# Compact per-account rolling state for the fraud triggers.
+# account_txn_state keeps, for every account, the last transaction time,
+# the last known location and event-time count / amount windows (1m, 10m,
+# 1h, 24h; see windows.py), so the velocity and geo checks are primary-key
+# lookups instead of scans over the account's transaction history.
+# The triggers installed by fraud_detect.py maintain it on every insert.
+#
+#   python account_state.py            # create table and functions
+#   python account_state.py --rebuild  # recompute the state from transactions
+
+import argparse
+import db
+from windows import FINEST_WIDTH, WINDOWS, install_windows
+
+ACCOUNT_STATE_SQL = f"""
+CREATE TABLE IF NOT EXISTS account_txn_state (
+    account_id     BIGINT PRIMARY KEY REFERENCES accounts(account_id) ON DELETE CASCADE,
+    last_txn_ts    TIMESTAMPTZ NOT NULL,
+    last_geo_ts    TIMESTAMPTZ,            -- time of the last txn that had coordinates
+    last_lat       DOUBLE PRECISION,
+    last_lng       DOUBLE PRECISION,
+    windows        txn_windows,            -- count / amount per event-time window
+    updated_at     TIMESTAMPTZ DEFAULT now()
+);
+
+-- Fold p_count transactions (p_amount in total) of one {FINEST_WIDTH} s bucket into an account's state
+CREATE OR REPLACE FUNCTION account_txn_state_push(
+    p_account_id BIGINT,
+    p_ts         TIMESTAMPTZ,
+    p_geo_ts     TIMESTAMPTZ,
+    p_lat        DOUBLE PRECISION,
+    p_lng        DOUBLE PRECISION,
+    p_amount     NUMERIC DEFAULT 0,
+    p_count      INT DEFAULT 1
+) RETURNS VOID LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO account_txn_state AS s
+        (account_id, last_txn_ts, last_geo_ts, last_lat, last_lng, windows)
+    VALUES (p_account_id, p_ts, p_geo_ts, p_lat, p_lng, txn_windows_push(NULL, p_ts, p_amount, p_count))
+    ON CONFLICT (account_id) DO UPDATE SET
+        last_txn_ts = GREATEST(s.last_txn_ts, EXCLUDED.last_txn_ts),
+        last_geo_ts = CASE WHEN EXCLUDED.last_geo_ts >= s.last_geo_ts OR s.last_geo_ts IS NULL
+                           THEN COALESCE(EXCLUDED.last_geo_ts, s.last_geo_ts) ELSE s.last_geo_ts END,
+        last_lat    = CASE WHEN EXCLUDED.last_geo_ts >= s.last_geo_ts
+                             OR (s.last_geo_ts IS NULL AND EXCLUDED.last_geo_ts IS NOT NULL)
+                           THEN EXCLUDED.last_lat ELSE s.last_lat END,
+        last_lng    = CASE WHEN EXCLUDED.last_geo_ts >= s.last_geo_ts
+                             OR (s.last_geo_ts IS NULL AND EXCLUDED.last_geo_ts IS NOT NULL)
+                           THEN EXCLUDED.last_lng ELSE s.last_lng END,
+        windows     = txn_windows_push(s.windows, p_ts, p_amount, p_count),
+        updated_at = now();
+END;
+$$;
+
+-- Recompute every account's state from the transactions table
+CREATE OR REPLACE FUNCTION rebuild_account_txn_state()
+RETURNS BIGINT LANGUAGE plpgsql AS $$
+DECLARE
+    n BIGINT;
+BEGIN
+    LOCK TABLE account_txn_state IN EXCLUSIVE MODE;
+    DELETE FROM account_txn_state;
+
+    INSERT INTO account_txn_state
+        (account_id, last_txn_ts, last_geo_ts, last_lat, last_lng, windows)
+    WITH last_txn AS (
+        SELECT account_id, MAX(txn_timestamp) AS last_ts
+        FROM transactions
+        GROUP BY account_id
+    ),
+    -- Finest buckets within the longest window of each account's last
+    -- transaction; anything older has left every ring
+    per_bucket AS (
+        SELECT t.account_id,
+               MAX(t.txn_timestamp) AS ts,
+               SUM(t.amount) AS amount,
+               COUNT(*)::INT AS txn_count
+        FROM transactions t
+        JOIN last_txn l ON l.account_id = t.account_id
+        WHERE t.txn_timestamp >= l.last_ts - INTERVAL '{max(w[1] for w in WINDOWS)} seconds'
+        GROUP BY t.account_id, floor(extract(epoch FROM t.txn_timestamp) / {FINEST_WIDTH})
+    ),
+    rings AS (
+        SELECT l.account_id, l.last_ts AS last_txn_ts, w.windows
+        FROM last_txn l
+        JOIN (SELECT account_id, txn_windows_agg(ts, amount, txn_count) AS windows
+              FROM per_bucket
+              GROUP BY account_id) w ON w.account_id = l.account_id
+    ),
+    last_geo AS (
+        SELECT DISTINCT ON (account_id) account_id, txn_timestamp, geo_lat, geo_lng
+        FROM transactions
+        WHERE geo_lat IS NOT NULL AND geo_lng IS NOT NULL
+        ORDER BY account_id, txn_timestamp DESC, txn_id DESC
+    )
+    SELECT r.account_id, r.last_txn_ts, g.txn_timestamp, g.geo_lat, g.geo_lng, r.windows
+    FROM rings r
+    LEFT JOIN last_geo g ON g.account_id = r.account_id;
+
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END;
+$$;
+"""
+
+
+def create_account_state(cur):
+    install_windows(cur)
+    cur.execute(ACCOUNT_STATE_SQL)
+
+
+def install_account_state(cur):
+    # Create the state table/functions; fill it if it is still empty
+    create_account_state(cur)
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM account_txn_state)")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT rebuild_account_txn_state()")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or rebuild the per-account rolling state.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute account_txn_state from the transactions table")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    cur = conn.cursor()
+    create_account_state(cur)
+    if args.rebuild:
+        cur.execute("SELECT rebuild_account_txn_state()")
+        print(f"Rebuilt state for {cur.fetchone()[0]} accounts.")
+    conn.commit()
+    cur.close()
+    conn.close()
+    print("account_txn_state is ready.")
@@ -0,0 +1,295 @@
+# alert_rollup.py
+#
+# Incrementally maintained alert counts per hour x severity x rule_id x
+# status (bucketed on created_at), replacing mv_fraud_by_day. Statement-level
+# triggers on fraud_alerts fold each INSERT / UPDATE / DELETE statement's
+# transition table into alert_rollup_hourly, so the table is always current
+# and the dashboard's time series read a few hundred rows.
+# alert_rollup_daily and fraud_by_day are views over the hourly table.
+# The same triggers keep alert counts and score sums per account
+# (alert_rollup_accounts) and alert counts per merchant
+# (alert_rollup_merchants), so the dashboard's summary and top accounts do
+# not scan fraud_alerts either. Merchant counts are not reduced for alerts
+# deleted together with their transaction (ON DELETE CASCADE: the merchant
+# can no longer be looked up); --rebuild recounts them.
+# Hours and days are cut in UTC whatever the session's TimeZone, so the
+# triggers, the backfill and the views always agree on the buckets.
+#
+# Backfill runs while the triggers are live. At install, alerts up to
+# backfill_boundary (max alert_id then) are left to the backfill; the triggers
+# count everything above it, plus every row the backfill has already passed
+# (alert_id <= backfilled_upto). The backfill takes each id range FOR SHARE,
+# so an UPDATE/DELETE of a row in that range is either seen by the backfill
+# in its final state or waits and is then counted by its trigger.
+#
+#   python alert_rollup.py              # install triggers, then backfill
+#   python alert_rollup.py --rebuild    # recount from scratch
+
+import argparse
+import db
+
+BACKFILL_BATCH = 50000   # alert_ids per backfill transaction
+
+ALERT_ROLLUP_SQL = """
+CREATE TABLE IF NOT EXISTS alert_rollup_hourly (
+    hour         TIMESTAMPTZ NOT NULL,     -- date_trunc('hour', created_at, 'UTC')
+    severity     TEXT NOT NULL,            -- '' when NULL
+    rule_id      TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    alert_count  BIGINT NOT NULL,
+    score_sum    NUMERIC NOT NULL,
+    PRIMARY KEY (hour, severity, rule_id, status)
+);
+
+-- Rows are kept at zero instead of deleted; readers skip alert_count = 0
+CREATE TABLE IF NOT EXISTS alert_rollup_accounts (
+    account_id   BIGINT PRIMARY KEY,
+    alert_count  BIGINT NOT NULL,
+    score_sum    NUMERIC NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alert_rollup_accounts_score ON alert_rollup_accounts (score_sum DESC);
+
+CREATE TABLE IF NOT EXISTS alert_rollup_merchants (
+    merchant_id  BIGINT PRIMARY KEY,
+    alert_count  BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS alert_rollup_progress (
+    id                 BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),   -- single row
+    backfill_boundary  BIGINT NOT NULL,   -- alerts above this are counted by the triggers
+    backfilled_upto    BIGINT NOT NULL,   -- backfill has counted alert_id <= this
+    updated_at         TIMESTAMPTZ DEFAULT now()
+);
+
+-- Add signed per-bucket deltas; buckets that drop to zero are removed
+-- (in a second statement: one statement cannot delete a row it has updated)
+CREATE OR REPLACE FUNCTION alert_rollup_apply(p_delta JSONB)
+RETURNS VOID LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO alert_rollup_hourly AS r (hour, severity, rule_id, status, alert_count, score_sum)
+    SELECT hour, severity, rule_id, status, alert_count, score_sum
+    FROM jsonb_to_recordset(p_delta)
+         AS d(hour TIMESTAMPTZ, severity TEXT, rule_id TEXT, status TEXT, alert_count BIGINT, score_sum NUMERIC)
+    ORDER BY 1, 2, 3, 4   -- same lock order in every transaction
+    ON CONFLICT (hour, severity, rule_id, status) DO UPDATE SET
+        alert_count = r.alert_count + EXCLUDED.alert_count,
+        score_sum   = r.score_sum + EXCLUDED.score_sum;
+
+    DELETE FROM alert_rollup_hourly r
+    USING jsonb_to_recordset(p_delta) AS d(hour TIMESTAMPTZ, severity TEXT, rule_id TEXT, status TEXT)
+    WHERE r.alert_count = 0
+      AND (r.hour, r.severity, r.rule_id, r.status) = (d.hour, d.severity, d.rule_id, d.status);
+END;
+$$;
+
+-- One function for the three statement triggers below. Transition tables
+-- only exist for their own event, so the change set is built per TG_OP.
+CREATE OR REPLACE FUNCTION trg_alert_rollup()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+DECLARE
+    boundary  BIGINT;
+    upto      BIGINT;
+    changes   TEXT;
+    delta     JSONB;
+    plus      TEXT := 'SELECT created_at, severity, rule_id, status, score, account_id, txn_id, 1 AS sign
+                       FROM new_alerts WHERE alert_id > $1 OR alert_id <= $2';
+    minus     TEXT := 'SELECT created_at, severity, rule_id, status, score, account_id, txn_id, -1 AS sign
+                       FROM old_alerts WHERE alert_id > $1 OR alert_id <= $2';
+BEGIN
+    SELECT backfill_boundary, backfilled_upto INTO boundary, upto FROM alert_rollup_progress;
+
+    changes := CASE TG_OP WHEN 'INSERT' THEN plus
+                          WHEN 'DELETE' THEN minus
+                          ELSE plus || ' UNION ALL ' || minus END;
+
+    -- Rows the backfill has not reached yet are counted by the backfill instead
+    EXECUTE format($q$
+        SELECT jsonb_agg(b)
+        FROM (
+            SELECT date_trunc('hour', created_at, 'UTC') AS hour,
+                   COALESCE(severity, '') AS severity,
+                   COALESCE(rule_id, '') AS rule_id,
+                   COALESCE(status, '') AS status,
+                   SUM(sign) AS alert_count,
+                   SUM(sign * COALESCE(score, 0)) AS score_sum
+            FROM (%s) changes
+            GROUP BY 1, 2, 3, 4
+            HAVING SUM(sign) <> 0 OR SUM(sign * COALESCE(score, 0)) <> 0
+        ) b
+    $q$, changes) INTO delta USING boundary, upto;
+
+    IF delta IS NOT NULL THEN
+        PERFORM alert_rollup_apply(delta);
+    END IF;
+
+    EXECUTE format($q$
+        INSERT INTO alert_rollup_accounts AS r (account_id, alert_count, score_sum)
+        SELECT account_id, SUM(sign), SUM(sign * COALESCE(score, 0))
+        FROM (%s) changes
+        GROUP BY 1
+        HAVING SUM(sign) <> 0 OR SUM(sign * COALESCE(score, 0)) <> 0
+        ORDER BY 1
+        ON CONFLICT (account_id) DO UPDATE SET
+            alert_count = r.alert_count + EXCLUDED.alert_count,
+            score_sum   = r.score_sum + EXCLUDED.score_sum
+    $q$, changes) USING boundary, upto;
+
+    -- Updates keep txn_id, so they cannot change the merchant counts
+    IF TG_OP <> 'UPDATE' THEN
+        EXECUTE format($q$
+            INSERT INTO alert_rollup_merchants AS r (merchant_id, alert_count)
+            SELECT t.merchant_id, SUM(changes.sign)
+            FROM (%s) changes
+            JOIN transactions t ON t.txn_id = changes.txn_id
+            WHERE t.merchant_id IS NOT NULL
+            GROUP BY 1
+            ORDER BY 1
+            ON CONFLICT (merchant_id) DO UPDATE SET alert_count = r.alert_count + EXCLUDED.alert_count
+        $q$, changes) USING boundary, upto;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE VIEW alert_rollup_daily AS
+SELECT date_trunc('day', hour, 'UTC') AS day, severity, rule_id, status,
+       SUM(alert_count) AS alert_count, SUM(score_sum) AS score_sum
+FROM alert_rollup_hourly
+GROUP BY 1, 2, 3, 4;
+
+-- Same columns as the old mv_fraud_by_day
+DROP MATERIALIZED VIEW IF EXISTS mv_fraud_by_day;
+CREATE OR REPLACE VIEW fraud_by_day AS
+SELECT date_trunc('day', hour, 'UTC') AS day,
+       SUM(alert_count) AS total_alerts,
+       SUM(alert_count) FILTER (WHERE severity IN ('high','critical')) AS high_severity
+FROM alert_rollup_hourly
+GROUP BY 1;
+"""
+
+# Transition tables need one trigger per event
+ROLLUP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS trg_alert_rollup_ins ON fraud_alerts;
+DROP TRIGGER IF EXISTS trg_alert_rollup_upd ON fraud_alerts;
+DROP TRIGGER IF EXISTS trg_alert_rollup_del ON fraud_alerts;
+
+CREATE TRIGGER trg_alert_rollup_ins
+AFTER INSERT ON fraud_alerts
+REFERENCING NEW TABLE AS new_alerts
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_alert_rollup();
+
+CREATE TRIGGER trg_alert_rollup_upd
+AFTER UPDATE ON fraud_alerts
+REFERENCING OLD TABLE AS old_alerts NEW TABLE AS new_alerts
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_alert_rollup();
+
+CREATE TRIGGER trg_alert_rollup_del
+AFTER DELETE ON fraud_alerts
+REFERENCING OLD TABLE AS old_alerts
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_alert_rollup();
+"""
+
+
+def install_alert_rollup(cur, rebuild=False):
+    # Create objects; on first install (or rebuild) start counting from an empty rollup
+    cur.execute(ALERT_ROLLUP_SQL)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM alert_rollup_progress)")
+    if rebuild or not cur.fetchone()[0]:
+        # Waits for in-flight alert writes, so every alert is either at or
+        # below the boundary or inserted after the triggers exist
+        cur.execute("LOCK TABLE fraud_alerts IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute("TRUNCATE alert_rollup_hourly, alert_rollup_accounts, alert_rollup_merchants")
+        cur.execute("""
+            INSERT INTO alert_rollup_progress(backfill_boundary, backfilled_upto)
+            SELECT COALESCE(max(alert_id), 0), 0 FROM fraud_alerts
+            ON CONFLICT (id) DO UPDATE SET
+                backfill_boundary = EXCLUDED.backfill_boundary,
+                backfilled_upto = 0, updated_at = now()
+        """)
+    cur.execute(ROLLUP_TRIGGERS_SQL)
+
+
+def backfill_alert_rollup(conn, batch=BACKFILL_BATCH):
+    # Count alert_id ranges up to the boundary; one committed transaction per range
+    cur = conn.cursor()
+    while True:
+        cur.execute("SELECT backfill_boundary, backfilled_upto FROM alert_rollup_progress FOR UPDATE")
+        boundary, upto = cur.fetchone()
+        if upto >= boundary:
+            conn.commit()
+            break
+        end = min(upto + batch, boundary)
+        cur.execute("""
+            WITH locked AS (
+                SELECT created_at, severity, rule_id, status, score
+                FROM fraud_alerts
+                WHERE alert_id > %s AND alert_id <= %s
+                FOR SHARE
+            )
+            SELECT alert_rollup_apply(jsonb_agg(b))
+            FROM (
+                SELECT date_trunc('hour', created_at, 'UTC') AS hour,
+                       COALESCE(severity, '') AS severity,
+                       COALESCE(rule_id, '') AS rule_id,
+                       COALESCE(status, '') AS status,
+                       COUNT(*) AS alert_count,
+                       SUM(COALESCE(score, 0)) AS score_sum
+                FROM locked
+                GROUP BY 1, 2, 3, 4
+            ) b
+            HAVING COUNT(*) > 0
+        """, (upto, end))
+        # The range is locked FOR SHARE by the statement above
+        cur.execute("""
+            INSERT INTO alert_rollup_accounts AS r (account_id, alert_count, score_sum)
+            SELECT account_id, COUNT(*), SUM(COALESCE(score, 0))
+            FROM fraud_alerts
+            WHERE alert_id > %s AND alert_id <= %s
+            GROUP BY 1
+            ORDER BY 1
+            ON CONFLICT (account_id) DO UPDATE SET
+                alert_count = r.alert_count + EXCLUDED.alert_count,
+                score_sum   = r.score_sum + EXCLUDED.score_sum
+        """, (upto, end))
+        cur.execute("""
+            INSERT INTO alert_rollup_merchants AS r (merchant_id, alert_count)
+            SELECT t.merchant_id, COUNT(*)
+            FROM fraud_alerts fa
+            JOIN transactions t ON t.txn_id = fa.txn_id
+            WHERE fa.alert_id > %s AND fa.alert_id <= %s AND t.merchant_id IS NOT NULL
+            GROUP BY 1
+            ORDER BY 1
+            ON CONFLICT (merchant_id) DO UPDATE SET alert_count = r.alert_count + EXCLUDED.alert_count
+        """, (upto, end))
+        cur.execute("UPDATE alert_rollup_progress SET backfilled_upto = %s, updated_at = now()", (end,))
+        conn.commit()
+        print(f"Backfilled alerts up to alert_id {end} / {boundary}")
+    cur.close()
+
+
+def alert_rollup_ready(cur):
+    # True once the rollup exists and the backfill has finished
+    cur.execute("SELECT to_regclass('alert_rollup_progress') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute("SELECT COALESCE(bool_and(backfilled_upto >= backfill_boundary), FALSE) FROM alert_rollup_progress")
+    return cur.fetchone()[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Install and backfill the incremental alert rollup.")
+    parser.add_argument("--rebuild", action="store_true", help="discard the rollup and recount all alerts")
+    parser.add_argument("--batch", type=int, default=BACKFILL_BATCH, help="alert_ids per backfill transaction")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    cur = conn.cursor()
+    install_alert_rollup(cur, rebuild=args.rebuild)
+    conn.commit()
+    cur.close()
+    backfill_alert_rollup(conn, args.batch)
+    conn.close()
+    print("alert_rollup_hourly is up to date.")
@@ -0,0 +1,134 @@
+# alert_sink.py
+#
+# Buffered writer for fraud_alerts, shared by the batch detectors.
+# Alerts are collected in memory and written in one round trip per flush
+# (COPY ... FROM STDIN, a multi-row INSERT via execute_values, or the
+# prepared insert_alert statement from db.py), and each flush is committed,
+# so a crash loses at most one buffer of alerts.
+# Every method upserts on the alert key (db.ALERT_ON_CONFLICT), so rerunning
+# or resuming a detector over the same transactions adds no duplicates; COPY
+# goes through a temp staging table to get there.
+# Give the writer its own connection when the caller keeps a long-running
+# read transaction (server-side cursor, locked detector_state row) open.
+
+import csv
+import io
+import time
+from contextlib import nullcontext
+
+import psycopg2.extras
+
+import db
+import metrics
+from dedupe_alerts import has_alert_key
+
+ALERT_COLUMNS = db.ALERT_INSERT_COLUMNS
+
+# COPY cannot resolve conflicts: copy into a per-session temp table, then
+# insert from it in key order (one row per key, so DO UPDATE never meets the
+# same alert twice, and concurrent writers lock rows in the same order)
+ALERT_STAGE_SQL = f"""
+CREATE TEMP TABLE IF NOT EXISTS fraud_alerts_stage ON COMMIT DELETE ROWS AS
+SELECT {', '.join(ALERT_COLUMNS)} FROM fraud_alerts WITH NO DATA
+"""
+ALERT_FROM_STAGE_SQL = f"""
+INSERT INTO fraud_alerts({', '.join(ALERT_COLUMNS)})
+SELECT DISTINCT ON ({', '.join(db.ALERT_KEY)}) {', '.join(ALERT_COLUMNS)}
+FROM fraud_alerts_stage
+ORDER BY {', '.join(db.ALERT_KEY)}
+{db.ALERT_ON_CONFLICT}
+"""
+
+
+class AlertWriter:
+
+    def __init__(self, conn, flush_size=5000, flush_interval=5.0, method="copy", timer=None):
+        if method not in ("copy", "values", "prepared"):
+            raise ValueError(f"Unknown alert write method: {method}")
+        self.conn = conn
+        self.cur = conn.cursor()
+        if not has_alert_key(self.cur):
+            raise SystemExit("fraud_alerts has no unique alert key: run python dedupe_alerts.py first")
+        self.conn.commit()
+        self.staged = False   # fraud_alerts_stage created on this connection
+        self.flush_size = flush_size            # alerts per flush
+        self.flush_interval = flush_interval    # seconds between flushes
+        self.method = method
+        self.timer = timer                      # optional StageTimer: flushes count as "write"
+        self.buffer = []
+        self.flushes = 0
+        self.alerts_written = 0
+        self.flush_seconds = 0.0
+        self.last_flush = time.monotonic()
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self.buffer), "alert_buffer")
+
+    def add(self, txn_id, txn_timestamp, account_id, rule_id, reason, severity, score, status="new"):
+        # txn_timestamp is the partition key of fraud_alerts (see partition_manager.py)
+        self.buffer.append((txn_id, txn_timestamp, account_id, rule_id, reason, severity, score, status))
+        if (len(self.buffer) >= self.flush_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            # Last alert per key, in key order
+            rows = sorted({(r[0], r[3], r[1]): r for r in self.buffer}.values(), key=lambda r: (r[0], r[3], r[1]))
+            start = time.perf_counter()
+            with self.timer.stage("write") if self.timer else nullcontext(), metrics.timed(f"alert_{self.method}"):
+                if self.method == "copy":
+                    written = self._copy(rows)
+                elif self.method == "prepared":
+                    # execute_batch only reports the last page's rowcount:
+                    # count what was sent, summary() labels it "attempted"
+                    db.execute_prepared_batch(self.cur, "insert_alert", rows)
+                    written = len(rows)
+                else:
+                    psycopg2.extras.execute_values(
+                        self.cur,
+                        f"INSERT INTO fraud_alerts({', '.join(ALERT_COLUMNS)}) VALUES %s {db.ALERT_ON_CONFLICT}",
+                        rows,
+                        page_size=len(rows),
+                    )
+                    written = self.cur.rowcount
+                self.conn.commit()
+            self.flush_seconds += time.perf_counter() - start
+            self.flushes += 1
+            # Inserted or changed by the upsert (copy / values); reruns of
+            # unchanged alerts add nothing
+            self.alerts_written += written
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def _copy(self, rows):
+        if not self.staged:
+            self.cur.execute(ALERT_STAGE_SQL)
+            self.staged = True
+        data = io.StringIO()
+        csv.writer(data).writerows(rows)
+        data.seek(0)
+        self.cur.copy_expert(
+            f"COPY fraud_alerts_stage({', '.join(ALERT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            data,
+        )
+        self.cur.execute(ALERT_FROM_STAGE_SQL)
+        return self.cur.rowcount
+
+    def close(self):
+        self.flush()
+        self.cur.close()
+
+    def summary(self):
+        avg_ms = self.flush_seconds / self.flushes * 1000 if self.flushes else 0.0
+        written = "attempted" if self.method == "prepared" else "written"
+        return (f"{self.alerts_written} alerts {written} in {self.flushes} flushes "
+                f"({self.flush_seconds:.2f}s total, {avg_ms:.1f} ms/flush, method={self.method})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.rollback()
+            self.cur.close()
@@ -0,0 +1,51 @@
+# alert_watermark.py
+#
+# Cheap change marker for fraud_alerts, used by dashboard.py to decide
+# whether its cached queries are stale. New alerts raise max(alert_id);
+# status changes raise max(updated_at), which a trigger keeps current.
+# Both maxima are single index probes, however large the table is.
+#
+# Also creates the (created_at, alert_id) indexes the dashboard's
+# keyset-paginated alert tables walk.
+#
+#   python alert_watermark.py   # install trigger and indexes
+
+import db
+
+ALERT_WATERMARK_SQL = """
+CREATE OR REPLACE FUNCTION fraud_alerts_touch_updated_at()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW IS DISTINCT FROM OLD THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_fraud_alerts_updated_at ON fraud_alerts;
+CREATE TRIGGER trg_fraud_alerts_updated_at
+BEFORE UPDATE ON fraud_alerts
+FOR EACH ROW
+EXECUTE FUNCTION fraud_alerts_touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_alert_updated_at ON fraud_alerts(updated_at);
+CREATE INDEX IF NOT EXISTS idx_alert_created_keyset ON fraud_alerts(created_at DESC, alert_id DESC);
+CREATE INDEX IF NOT EXISTS idx_alert_severity_created ON fraud_alerts(severity, created_at DESC, alert_id DESC);
+"""
+
+
+def read_alert_watermark(cur):
+    # (max alert_id, max updated_at); changes whenever an alert is added or updated
+    cur.execute("SELECT (SELECT max(alert_id) FROM fraud_alerts), (SELECT max(updated_at) FROM fraud_alerts)")
+    return cur.fetchone()
+
+
+if __name__ == "__main__":
+    conn = db.connect()
+    cur = conn.cursor()
+    cur.execute(ALERT_WATERMARK_SQL)
+    conn.commit()
+    cur.close()
+    conn.close()
+    print("fraud_alerts watermark trigger and indexes are ready.")
@@ -1,163 +1,293 @@
 # insert_bulk_test_txns.py
-import psycopg2
-import psycopg2.extras
-import random
-import json
-from datetime import datetime, timedelta
+#
+# Scenario generator for fraud testing: high-value, velocity bursts, geo
+# mismatch, new device, Gambling/Crypto merchants and random filler.
+# Rows are built in NumPy batches from precomputed value pools (Faker is
+# only used to fill the pools), chunk by chunk in worker processes. Every
+# chunk has its own seed derived from --seed, so the output is the same
+# for any --workers value.
+#
+# Each row carries metadata {"note": <scenario>, "gen_row": "<seed>-<n>"};
+# --labels writes the ground truth per gen_row (scenario and the rule it
+# is meant to fire), which joins back on metadata->>'gen_row'.
+#
+#   python all_fraud_data.py                                    # 60 rows into the DB
+#   python all_fraud_data.py --rows 10000000 --workers 8 --seed 7 --labels labels.csv
+#   python all_fraud_data.py --rows 1000000 --out txns.csv      # COPY later
+#   python all_fraud_data.py --rows 1000000 --out - | psql -c "\copy transactions(...) FROM STDIN CSV"
+import argparse
+import io
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+import db
 from faker import Faker
-fake = Faker()
 
 # ---------- CONFIG ----------
-DB = {
-    "host": "localhost",
-    "database": "postgres",   # change if you use a different DB name
-    "user": "postgres",
-    "password": "Paused.0"    # change to your password
-}
 NUM_RANDOM = 60   # total transactions to insert (adjust as needed)
+CHUNK_ROWS = 250000   # rows generated per task
+POOL_SIZE = 5000      # distinct fake locations / IPs
+
+# Share of each injected scenario among the fraud rows (the original mix:
+# 8 high-value, 6 bursts of 4, 6 geo pairs, 6 new-device, 8 merchant rows)
+SCENARIO_MIX = {
+    "test_high_value": 8,
+    "test_velocity": 24,
+    "geo_mismatch": 12,
+    "possible_new_device": 6,
+    "suspicious_merchant": 8,
+}
+# Fraction of rows that belong to an injected scenario: 58 of the original
+# 60, so the default run still writes the 58 scenario rows plus 2 random ones
+FRAUD_SHARE = sum(SCENARIO_MIX.values()) / NUM_RANDOM
+EXPECTED_RULE = {
+    "test_high_value": "HIGH_VALUE",
+    "test_velocity": "VELOCITY",
+    "geo_mismatch": "GEO_MISMATCH",
+    "possible_new_device": "NEW_DEVICE",
+    "suspicious_merchant": "SUSPICIOUS_MERCHANT",
+    "random": "",
+}
+TXN_COLUMNS = ["account_id", "merchant_id", "device_id", "amount", "txn_timestamp", "channel",
+               "location", "ip_address", "geo_lat", "geo_lng", "merchant_category", "metadata"]
 # ----------------------------
 
-conn = psycopg2.connect(**DB)
-cur = conn.cursor()
-
-# fetch valid ids
-cur.execute("SELECT account_id FROM accounts")
-account_ids = [r[0] for r in cur.fetchall()]
-if not account_ids:
-    raise SystemExit("No accounts found — create accounts first.")
-
-cur.execute("SELECT merchant_id, category FROM merchants")
-merchants = cur.fetchall()
-if not merchants:
-    raise SystemExit("No merchants found — create merchants first.")
-merchant_ids = [r[0] for r in merchants]
-merchant_cat_map = {r[0]: r[1] for r in merchants}
-
-cur.execute("SELECT device_id FROM devices")
-device_ids = [r[0] for r in cur.fetchall()]
-if not device_ids:
-    raise SystemExit("No devices found — create devices first.")
-
-print(f"Found {len(account_ids)} accounts, {len(merchant_ids)} merchants, {len(device_ids)} devices.")
-
-# helper to pick random existing IDs
-def pick_account():
-    return random.choice(account_ids)
-
-def pick_merchant():
-    return random.choice(merchant_ids)
-
-def pick_device():
-    return random.choice(device_ids)
-
-insert_query = """
-INSERT INTO transactions(
-    account_id, merchant_id, device_id, amount, txn_timestamp,
-    channel, location, ip_address, geo_lat, geo_lng, merchant_category, metadata
-) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);
-"""
-
-txns = []
-
-# 1) Add some high-value txns (to trigger HIGH_VALUE)
-for _ in range(8):
-    acct = pick_account()
-    mid = pick_merchant()
-    dev = pick_device()
-    amount = random.uniform(120000, 500000)  # >100k
-    ts = datetime.now() - timedelta(minutes=random.randint(0, 120))
-    city = fake.city()
-    country = fake.country()
-    lat = float(fake.latitude())
-    lng = float(fake.longitude())
-    cat = merchant_cat_map.get(mid) or random.choice(['Retail','Travel','Electronics','Food','Health'])
-    meta = {"note":"test_high_value"}
-    txns.append((acct, mid, dev, round(amount,2), ts, random.choice(['atm','pos','web','mobile']), f"{city}, {country}",
-                 fake.ipv4_public(), lat, lng, cat, json.dumps(meta)))
-
-# 2) Create velocity bursts (multiple txns for same account within short window)
-for _ in range(6):
-    acct = pick_account()
-    mid = pick_merchant()
-    dev = pick_device()
-    # create 4 quick txns for this account
-    base_time = datetime.now() - timedelta(minutes=random.randint(0,60))
-    for k in range(4):
-        amount = random.uniform(100, 8000)
-        ts = base_time + timedelta(minutes=k*2)  # 2 minutes apart
-        city = fake.city(); country = fake.country()
-        lat = float(fake.latitude()); lng = float(fake.longitude())
-        cat = merchant_cat_map.get(mid) or random.choice(['Retail','Travel'])
-        meta = {"note":"test_velocity"}
-        txns.append((acct, mid, dev, round(amount,2), ts, 'pos', f"{city}, {country}",
-                     fake.ipv4_public(), lat, lng, cat, json.dumps(meta)))
-
-# 3) Geo-mismatch: insert two txns for same account far apart
-for _ in range(6):
-    acct = pick_account()
-    mid = pick_merchant()
-    dev = pick_device()
-    # first txn at one location
-    ts1 = datetime.now() - timedelta(hours=5)
-    lat1, lng1 = 12.9716, 77.5946   # e.g., Bangalore
-    txns.append((acct, mid, dev, round(random.uniform(100,5000),2), ts1, 'web', "Bangalore, IN",
-                 fake.ipv4_public(), lat1, lng1, 'Retail', json.dumps({"note":"geo1"})))
-    # second txn quickly from a far location (simulate > 500km apart)
-    ts2 = ts1 + timedelta(minutes=30)
-    lat2, lng2 = 28.7041, 77.1025   # e.g., Delhi (far)
-    txns.append((acct, mid, dev, round(random.uniform(100,5000),2), ts2, 'web', "Delhi, IN",
-                 fake.ipv4_public(), lat2, lng2, 'Retail', json.dumps({"note":"geo2"})))
-
-# 4) New device: choose an account but a device id not used earlier for that account
-# We can't easily check device history here; instead create txns where device_id is a likely new one:
-for _ in range(6):
-    acct = pick_account()
-    mid = pick_merchant()
-    # create a new device id (temporary) by generating a large number not in device_ids
-    # but to avoid FK error, we need existing device ids — instead pick a device and mark it suspicious via metadata
-    dev = pick_device()
-    ts = datetime.now() - timedelta(minutes=random.randint(0,200))
-    lat = float(fake.latitude()); lng = float(fake.longitude())
-    txns.append((acct, mid, dev, round(random.uniform(50,8000),2), ts, 'mobile', fake.city()+", "+fake.country(),
-                 fake.ipv4_public(), lat, lng, 'Retail', json.dumps({"note":"possible_new_device"})))
-
-# 5) Suspicious merchant categories (Gambling/Crypto)
-# If you don't have merchants with such categories, we set merchant_category explicitly
-for _ in range(8):
-    acct = pick_account()
-    mid = pick_merchant()
-    dev = pick_device()
-    amount = random.uniform(500,20000)
-    ts = datetime.now() - timedelta(minutes=random.randint(0,1440))
-    lat = float(fake.latitude()); lng = float(fake.longitude())
-    cat = random.choice(['Gambling','Crypto'])
-    txns.append((acct, mid, dev, round(amount,2), ts, random.choice(['web','pos']), fake.city()+", "+fake.country(),
-                 fake.ipv4_public(), lat, lng, cat, json.dumps({"note":"suspicious_merchant"})))
-
-# 6) Fill remaining transactions randomly until NUM_RANDOM
-while len(txns) < NUM_RANDOM:
-    acct = pick_account()
-    mid = pick_merchant()
-    dev = pick_device()
-    amount = random.uniform(10,50000)
-    ts = datetime.now() - timedelta(minutes=random.randint(0,10000))
-    lat = float(fake.latitude()); lng = float(fake.longitude())
-    cat = merchant_cat_map.get(mid) or random.choice(['Retail','Food','Electronics'])
-    txns.append((acct, mid, dev, round(amount,2), ts, random.choice(['atm','pos','web','mobile']),
-                 fake.city()+", "+fake.country(), fake.ipv4_public(), lat, lng, cat, json.dumps({"note":"random"})))
-
-# Shuffle for randomness
-random.shuffle(txns)
-
-# Bulk insert
-print(f"Inserting {len(txns)} transactions...")
-psycopg2.extras.execute_batch(cur, insert_query, txns, page_size=200)
-conn.commit()
-print("Insert complete.")
-
-# optionally display number of alerts after insert
-cur.execute("SELECT count(*) FROM fraud_alerts;")
-print("Total fraud alerts now:", cur.fetchone()[0])
-
-cur.close()
-conn.close()
+parser = argparse.ArgumentParser(description="Generate fraud-scenario transactions.")
+parser.add_argument("--rows", type=int, default=NUM_RANDOM)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--workers", type=int, default=1)
+parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+parser.add_argument("--fraud-share", type=float, default=FRAUD_SHARE,
+                    help="fraction of rows that are injected fraud scenarios")
+parser.add_argument("--anchor", type=datetime.fromisoformat,
+                    help="timestamp the scenarios are placed before (default: now); fix it for reproducible output")
+parser.add_argument("--out", help="write COPY-ready CSV here ('-' for stdout) instead of loading the DB")
+parser.add_argument("--labels", help="write the ground-truth labels CSV here")
+
+
+# ---------------------------
+# 1️⃣ Value pools
+# ---------------------------
+def load_pools(cur, seed):
+    # fetch valid ids
+    cur.execute("SELECT account_id FROM accounts")
+    account_ids = np.array([r[0] for r in cur.fetchall()], dtype=np.int64)
+    if not account_ids.size:
+        raise SystemExit("No accounts found — create accounts first.")
+
+    cur.execute("SELECT merchant_id, category FROM merchants ORDER BY merchant_id")
+    merchants = cur.fetchall()
+    if not merchants:
+        raise SystemExit("No merchants found — create merchants first.")
+
+    cur.execute("SELECT device_id FROM devices")
+    device_ids = np.array([r[0] for r in cur.fetchall()], dtype=np.int64)
+    if not device_ids.size:
+        raise SystemExit("No devices found — create devices first.")
+
+    fake = Faker()
+    Faker.seed(seed)
+    return {
+        "account_ids": np.sort(account_ids),
+        "merchant_ids": np.array([m[0] for m in merchants], dtype=np.int64),
+        "merchant_cats": np.array([m[1] or "Retail" for m in merchants], dtype=object),
+        "device_ids": np.sort(device_ids),
+        "locations": np.array([f"{fake.city()}, {fake.country()}" for _ in range(POOL_SIZE)], dtype=object),
+        "ips": np.array([fake.ipv4_public() for _ in range(POOL_SIZE)], dtype=object),
+    }
+
+
+# ---------------------------
+# 2️⃣ Scenario builders
+# ---------------------------
+# Each builder returns a dict of column arrays for n rows; times are
+# minutes before the anchor, so the rows only depend on the seed.
+def _base(rng, pools, n, minutes_back):
+    midx = rng.integers(0, len(pools["merchant_ids"]), n)
+    return {
+        "account_id": rng.choice(pools["account_ids"], n),
+        "merchant_id": pools["merchant_ids"][midx],
+        "device_id": rng.choice(pools["device_ids"], n),
+        "minutes_ago": rng.integers(0, minutes_back + 1, n).astype(float),
+        "channel": rng.choice(np.array(["atm", "pos", "web", "mobile"], dtype=object), n),
+        "location": rng.choice(pools["locations"], n),
+        "ip_address": rng.choice(pools["ips"], n),
+        "geo_lat": rng.uniform(-90, 90, n).round(6),
+        "geo_lng": rng.uniform(-180, 180, n).round(6),
+        "merchant_category": pools["merchant_cats"][midx],
+    }
+
+def high_value(rng, pools, n):
+    rows = _base(rng, pools, n, 120)
+    rows["amount"] = rng.uniform(120000, 500000, n)  # >100k
+    return rows
+
+def velocity_bursts(rng, pools, n):
+    # bursts of 4 txns, 2 minutes apart, same account/merchant/device
+    bursts = n // 4
+    rows = {k: np.repeat(v, 4) for k, v in _base(rng, pools, bursts, 60).items()}
+    rows["minutes_ago"] -= np.tile(np.arange(4) * 2.0, bursts)
+    rows["channel"][:] = "pos"
+    rows["amount"] = rng.uniform(100, 8000, bursts * 4)
+    return rows
+
+def geo_mismatch(rng, pools, n):
+    # Bangalore, then Delhi (> 500 km) 30 minutes later
+    pairs = n // 2
+    rows = {k: np.repeat(v, 2) for k, v in _base(rng, pools, pairs, 0).items()}
+    rows["minutes_ago"] += 300 - np.tile([0.0, 30.0], pairs) + np.repeat(rng.integers(0, 60, pairs), 2)
+    rows["channel"][:] = "web"
+    rows["location"] = np.tile(np.array(["Bangalore, IN", "Delhi, IN"], dtype=object), pairs)
+    rows["geo_lat"] = np.tile([12.9716, 28.7041], pairs)
+    rows["geo_lng"] = np.tile([77.5946, 77.1025], pairs)
+    rows["merchant_category"][:] = "Retail"
+    rows["amount"] = rng.uniform(100, 5000, pairs * 2)
+    return rows
+
+def new_device(rng, pools, n):
+    # Device ids must exist (FK), so the account gets one it has most likely never used
+    rows = _base(rng, pools, n, 200)
+    rows["channel"][:] = "mobile"
+    rows["merchant_category"][:] = "Retail"
+    rows["amount"] = rng.uniform(50, 8000, n)
+    return rows
+
+def suspicious_merchant(rng, pools, n):
+    rows = _base(rng, pools, n, 1440)
+    rows["channel"] = rng.choice(np.array(["web", "pos"], dtype=object), n)
+    rows["merchant_category"] = rng.choice(np.array(["Gambling", "Crypto"], dtype=object), n)
+    rows["amount"] = rng.uniform(500, 20000, n)
+    return rows
+
+def random_filler(rng, pools, n):
+    rows = _base(rng, pools, n, 10000)
+    rows["amount"] = rng.uniform(10, 50000, n)
+    return rows
+
+BUILDERS = {
+    "test_high_value": high_value,
+    "test_velocity": velocity_bursts,
+    "geo_mismatch": geo_mismatch,
+    "possible_new_device": new_device,
+    "suspicious_merchant": suspicious_merchant,
+}
+
+
+def scenario_counts(n_rows, fraud_share):
+    # Exact fractions, so float rounding never drops a row (or a burst) at the defaults
+    share = Fraction(fraud_share).limit_denominator(10 ** 6)
+    total_weight = sum(SCENARIO_MIX.values())
+    counts = {}
+    for name, weight in SCENARIO_MIX.items():
+        group = {"test_velocity": 4, "geo_mismatch": 2}.get(name, 1)
+        counts[name] = int(n_rows * share * weight / (total_weight * group)) * group
+    counts["random"] = n_rows - sum(counts.values())
+    return counts
+
+
+# ---------------------------
+# 3️⃣ Build one chunk
+# ---------------------------
+_pools = None
+
+def _init_worker(pools):
+    global _pools
+    _pools = pools
+
+def build_chunk(chunk_no, first_row, n_rows, seed, fraud_share, anchor):
+    # Returns (transactions CSV, labels CSV) for rows first_row .. first_row + n_rows - 1
+    rng = np.random.default_rng(np.random.SeedSequence([seed, chunk_no]))
+    parts = []
+    for name, count in scenario_counts(n_rows, fraud_share).items():
+        if count:
+            rows = BUILDERS.get(name, random_filler)(rng, _pools, count)
+            rows["note"] = np.full(len(rows["amount"]), name, dtype=object)
+            parts.append(pd.DataFrame(rows))
+    df = pd.concat(parts, ignore_index=True)
+    df = df.iloc[rng.permutation(len(df))].reset_index(drop=True)   # Shuffle for randomness
+
+    df["gen_row"] = f"{seed}-" + pd.Series(np.arange(first_row, first_row + len(df))).astype(str)
+    df["amount"] = df["amount"].round(2)
+    # anchor is UTC; NumPy formats datetimes much faster than pandas' to_csv does
+    txn_times = np.datetime64(anchor.replace(tzinfo=None), "s") - (df["minutes_ago"].to_numpy() * 60).astype("timedelta64[s]")
+    df["txn_timestamp"] = np.char.add(np.datetime_as_string(txn_times, unit="s"), "+00:00").astype(object)
+    df["metadata"] = '{"note": "' + df["note"] + '", "gen_row": "' + df["gen_row"] + '"}'
+
+    txn_csv = df[TXN_COLUMNS].to_csv(index=False, header=False)
+    df["expected_rule"] = df["note"].map(EXPECTED_RULE)
+    label_csv = df[["gen_row", "note", "expected_rule", "account_id", "txn_timestamp"]].to_csv(
+        index=False, header=False)
+    return txn_csv, label_csv
+
+
+def generate(pools, args, anchor):
+    # Yields chunk CSVs in order; at most 2 chunks per worker are in flight
+    chunks = [(i, start, min(args.chunk_rows, args.rows - start))
+              for i, start in enumerate(range(0, args.rows, args.chunk_rows))]
+    if args.workers <= 1:
+        _init_worker(pools)
+        for chunk_no, start, n in chunks:
+            yield build_chunk(chunk_no, start, n, args.seed, args.fraud_share, anchor)
+        return
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(pools,)) as pool:
+        pending = deque()
+        for chunk_no, start, n in chunks:
+            pending.append(pool.submit(build_chunk, chunk_no, start, n, args.seed, args.fraud_share, anchor))
+            if len(pending) >= args.workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ---------------------------
+# 4️⃣ Write / load
+# ---------------------------
+if __name__ == "__main__":
+    args = parser.parse_args()
+    anchor = (args.anchor or datetime.now()).astimezone(timezone.utc)
+
+    conn = db.connect()
+    cur = conn.cursor()
+    pools = load_pools(cur, args.seed)
+    print(f"Found {len(pools['account_ids'])} accounts, {len(pools['merchant_ids'])} merchants, "
+          f"{len(pools['device_ids'])} devices.", file=sys.stderr)
+
+    out = None
+    if args.out:
+        out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    labels = open(args.labels, "w", newline="") if args.labels else None
+    if labels:
+        labels.write("gen_row,scenario,expected_rule,account_id,txn_timestamp\n")
+
+    copy_sql = f"COPY transactions({', '.join(TXN_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    written = 0
+    for txn_csv, label_csv in generate(pools, args, anchor):
+        if out:
+            out.write(txn_csv)
+        else:
+            # one COPY per chunk, so a statement-level trigger scores each chunk at once
+            cur.copy_expert(copy_sql, io.StringIO(txn_csv))
+            conn.commit()
+        if labels:
+            labels.write(label_csv)
+        written += txn_csv.count("\n")
+        print(f"{written} / {args.rows} transactions", file=sys.stderr)
+
+    if out and out is not sys.stdout:
+        out.close()
+    if labels:
+        labels.close()
+
+    if not out:
+        print("Insert complete.")
+        # optionally display number of alerts after insert
+        cur.execute("SELECT count(*) FROM fraud_alerts;")
+        print("Total fraud alerts now:", cur.fetchone()[0])
+
+    cur.close()
+    conn.close()
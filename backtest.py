@@ -0,0 +1,436 @@
+# backtest.py
+#
+# Offline rule tuning. Replays a columnar snapshot of transactions through
+# a rules.json profile with the thresholds swept over a grid, and reports
+# per config how many alerts each rule would raise and how they line up
+# with analyst labels (fraud_alerts rows marked confirmed / dismissed).
+# Nothing is written to the database; `run` does not even connect.
+#
+#   python backtest.py snapshot --out snapshots/2025-10-18     # once, from the database
+#   python backtest.py run --snapshot snapshots/2025-10-18 --profile fraud_alerts \
+#       --grid HIGH_VALUE.threshold=500000,1000000 --grid VELOCITY.min_count=3,4,5 \
+#       --grid context.history_size=5,10 --workers 4 --out sweep.json
+#
+# The snapshot is Arrow IPC (memory-mapped, so each worker process maps the
+# same pages instead of loading its own copy). A Parquet file, or an
+# export_parquet.py directory (then the labels come from its fraud_alerts),
+# works as well:
+#   python backtest.py run --snapshot exports --grid VELOCITY.window_minutes=10,30
+# Rules are evaluated a whole column at a time, with the per-account
+# context of rules.py (history size, same-timestamp visibility, missing
+# coordinates) reproduced on the sorted arrays, so the alert decisions match
+# what the detectors would write for the same data.
+
+import argparse
+import copy
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from export_parquet import MANIFEST, copy_batches, select_list
+from geo_distance import distances_km
+from rules import RULES_CONFIG, profile_config
+from windows import WINDOW_NAMES, WINDOWS
+
+TXN_SNAPSHOT = "transactions.arrow"
+LABEL_SNAPSHOT = "alert_labels.arrow"
+LABEL_STATUSES = ("confirmed", "dismissed")
+
+TXN_SCHEMA = pa.schema([
+    ("txn_id", pa.int64()),
+    ("account_id", pa.int64()),
+    ("amount", pa.float64()),
+    ("txn_timestamp", pa.timestamp("us", tz="UTC")),
+    ("geo_lat", pa.float64()),
+    ("geo_lng", pa.float64()),
+    ("device_id", pa.int64()),
+])
+LABEL_SCHEMA = pa.schema([
+    ("txn_id", pa.int64()),
+    ("rule_id", pa.string()),
+    ("status", pa.string()),
+])
+
+
+# ---------------------------
+# 1️⃣ Snapshot
+# ---------------------------
+def copy_to_arrow(cur, query, schema, path):
+    # Stream COPY output (export_parquet.copy_batches) into an Arrow IPC file
+    rows = 0
+    tmp = f"{path}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, ipc.new_file(sink, schema) as writer:
+        for batch in copy_batches(cur, query, schema):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(tmp, path)
+    return rows
+
+
+def snapshot(args):
+    import db   # only this subcommand touches the database
+    os.makedirs(args.out, exist_ok=True)
+    conn = db.connect()
+    cur = conn.cursor()
+    # One repeatable-read transaction, so the labels match the transactions
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    start = time.perf_counter()
+    n_txns = copy_to_arrow(cur, f"SELECT {select_list(TXN_SCHEMA)} FROM transactions",
+                           TXN_SCHEMA, os.path.join(args.out, TXN_SNAPSHOT))
+    n_labels = copy_to_arrow(cur, f"SELECT {select_list(LABEL_SCHEMA)} FROM fraud_alerts "
+                                  f"WHERE status IN ('confirmed', 'dismissed')",
+                             LABEL_SCHEMA, os.path.join(args.out, LABEL_SNAPSHOT))
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"Snapshot {args.out}: {n_txns} transactions, {n_labels} labelled alerts "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def read_table(path):
+    # Arrow IPC is memory-mapped (zero copy); Parquet is decoded from a mapped file
+    if path.endswith(".parquet"):
+        return pq.read_table(path, memory_map=True)
+    return ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def load_snapshot(path):
+    # A snapshot directory, an export_parquet.py directory, or a single
+    # transactions file (then without labels)
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        txns = pq.read_table(os.path.join(path, "transactions"), columns=TXN_SCHEMA.names, memory_map=True)
+        alerts = os.path.join(path, "fraud_alerts")
+        labels = (pq.read_table(alerts, columns=LABEL_SCHEMA.names, memory_map=True,
+                                filters=[("status", "in", LABEL_STATUSES)])
+                  if os.path.isdir(alerts) else None)
+        return txns, labels
+    if os.path.isdir(path):
+        txns = read_table(os.path.join(path, TXN_SNAPSHOT))
+        label_path = os.path.join(path, LABEL_SNAPSHOT)
+        labels = read_table(label_path) if os.path.exists(label_path) else None
+        return txns, labels
+    return read_table(path), None
+
+
+# ---------------------------
+# 2️⃣ Columnar replay
+# ---------------------------
+class Replay:
+    # Transactions sorted by (account, timestamp, txn_id) - the order in which
+    # each account context sees them - plus the group bookkeeping every rule shares
+
+    def __init__(self, txns):
+        def col(name, fill):
+            # Zero-copy view of the mapped column unless nulls have to be filled
+            c = txns.column(name)
+            return (c.fill_null(fill) if c.null_count else c).to_numpy()
+
+        txn_id, account_id = col("txn_id", 0), col("account_id", 0)
+        ts = txns.column("txn_timestamp").cast(pa.int64()).to_numpy()
+        order = np.lexsort((txn_id, ts, account_id))
+        self.n = len(order)
+        self.txn_id = txn_id[order]
+        self.ts = ts[order]
+        self.amount = col("amount", np.nan)[order]
+        self.lat = col("geo_lat", np.nan)[order]
+        self.lng = col("geo_lng", np.nan)[order]
+        self.device = col("device_id", -1)[order]   # None == None in rules.py, so nulls match each other
+        self.device_null = txns.column("device_id").is_null().to_numpy(zero_copy_only=False)[order]
+        self.idx = np.arange(self.n)
+
+        account = account_id[order]
+        new_group = np.ones(self.n, dtype=bool)
+        new_group[1:] = account[1:] != account[:-1]
+        self.group = np.cumsum(new_group) - 1
+        self.group_start = np.maximum.accumulate(np.where(new_group, self.idx, 0))
+        # Sortable (account, timestamp) key: timestamps replaced by their rank
+        self.times = np.unique(self.ts)
+        self.key = self.group * (len(self.times) + 1) + np.searchsorted(self.times, self.ts)
+        # First row of this account with the same timestamp
+        self.same_time_start = np.searchsorted(self.key, self.key, "left")
+        self._row_of_txn = None
+
+    def first_at_or_after(self, bound):
+        # Per row: first row of the same account with txn_timestamp >= bound[row]
+        rank = np.searchsorted(self.times, bound, "left")
+        return np.searchsorted(self.key, self.group * (len(self.times) + 1) + rank, "left")
+
+    def rows_of(self, txn_ids):
+        # Row of each txn_id, -1 when it is not in the snapshot
+        if self._row_of_txn is None:
+            self._row_of_txn = np.argsort(self.txn_id, kind="stable")
+        sorted_ids = self.txn_id[self._row_of_txn]
+        pos = np.clip(np.searchsorted(sorted_ids, txn_ids), 0, max(self.n - 1, 0))
+        found = sorted_ids[pos] == txn_ids if self.n else np.zeros(len(txn_ids), dtype=bool)
+        return np.where(found, self._row_of_txn[pos], -1)
+
+
+class Context:
+    # One profile's context settings over a Replay (AccountContext / TxnView in rules.py)
+
+    def __init__(self, replay, history_size=None, zero_is_missing=False, same_time_visible=True,
+                 max_age_us=None, seed=None):
+        r = self.replay = replay
+        if zero_is_missing:
+            self.located = (np.nan_to_num(r.lat) != 0) & (np.nan_to_num(r.lng) != 0)
+        else:
+            self.located = ~np.isnan(r.lat) & ~np.isnan(r.lng)
+        # Rows [lo, i) are the account's `recent` deque when row i is scored
+        if history_size is not None:
+            self.lo = np.maximum(r.group_start, r.idx - history_size)
+        elif max_age_us is not None:
+            # Pruned against the previous transaction's timestamp, as in RuleEngine.observe
+            prev_ts = np.concatenate(([0], r.ts[:-1]))
+            self.lo = np.where(r.idx == r.group_start, r.idx, r.first_at_or_after(prev_ts - max_age_us))
+        else:
+            self.lo = r.group_start
+        self.unbounded = history_size is None and max_age_us is None
+        # Rows before `visible_end` can be seen; with same_time_visible off, not the same-timestamp ones
+        self.visible_end = r.idx if same_time_visible else r.same_time_start
+        self.rng = np.random.default_rng(seed)
+
+    def window_offsets(self):
+        # 1 .. longest recent deque, for the rules that look at every entry
+        return range(1, int((self.replay.idx - self.lo).max(initial=0)) + 1)
+
+
+def high_value(ctx, threshold):
+    return ctx.replay.amount > threshold
+
+def velocity(ctx, window_minutes, min_count):
+    r = ctx.replay
+    since = r.first_at_or_after(r.ts - int(window_minutes * 60 * 1_000_000))
+    count = np.clip(ctx.visible_end - np.maximum(since, ctx.lo), 0, None) + 1   # this transaction included
+    return count >= min_count
+
+def window(ctx, window, min_count=None, min_amount=None):
+    # rules.py window counters on sorted rows: nothing is evicted early, so a
+    # window holds every earlier row of the account in its last `size` buckets
+    r = ctx.replay
+    _, seconds, size = WINDOWS[WINDOW_NAMES.index(window)]
+    width_us = seconds // size * 1_000_000
+    start = r.first_at_or_after((r.ts // width_us - size + 1) * width_us)
+    count = r.idx - start + 1   # this transaction included
+    spent = np.concatenate(([0.0], np.cumsum(np.nan_to_num(r.amount))))
+    amount = spent[r.idx + 1] - spent[start]
+    fired = np.zeros(r.n, dtype=bool)
+    if min_count is not None:
+        fired |= count >= min_count
+    if min_amount is not None:
+        fired |= amount >= min_amount
+    return fired
+
+def geo_mismatch(ctx, max_km, compare="recent", exact=True):
+    r = ctx.replay
+    if compare == "last":
+        # Latest located row before this one, kept beyond the recent deque
+        latest = np.maximum.accumulate(np.where(ctx.located, r.idx, -1))
+        before = ctx.visible_end - 1
+        ref = np.where(before >= r.group_start, latest[np.maximum(before, 0)], -1)
+        rows = np.flatnonzero(ctx.located & (ref >= r.group_start))
+        pairs = [(rows, ref[rows])]
+    else:
+        pairs = []
+        for d in ctx.window_offsets():
+            j = r.idx - d
+            ok = ctx.located & (j >= ctx.lo) & (j < ctx.visible_end)
+            ok[ok] &= ctx.located[j[ok]]
+            rows = np.flatnonzero(ok)
+            pairs.append((rows, rows - d))
+    fired = np.zeros(r.n, dtype=bool)
+    rows = np.concatenate([p[0] for p in pairs]) if pairs else np.empty(0, dtype=int)
+    prev = np.concatenate([p[1] for p in pairs]) if pairs else np.empty(0, dtype=int)
+    if rows.size:
+        dist = distances_km(np.column_stack((r.lat[prev], r.lng[prev])), np.column_stack((r.lat[rows], r.lng[rows])),
+                            threshold_km=max_km, exact=exact)
+        fired[rows[dist > max_km]] = True
+    return fired
+
+def new_device(ctx, source="recent"):
+    r = ctx.replay
+    if source == "account_devices":
+        # account_devices.first_seen of the pair (the snapshot holds every use):
+        # new unless the account used the device at an earlier timestamp, and
+        # only when the account used some device before (DeviceIndex.account_seen_before)
+        _, first, inverse = np.unique(np.column_stack((r.group, r.device)), axis=0,
+                                      return_index=True, return_inverse=True)
+        known = r.ts[first][inverse.ravel()] < r.ts
+        account_first = np.full(r.group[-1] + 1 if r.n else 0, np.iinfo(np.int64).max)
+        np.minimum.at(account_first, r.group[~r.device_null], r.ts[~r.device_null])
+        account_known = account_first[r.group] < r.ts
+        return ~known & account_known & ~r.device_null
+    if ctx.unbounded:
+        # Whole history: the first time the account uses a device
+        _, first = np.unique(np.column_stack((r.group, r.device)), axis=0, return_index=True)
+        seen = np.ones(r.n, dtype=bool)
+        seen[first] = False
+    else:
+        seen = np.zeros(r.n, dtype=bool)
+        for d in ctx.window_offsets():
+            j = r.idx - d
+            ok = j >= ctx.lo
+            seen[ok] |= r.device[j[ok]] == r.device[ok]
+    return (r.idx > ctx.lo) & ~seen
+
+def random_sample(ctx, probability):
+    return ctx.rng.random(ctx.replay.n) < probability
+
+VECTOR_KINDS = {
+    "high_value": high_value,
+    "velocity": velocity,
+    "window": window,
+    "geo_mismatch": geo_mismatch,
+    "new_device": new_device,
+    "random_sample": random_sample,
+}
+
+
+# ---------------------------
+# 3️⃣ Grid sweep
+# ---------------------------
+def expand_grid(profile_config, grid):
+    # grid: ["RULE_ID.param=v1,v2", "context.key=v1,v2"] -> [(overrides, profile config)]
+    axes = []
+    rule_ids = {r["rule_id"] for r in profile_config["rules"]}
+    for spec in grid:
+        target, _, values = spec.partition("=")
+        owner, _, param = target.partition(".")
+        if not values or not param or (owner != "context" and owner not in rule_ids):
+            raise SystemExit(f"Bad --grid '{spec}': use RULE_ID.param=v1,v2 or context.key=v1,v2 "
+                             f"(rules: {', '.join(sorted(rule_ids))})")
+        axes.append([(target, json.loads(v)) for v in values.split(",")])
+    configs = []
+    for combo in itertools.product(*axes):
+        config = copy.deepcopy(profile_config)
+        for target, value in combo:
+            owner, _, param = target.partition(".")
+            if owner == "context":
+                config.setdefault("context", {})[param] = value
+            else:
+                next(r for r in config["rules"] if r["rule_id"] == owner).setdefault("params", {})[param] = value
+        configs.append((dict(combo), config))
+    return configs
+
+
+_replay = None
+_labels = None
+
+
+def _init_worker(snapshot_path):
+    # Each worker maps the snapshot itself; only configs and results cross processes
+    global _replay, _labels
+    txns, labels = load_snapshot(snapshot_path)
+    _replay = Replay(txns)
+    _labels = None
+    if labels is not None and labels.num_rows:
+        rows = _replay.rows_of(labels.column("txn_id").to_numpy())
+        _labels = (rows, labels.column("rule_id").to_numpy(zero_copy_only=False),
+                   labels.column("status").to_numpy(zero_copy_only=False))
+
+
+def evaluate(job):
+    overrides, config, seed = job
+    start = time.perf_counter()
+    context = dict(config.get("context", {}))
+    windows = [r["params"]["window_minutes"] for r in config["rules"] if r["kind"] == "velocity"]
+    max_age_us = (int(max(windows) * 60 * 1_000_000)
+                  if context.get("history_size") is None and windows else None)
+    ctx = Context(_replay, max_age_us=max_age_us, seed=seed, **context)
+    result = {"config": overrides, "alerts": {}, "labels": {}}
+    for rule in config["rules"]:
+        fired = VECTOR_KINDS[rule["kind"]](ctx, **rule.get("params", {}))
+        result["alerts"][rule["rule_id"]] = int(fired.sum())
+        if _labels is not None:
+            rows, rule_ids, statuses = _labels
+            mine = (rule_ids == rule["rule_id"]) & (rows >= 0)
+            hit = np.zeros(len(rows), dtype=bool)
+            hit[mine] = fired[rows[mine]]
+            result["labels"][rule["rule_id"]] = {
+                status: {"labelled": int((mine & (statuses == status)).sum()),
+                         "fired": int((hit & (statuses == status)).sum())}
+                for status in LABEL_STATUSES}
+    result["total_alerts"] = sum(result["alerts"].values())
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def ratio(a, b):
+    return f"{a / b:.2f}" if b else "-"
+
+
+def report(results, has_labels):
+    # One line per config and rule: alerts, confirmed kept (recall), share of hits that were confirmed
+    print(f"{'config':<60} {'rule':<16} {'alerts':>9} {'confirmed':>13} {'dismissed':>13} {'recall':>7} {'precision':>9}")
+    for res in results:
+        label = ", ".join(f"{k}={v}" for k, v in res["config"].items()) or "(profile as configured)"
+        for rule_id, alerts in res["alerts"].items():
+            line = f"{label:<60} {rule_id:<16} {alerts:>9}"
+            lab = res["labels"].get(rule_id)
+            if has_labels and lab:
+                c, d = lab["confirmed"], lab["dismissed"]
+                line += (f" {c['fired']:>6}/{c['labelled']:<6} {d['fired']:>6}/{d['labelled']:<6}"
+                         f" {ratio(c['fired'], c['labelled']):>7} {ratio(c['fired'], c['fired'] + d['fired']):>9}")
+            print(line)
+            label = ""
+        print(f"{'':<60} {'total':<16} {res['total_alerts']:>9}   ({res['seconds']}s)")
+
+
+def run(args):
+    try:
+        profile = profile_config(args.profile, args.rules)   # "extends" resolved
+    except KeyError as e:
+        raise SystemExit(e.args[0])
+    configs = expand_grid(profile, args.grid or [])
+    jobs = [(overrides, config, args.seed) for overrides, config in configs]
+    print(f"{len(jobs)} configs of profile '{args.profile}' over {args.snapshot} ({args.workers} workers)")
+
+    start = time.perf_counter()
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(args.snapshot,)) as pool:
+            results = list(pool.map(evaluate, jobs))
+    else:
+        _init_worker(args.snapshot)
+        results = [evaluate(job) for job in jobs]
+    has_labels = any(res["labels"] for res in results)
+    report(results, has_labels)
+    if not has_labels:
+        print("No confirmed/dismissed alert labels in the snapshot: overlap not reported")
+    print(f"Swept {len(jobs)} configs in {time.perf_counter() - start:.1f}s")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"profile": args.profile, "snapshot": args.snapshot, "seed": args.seed,
+                       "results": results}, f, indent=2)
+        print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest rule thresholds over a transaction snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    snap_parser = sub.add_parser("snapshot", help="write transactions and alert labels to Arrow files")
+    snap_parser.add_argument("--out", required=True, help="snapshot directory")
+
+    run_parser = sub.add_parser("run", help="sweep rule configs over a snapshot (no database access)")
+    run_parser.add_argument("--snapshot", required=True,
+                            help="snapshot directory, or a single .arrow / .parquet transactions file")
+    run_parser.add_argument("--profile", default="fraud_alerts", help="rule profile in rules.json")
+    run_parser.add_argument("--rules", help=f"rules file (default: {RULES_CONFIG})")
+    run_parser.add_argument("--grid", action="append",
+                            help="RULE_ID.param=v1,v2 or context.key=v1,v2 (JSON values); repeat for more axes")
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for the sweep")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed for random_sample rules")
+    run_parser.add_argument("--out", help="write all results as JSON")
+
+    args = parser.parse_args()
+    if args.command == "snapshot":
+        snapshot(args)
+    else:
+        run(args)
@@ -0,0 +1,515 @@
+# benchmark.py
+#
+# Throughput benchmark for the batch detectors (fraud_alerts.py,
+# fraud_generate.py, fraud_generate_advanced.py) and the trigger modes of
+# fraud_detect.py (row, statement, notify + detection_daemon.py).
+#
+# Every run starts a throwaway PostgreSQL cluster (initdb into a temp
+# directory, own port), loads fixed-seed datasets with generate_data.py and
+# all_fraud_data.py, and runs each detector as a subprocess against it with
+# PGPORT pointing at the cluster. Detector state and alerts are reset before
+# every run, so each run scores the whole dataset.
+#
+# A trigger run installs its mode with fraud_detect.py on an emptied
+# transactions table and times re-inserting the dataset, TRIGGER_BATCH rows
+# per INSERT statement. In notify mode the clock runs until
+# detection_daemon.py has scored the last row.
+#
+# Per run it records rows/s, peak RSS of the detector process tree, DB round
+# trips (statements counted by pg_stat_statements, when the server has it)
+# and the fetch / score / write split the detectors report through
+# stage_timer.py. Results go to a JSON file; compare two of them to see what
+# a commit changed.
+#
+#   python benchmark.py run --sizes 10k 100k --repeat 3 --out bench-main.json
+#   python benchmark.py run --sizes 1m --detectors fraud_alerts_stream --out bench-1m.json
+#   python benchmark.py run --sizes 100k --detectors trigger_row trigger_statement trigger_notify
+#   python benchmark.py compare bench-main.json bench-branch.json --fail-above 10
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import db
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_PORT = 55432
+BENCH_SEED = 42
+BENCH_ANCHOR = "2025-10-01T00:00:00+00:00"   # fixed, so every dataset is identical run to run
+
+# name -> (transactions, users); generate_data.py creates 1-3 accounts per user
+DATASETS = {
+    "10k": (10000, 500),
+    "100k": (100000, 2000),
+    "1m": (1000000, 10000),
+}
+
+# name -> command line (relative to the repo)
+DETECTORS = {
+    "fraud_alerts": ["fraud_alerts.py"],
+    "fraud_alerts_stream": ["fraud_alerts.py", "--stream"],
+    "fraud_generate": ["fraud_generate.py"],
+    "fraud_generate_advanced": ["fraud_generate_advanced.py"],
+}
+
+# name -> fraud_detect.py --mode
+TRIGGER_MODES = {
+    "trigger_row": "row",
+    "trigger_statement": "statement",
+    "trigger_notify": "notify",
+}
+TRIGGER_BATCH = 1000   # rows per INSERT statement in the trigger runs
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS trg_check_txn ON transactions;
+DROP TRIGGER IF EXISTS trg_check_txn_stmt ON transactions;
+DROP TRIGGER IF EXISTS trg_txn_devices ON transactions;
+DROP TRIGGER IF EXISTS trg_txn_notify ON transactions;
+"""
+
+# Tables the detectors touch, as defined in "fraud detect.sql" (keep in sync)
+BENCH_SCHEMA_SQL = """
+CREATE TYPE account_status AS ENUM ('active','suspended','closed');
+CREATE TYPE account_type AS ENUM ('savings','current','credit');
+
+CREATE TABLE users (
+  user_id     BIGSERIAL PRIMARY KEY,
+  full_name   TEXT NOT NULL,
+  email       TEXT UNIQUE NOT NULL,
+  phone       TEXT,
+  dob         DATE,
+  kyc_level   SMALLINT DEFAULT 0,
+  created_at  TIMESTAMPTZ DEFAULT now(),
+  updated_at  TIMESTAMPTZ DEFAULT now(),
+  risk_score  NUMERIC(5,2) DEFAULT 0.00
+);
+
+CREATE TABLE accounts (
+  account_id  BIGSERIAL PRIMARY KEY,
+  user_id     BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+  account_no  TEXT UNIQUE NOT NULL,
+  account_type account_type NOT NULL,
+  balance     NUMERIC(18,2) DEFAULT 0.00,
+  currency    TEXT DEFAULT 'INR',
+  status      account_status DEFAULT 'active',
+  created_at  TIMESTAMPTZ DEFAULT now(),
+  updated_at  TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE merchants (
+  merchant_id   BIGSERIAL PRIMARY KEY,
+  name          TEXT NOT NULL,
+  merchant_code TEXT UNIQUE,
+  category      TEXT,
+  city          TEXT,
+  country       TEXT,
+  created_at    TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE devices (
+  device_id          BIGSERIAL PRIMARY KEY,
+  device_fingerprint TEXT UNIQUE,
+  device_info        JSONB,
+  first_seen         TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE transactions (
+    txn_id        BIGSERIAL PRIMARY KEY,
+    account_id    BIGINT NOT NULL REFERENCES accounts(account_id) ON DELETE CASCADE,
+    merchant_id   BIGINT REFERENCES merchants(merchant_id),
+    device_id     BIGINT REFERENCES devices(device_id),
+    amount        NUMERIC(18,2) NOT NULL,
+    currency      TEXT DEFAULT 'INR',
+    txn_timestamp TIMESTAMPTZ NOT NULL,
+    channel       VARCHAR(50) NOT NULL,
+    status        TEXT DEFAULT 'posted',
+    location      TEXT,
+    ip_address    INET,
+    geo_lat       DOUBLE PRECISION,
+    geo_lng       DOUBLE PRECISION,
+    merchant_category TEXT,
+    metadata      JSONB
+);
+CREATE INDEX idx_txn_account_ts ON transactions (account_id, txn_timestamp DESC);
+CREATE INDEX idx_txn_merchant ON transactions (merchant_id);
+CREATE INDEX idx_txn_amount ON transactions (amount);
+
+CREATE TABLE fraud_alerts (
+    alert_id      BIGSERIAL PRIMARY KEY,
+    txn_id        BIGINT NOT NULL REFERENCES transactions(txn_id) ON DELETE CASCADE,
+    txn_timestamp TIMESTAMPTZ NOT NULL,
+    account_id    BIGINT NOT NULL REFERENCES accounts(account_id) ON DELETE CASCADE,
+    rule_id       TEXT,
+    reason        TEXT,
+    severity      TEXT DEFAULT 'medium',
+    score         NUMERIC(5,2) DEFAULT 0.0,
+    status        TEXT DEFAULT 'new',
+    created_at    TIMESTAMPTZ DEFAULT now(),
+    updated_at    TIMESTAMPTZ DEFAULT now(),
+    analyst_id    BIGINT
+);
+CREATE INDEX idx_alert_account ON fraud_alerts(account_id);
+CREATE INDEX idx_alert_status ON fraud_alerts(status);
+CREATE UNIQUE INDEX idx_alert_txn_rule ON fraud_alerts(txn_id, rule_id, txn_timestamp);
+"""
+
+
+# ---------------------------
+# 1️⃣ Throwaway PostgreSQL cluster
+# ---------------------------
+def find_pg_bin(pg_bin):
+    # --pg-bin, then initdb on PATH, then pg_config --bindir
+    if pg_bin:
+        return pg_bin
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    pg_config = shutil.which("pg_config")
+    if pg_config:
+        return subprocess.run([pg_config, "--bindir"], capture_output=True, text=True, check=True).stdout.strip()
+    sys.exit("initdb not found: put the PostgreSQL bin directory on PATH or pass --pg-bin")
+
+
+class BenchCluster:
+
+    def __init__(self, pg_bin, port):
+        self.pg_bin = pg_bin
+        self.port = port
+        self.workdir = tempfile.mkdtemp(prefix="fraud_bench_")
+        self.datadir = os.path.join(self.workdir, "data")
+        self.stat_statements = False
+
+    def _bin(self, name):
+        return os.path.join(self.pg_bin, name)
+
+    def start(self):
+        subprocess.run([self._bin("initdb"), "-D", self.datadir, "-U", "postgres", "--auth=trust",
+                        "--no-sync", "-E", "UTF8"], check=True, stdout=subprocess.DEVNULL)
+        options = [f"-p {self.port}", "-c listen_addresses=localhost", f"-k {self.workdir}",
+                   "-c fsync=off", "-c synchronous_commit=off", "-c full_page_writes=off"]
+        # Round trips are counted by pg_stat_statements when the server ships it
+        libdir = subprocess.run([self._bin("pg_config"), "--pkglibdir"], capture_output=True, text=True)
+        if libdir.returncode == 0 and os.path.exists(os.path.join(libdir.stdout.strip(), "pg_stat_statements.so")):
+            options += ["-c shared_preload_libraries=pg_stat_statements", "-c pg_stat_statements.track=all"]
+            self.stat_statements = True
+        subprocess.run([self._bin("pg_ctl"), "-D", self.datadir, "-l", os.path.join(self.workdir, "server.log"),
+                        "-o", " ".join(options), "-w", "start"], check=True, stdout=subprocess.DEVNULL)
+        self.execute(BENCH_SCHEMA_SQL)
+        if self.stat_statements:
+            self.execute("CREATE EXTENSION pg_stat_statements")
+        self.server_version = self.execute("SHOW server_version")[0]
+
+    def stop(self, keep=False):
+        subprocess.run([self._bin("pg_ctl"), "-D", self.datadir, "-m", "fast", "-w", "stop"],
+                       stdout=subprocess.DEVNULL)
+        if keep:
+            print(f"Cluster kept in {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def execute(self, *statements):
+        # Run statements on a fresh autocommit connection; returns the last result row
+        conn = db.connect(host="localhost", port=self.port, database="postgres", user="postgres", password=None)
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            row = None
+            for statement in statements:
+                cur.execute(statement)
+                row = cur.fetchone() if cur.description else None
+            return row
+        finally:
+            conn.close()
+
+    def env(self):
+        # db.py lets PG* variables win over db.ini, so the scripts land on this cluster
+        return dict(os.environ, PGHOST="localhost", PGPORT=str(self.port), PGDATABASE="postgres", PGUSER="postgres")
+
+
+# ---------------------------
+# 2️⃣ Datasets and runs
+# ---------------------------
+def run_script(cluster, argv, timings_file=None):
+    # Returns (wall seconds, peak RSS in MB of the process and the children it waited for)
+    env = cluster.env()
+    if timings_file:
+        env["FRAUD_STAGE_TIMINGS"] = timings_file
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable] + argv, cwd=HERE, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    # wait4 instead of proc.wait(): it also returns the child's resource usage
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        sys.exit(f"{' '.join(argv)} failed ({proc.returncode}):\n{stderr.decode(errors='replace')}")
+    return wall, rusage.ru_maxrss / 1024   # ru_maxrss is in KB on Linux
+
+
+def load_dataset(cluster, name):
+    rows, users = DATASETS[name]
+    cluster.execute("TRUNCATE users, accounts, merchants, devices, transactions, fraud_alerts RESTART IDENTITY CASCADE")
+    start = time.perf_counter()
+    run_script(cluster, ["generate_data.py", "--bulk", "--seed", str(BENCH_SEED), "--users", str(users),
+                         "--merchants", "200", "--devices", str(users), "--transactions", "0"])
+    run_script(cluster, ["all_fraud_data.py", "--rows", str(rows), "--seed", str(BENCH_SEED),
+                         "--anchor", BENCH_ANCHOR])
+    run_script(cluster, ["account_devices.py", "--rebuild"])   # no triggers here to maintain it
+    # Source of the trigger runs, which empty transactions and insert it again
+    cluster.execute("DROP TABLE IF EXISTS bench_txns", "CREATE TABLE bench_txns AS SELECT * FROM transactions")
+    loaded = cluster.execute("VACUUM ANALYZE", "SELECT count(*) FROM transactions")[0]
+    return {"rows": loaded, "users": users, "seed": BENCH_SEED, "load_s": round(time.perf_counter() - start, 3)}
+
+
+def run_detector(cluster, dataset, detector, rows):
+    # Every run scores the whole dataset from a clean alert table
+    cluster.execute("TRUNCATE fraud_alerts RESTART IDENTITY", "DROP TABLE IF EXISTS detector_state", "CHECKPOINT")
+    if cluster.stat_statements:
+        cluster.execute("SELECT pg_stat_statements_reset()")
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        timings_file = f.name
+    try:
+        wall, peak_rss_mb = run_script(cluster, DETECTORS[detector], timings_file)
+        with open(timings_file) as f:
+            stages = json.load(f) if os.path.getsize(timings_file) else {}
+    finally:
+        os.unlink(timings_file)
+
+    round_trips = None
+    if cluster.stat_statements:
+        # Statements sent by the detector; the benchmark's own are excluded
+        round_trips = int(cluster.execute("""
+            SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements
+            WHERE query NOT ILIKE '%pg_stat_statements%'
+        """)[0])
+    alerts = cluster.execute("SELECT count(*) FROM fraud_alerts")[0]
+
+    stages = {k: round(v, 3) for k, v in stages.items()}
+    stages["other"] = round(wall - sum(stages.values()), 3)   # startup, imports, connect
+    return {
+        "dataset": dataset,
+        "detector": detector,
+        "rows": rows,
+        "wall_s": round(wall, 3),
+        "rows_per_s": round(rows / wall, 1),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "round_trips": round_trips,
+        "alerts": alerts,
+        "stages_s": stages,
+    }
+
+
+def start_daemon(cluster):
+    # detection_daemon.py, once it listens
+    proc = subprocess.Popen([sys.executable, "detection_daemon.py"], cwd=HERE, env=cluster.env(),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    output = []
+    for line in proc.stdout:
+        output.append(line)
+        if "listening on" in line:
+            return proc
+    proc.wait()
+    sys.exit(f"detection_daemon.py failed ({proc.returncode}):\n{''.join(output)}")
+
+
+def run_trigger(cluster, dataset, detector, rows):
+    # Insert the dataset again through one trigger mode, from empty tables
+    mode = TRIGGER_MODES[detector]
+    cluster.execute(DROP_TRIGGERS_SQL, "TRUNCATE transactions, fraud_alerts RESTART IDENTITY CASCADE",
+                    "DROP TABLE IF EXISTS detector_state, account_txn_state, account_devices CASCADE")
+    run_script(cluster, ["fraud_detect.py", "--mode", mode])
+    daemon = start_daemon(cluster) if mode == "notify" else None
+    cluster.execute("CHECKPOINT")
+    if cluster.stat_statements:
+        cluster.execute("SELECT pg_stat_statements_reset()")
+
+    conn = db.connect(host="localhost", port=cluster.port, database="postgres", user="postgres", password=None)
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(max(txn_id), 0) FROM bench_txns")
+    last_txn_id = cur.fetchone()[0]
+    conn.commit()
+    start = time.perf_counter()
+    for lo in range(0, last_txn_id, TRIGGER_BATCH):
+        cur.execute("INSERT INTO transactions SELECT * FROM bench_txns WHERE txn_id > %s AND txn_id <= %s",
+                    (lo, lo + TRIGGER_BATCH))
+        conn.commit()
+    stages = {"insert": time.perf_counter() - start}
+    peak_rss_mb = None
+    if daemon:
+        # Scored once the daemon's checkpoint reaches the last row; SIGTERM drains the rest
+        while True:
+            cur.execute("SELECT COALESCE(max(last_txn_id), 0) FROM detector_state WHERE detector LIKE 'detection_daemon%%'")
+            done = cur.fetchone()[0] >= last_txn_id
+            conn.commit()
+            if done or daemon.poll() is not None:
+                break
+            time.sleep(0.05)
+        daemon.send_signal(signal.SIGTERM)
+        daemon.stdout.read()
+        _, status, rusage = os.wait4(daemon.pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            sys.exit(f"detection_daemon.py failed ({os.waitstatus_to_exitcode(status)})")
+        peak_rss_mb = rusage.ru_maxrss / 1024
+        stages["score"] = time.perf_counter() - start - stages["insert"]
+    wall = time.perf_counter() - start
+    conn.close()
+
+    round_trips = None
+    if cluster.stat_statements:
+        round_trips = int(cluster.execute("""
+            SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements
+            WHERE query NOT ILIKE '%pg_stat_statements%'
+        """)[0])
+    alerts = cluster.execute("SELECT count(*) FROM fraud_alerts")[0]
+    cluster.execute(DROP_TRIGGERS_SQL)   # later loads and runs insert without them
+    return {
+        "dataset": dataset,
+        "detector": detector,
+        "rows": rows,
+        "wall_s": round(wall, 3),
+        "rows_per_s": round(rows / wall, 1),
+        "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb is not None else None,   # server-side work: not measured
+        "round_trips": round_trips,
+        "alerts": alerts,
+        "stages_s": {k: round(v, 3) for k, v in stages.items()},
+    }
+
+
+def git_describe():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(args):
+    cluster = BenchCluster(find_pg_bin(args.pg_bin), args.port)
+    commit, dirty = git_describe()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "datasets": {},
+        "runs": [],
+    }
+    cluster.start()
+    try:
+        results["postgres"] = cluster.server_version
+        results["round_trips_counted"] = cluster.stat_statements
+        if not cluster.stat_statements:
+            print("pg_stat_statements is not available: round trips are not recorded")
+        for dataset in args.sizes:
+            print(f"Loading dataset {dataset} ...")
+            results["datasets"][dataset] = info = load_dataset(cluster, dataset)
+            print(f"  {info['rows']} transactions in {info['load_s']}s")
+            for detector in args.detectors:
+                for i in range(args.repeat):
+                    run_one = run_trigger if detector in TRIGGER_MODES else run_detector
+                    r = run_one(cluster, dataset, detector, info["rows"])
+                    r["repeat"] = i + 1
+                    results["runs"].append(r)
+                    rss = f"{r['peak_rss_mb']:>7.1f} MB" if r["peak_rss_mb"] is not None else f"{'-':>7} MB"
+                    print(f"  {detector:<24} run {i + 1}: {r['rows_per_s']:>10.1f} rows/s  "
+                          f"{rss}  round_trips={r['round_trips']}  stages={r['stages_s']}")
+    finally:
+        cluster.stop(keep=args.keep)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+# ---------------------------
+# 3️⃣ Compare two result files
+# ---------------------------
+def summarise(results):
+    # (dataset, detector) -> medians over the repeats
+    groups = {}
+    for r in results["runs"]:
+        groups.setdefault((r["dataset"], r["detector"]), []).append(r)
+    summary = {}
+    for key, runs in groups.items():
+        trips = [r["round_trips"] for r in runs if r["round_trips"] is not None]
+        rss = [r["peak_rss_mb"] for r in runs if r["peak_rss_mb"] is not None]
+        summary[key] = {
+            "rows_per_s": statistics.median(r["rows_per_s"] for r in runs),
+            "peak_rss_mb": statistics.median(rss) if rss else None,
+            "round_trips": statistics.median(trips) if trips else None,
+            "alerts": runs[0]["alerts"],
+        }
+    return summary
+
+
+def pct(old, new):
+    if old in (None, 0) or new is None:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base: {base.get('commit')}{' (dirty)' if base.get('dirty') else ''}  {base.get('created_at')}")
+    print(f"new:  {new.get('commit')}{' (dirty)' if new.get('dirty') else ''}  {new.get('created_at')}")
+    old_summary, new_summary = summarise(base), summarise(new)
+    regressions = []
+    print(f"{'dataset':<8} {'detector':<24} {'rows/s':>22} {'peak RSS MB':>20} {'round trips':>22} {'alerts':>8}")
+    for key in sorted(set(old_summary) & set(new_summary)):
+        o, n = old_summary[key], new_summary[key]
+        print(f"{key[0]:<8} {key[1]:<24} "
+              f"{n['rows_per_s']:>12.1f} {pct(o['rows_per_s'], n['rows_per_s']):>9} "
+              f"{n['peak_rss_mb'] if n['peak_rss_mb'] is not None else '-':>10} {pct(o['peak_rss_mb'], n['peak_rss_mb']):>9} "
+              f"{n['round_trips'] if n['round_trips'] is not None else '-':>12} {pct(o['round_trips'], n['round_trips']):>9} "
+              f"{n['alerts']:>8}{'' if n['alerts'] == o['alerts'] else ' (was ' + str(o['alerts']) + ')'}")
+        if args.fail_above is not None and n["rows_per_s"] < o["rows_per_s"] * (1 - args.fail_above / 100):
+            regressions.append(key)
+    for key in sorted(set(old_summary) ^ set(new_summary)):
+        print(f"{key[0]:<8} {key[1]:<24} only in {'base' if key in old_summary else 'new'}")
+    if regressions:
+        print(f"Throughput dropped by more than {args.fail_above}% for: "
+              + ", ".join(f"{d}/{det}" for d, det in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the detectors and trigger modes on a throwaway PostgreSQL cluster.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="load fixed-seed datasets and time each detector")
+    run_parser.add_argument("--sizes", nargs="+", choices=list(DATASETS), default=["10k", "100k"])
+    run_parser.add_argument("--detectors", nargs="+", choices=list(DETECTORS) + list(TRIGGER_MODES),
+                            default=list(DETECTORS) + list(TRIGGER_MODES))
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs per detector and dataset")
+    run_parser.add_argument("--out", default="benchmark.json", help="results JSON file")
+    run_parser.add_argument("--port", type=int, default=BENCH_PORT, help="port for the throwaway cluster")
+    run_parser.add_argument("--pg-bin", help="directory with initdb / pg_ctl (default: from PATH)")
+    run_parser.add_argument("--keep", action="store_true", help="keep the cluster directory for inspection")
+
+    compare_parser = sub.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--fail-above", type=float,
+                                help="exit 1 if rows/s drops by more than this many percent")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
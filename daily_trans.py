@@ -1,5 +1,6 @@
 import psycopg2
 import psycopg2.extras  # ✅ add this
+import db
 from faker import Faker
 import random
 from datetime import datetime, timedelta
@@ -10,12 +11,7 @@ fake = Faker()
 # ---------------------------
 # 1️⃣ Connect to PostgreSQL
 # ---------------------------
-conn = psycopg2.connect(
-    host="localhost",
-    database="postgres",
-    user="postgres",
-    password="Paused.0"  # your password
-)
+conn = db.connect()
 cur = conn.cursor()
 
 # ---------------------------
@@ -66,10 +62,11 @@ insert_query = """
 INSERT INTO transactions(
     account_id, merchant_id, device_id, amount, txn_timestamp,
     channel, location, ip_address, geo_lat, geo_lng, merchant_category, metadata
-) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);
+) VALUES %s;
 """
 
-cur.executemany(insert_query, transactions)
+# One multi-row INSERT per page instead of one statement per transaction
+psycopg2.extras.execute_values(cur, insert_query, transactions, page_size=200)
 conn.commit()
 print(f"Inserted {len(transactions)} new transactions.")
 
@@ -1,40 +1,144 @@
 import streamlit as st
-import psycopg2
+import db
 import pandas as pd
 import plotly.express as px
+from alert_watermark import read_alert_watermark
+from alert_rollup import alert_rollup_ready
+
+PAGE_SIZE = 50          # rows per page in the alert tables
+CACHE_TTL_S = 600       # safety net; the watermark normally invalidates first
 
 # ---------------------------
 # 1️⃣ Connect to PostgreSQL
 # ---------------------------
-conn = psycopg2.connect(
-    host="localhost",
-    database="postgres",  # your DB name
-    user="postgres",
-    password="Paused.0"
-)
+# Streamlit runs each session in its own thread: every query borrows a
+# connection from the per-process pool in db.py instead of sharing one
+def run_query(query, params=None):
+    with db.connection() as conn:
+        return pd.read_sql(query, conn, params=params)
 
 # ---------------------------
 # 2️⃣ Fetch fraud alerts
 # ---------------------------
-@st.cache_data
-def load_data():
-    query = """
-    SELECT fa.alert_id, fa.txn_id, fa.account_id, fa.rule_id, fa.reason,
-           fa.severity, fa.score, fa.status, fa.created_at,
-           a.balance, a.currency,
-           t.amount, t.txn_timestamp, t.channel, t.location, t.merchant_id,
-           m.name as merchant_name, m.category as merchant_category
-    FROM fraud_alerts fa
-    JOIN accounts a ON fa.account_id = a.account_id
-    JOIN transactions t ON fa.txn_id = t.txn_id
-    LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
-    ORDER BY fa.created_at DESC
-"""
-
-    df = pd.read_sql(query, conn)
-    return df
-
-df = load_data()
+# Every cached query takes the alert watermark as an argument, so a rerun
+# hits the cache until an alert is inserted or updated. Aggregates run in
+# PostgreSQL; only their results come back.
+# Counts per day / severity, the summary and the top accounts come from the
+# alert rollups once they are backfilled (python alert_rollup.py), otherwise
+# from fraud_alerts.
+with db.connection() as conn, conn.cursor() as cur:
+    watermark = read_alert_watermark(cur)
+    use_rollup = alert_rollup_ready(cur)
+
+@st.cache_data(ttl=CACHE_TTL_S)
+def load_summary(watermark, use_rollup):
+    if use_rollup:
+        return run_query("""
+            SELECT (SELECT COALESCE(SUM(alert_count), 0) FROM alert_rollup_hourly) AS total_alerts,
+                   (SELECT COALESCE(SUM(alert_count), 0) FROM alert_rollup_hourly
+                    WHERE severity IN ('high','critical')) AS high_severity,
+                   (SELECT COUNT(*) FROM alert_rollup_accounts WHERE alert_count > 0) AS accounts_affected,
+                   (SELECT COUNT(*) FROM alert_rollup_merchants WHERE alert_count > 0) AS merchants_involved
+        """).iloc[0]
+    return run_query("""
+        SELECT COUNT(*) AS total_alerts,
+               COUNT(*) FILTER (WHERE fa.severity IN ('high','critical')) AS high_severity,
+               COUNT(DISTINCT fa.account_id) AS accounts_affected,
+               COUNT(DISTINCT t.merchant_id) AS merchants_involved
+        FROM fraud_alerts fa
+        JOIN transactions t ON fa.txn_id = t.txn_id   -- not on txn_timestamp: older alerts may lack it
+    """).iloc[0]
+
+@st.cache_data(ttl=CACHE_TTL_S)
+def load_severity_counts(watermark, use_rollup):
+    if use_rollup:
+        return run_query("""
+            SELECT NULLIF(severity, '') AS severity, SUM(alert_count) AS count
+            FROM alert_rollup_hourly
+            GROUP BY 1
+            ORDER BY 1
+        """)
+    return run_query("""
+        SELECT severity, COUNT(*) AS count
+        FROM fraud_alerts
+        GROUP BY severity
+        ORDER BY severity
+    """)
+
+@st.cache_data(ttl=CACHE_TTL_S)
+def load_alerts_by_day(watermark, use_rollup):
+    if use_rollup:
+        return run_query("""
+            SELECT (day AT TIME ZONE 'UTC')::date AS day, total_alerts AS count
+            FROM fraud_by_day
+            ORDER BY 1
+        """)
+    return run_query("""
+        SELECT (created_at AT TIME ZONE 'UTC')::date AS day, COUNT(*) AS count   -- UTC days, like the rollup
+        FROM fraud_alerts
+        GROUP BY 1
+        ORDER BY 1
+    """)
+
+@st.cache_data(ttl=CACHE_TTL_S)
+def load_top_accounts(watermark, use_rollup):
+    if use_rollup:
+        return run_query("""
+            SELECT account_id, score_sum AS score
+            FROM alert_rollup_accounts
+            WHERE alert_count > 0
+            ORDER BY score_sum DESC
+            LIMIT 10
+        """)
+    return run_query("""
+        SELECT account_id, SUM(score) AS score
+        FROM fraud_alerts
+        GROUP BY account_id
+        ORDER BY score DESC
+        LIMIT 10
+    """)
+
+@st.cache_data(ttl=CACHE_TTL_S)
+def load_alert_page(watermark, after, severities):
+    # Keyset pagination: the page after cursor `after` = (created_at, alert_id)
+    # walks idx_alert_created_keyset / idx_alert_severity_created, so page N
+    # costs the same as page 1 (no OFFSET scan).
+    conditions, params = [], []
+    if after is not None:
+        conditions.append("(created_at, alert_id) < (%s, %s)")
+        params += list(after)
+    if severities is not None:
+        conditions.append("severity = ANY(%s)")
+        params.append(list(severities))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return run_query(f"""
+        SELECT alert_id, txn_id, account_id, rule_id, reason, severity, score, status, created_at
+        FROM fraud_alerts
+        {where}
+        ORDER BY created_at DESC, alert_id DESC
+        LIMIT %s
+    """, params + [PAGE_SIZE])
+
+def paged_alert_table(key, severities=None):
+    # Cursor stack per table in session_state: Next pushes the last row's key, Previous pops
+    state_key = f"{key}_cursors"
+    if st.session_state.get(f"{key}_filter") != severities:
+        st.session_state[state_key] = [None]   # filter changed: back to page 1
+        st.session_state[f"{key}_filter"] = severities
+    cursors = st.session_state.setdefault(state_key, [None])
+
+    page = load_alert_page(watermark, cursors[-1], severities)
+    st.dataframe(page)
+
+    prev_col, info_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button("◀ Previous", key=f"{key}_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    info_col.caption(f"Page {len(cursors)}")
+    if next_col.button("Next ▶", key=f"{key}_next", disabled=len(page) < PAGE_SIZE):
+        last = page.iloc[-1]
+        cursors.append((last['created_at'].to_pydatetime(), int(last['alert_id'])))
+        st.rerun()
 
 # ---------------------------
 # 3️⃣ Dashboard Layout
@@ -44,35 +148,35 @@ st.title("💳 Fraud Detection Dashboard")
 
 # --- Summary Metrics ---
 st.subheader("Summary Metrics")
+summary = load_summary(watermark, use_rollup)
 col1, col2, col3, col4 = st.columns(4)
-col1.metric("Total Alerts", len(df))
-col2.metric("High Severity", len(df[df['severity'].isin(['high','critical'])]))
-col3.metric("Accounts Affected", df['account_id'].nunique())
-col4.metric("Merchants Involved", df['merchant_id'].nunique())
+col1.metric("Total Alerts", int(summary['total_alerts']))
+col2.metric("High Severity", int(summary['high_severity']))
+col3.metric("Accounts Affected", int(summary['accounts_affected']))
+col4.metric("Merchants Involved", int(summary['merchants_involved']))
 
 # --- Severity Distribution Chart ---
 st.subheader("Alerts by Severity")
-fig_severity = px.histogram(df, x='severity', color='severity', title="Alerts by Severity")
+severity_counts = load_severity_counts(watermark, use_rollup)
+fig_severity = px.bar(severity_counts, x='severity', y='count', color='severity', title="Alerts by Severity")
 st.plotly_chart(fig_severity, use_container_width=True)
 
 # --- Alerts Over Time ---
 st.subheader("Alerts Over Time")
-df['day'] = pd.to_datetime(df['created_at']).dt.date
-alerts_by_day = df.groupby('day').size().reset_index(name='count')
+alerts_by_day = load_alerts_by_day(watermark, use_rollup)
 fig_time = px.line(alerts_by_day, x='day', y='count', title="Alerts Over Time")
 st.plotly_chart(fig_time, use_container_width=True)
 
 # --- Top Risky Accounts ---
 st.subheader("Top Risky Accounts")
-top_accounts = df.groupby('account_id')['score'].sum().reset_index().sort_values(by='score', ascending=False).head(10)
-st.dataframe(top_accounts)
+st.dataframe(load_top_accounts(watermark, use_rollup))
 
 # --- Recent Alerts Table ---
 st.subheader("Recent Alerts")
-st.dataframe(df[['alert_id','txn_id','account_id','rule_id','reason','severity','score','status','created_at']])
+paged_alert_table("recent")
 
 # --- Optional: Filter by Severity ---
 st.subheader("Filter Alerts by Severity")
-selected_severity = st.multiselect("Select Severity", options=df['severity'].unique(), default=df['severity'].unique())
-filtered_df = df[df['severity'].isin(selected_severity)]
-st.dataframe(filtered_df[['alert_id','txn_id','account_id','rule_id','reason','severity','score','status','created_at']])
+severity_options = severity_counts['severity'].dropna().tolist()
+selected_severity = st.multiselect("Select Severity", options=severity_options, default=severity_options)
+paged_alert_table("by_severity", tuple(selected_severity))
@@ -0,0 +1,170 @@
+# db.py
+#
+# Database access shared by every script: connection settings, a
+# thread-safe connection pool, server-side prepared statements for the hot
+# inserts, and a batch helper that sends many statements per round trip.
+#
+# Settings, first match wins:
+#   1. environment: PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD
+#   2. ini file named by FRAUD_DB_CONFIG (default: db.ini next to this file),
+#      section [postgres] - see db.ini.example
+#   3. defaults: localhost:5432, database and user "postgres", no password
+#      (libpq then falls back to ~/.pgpass)
+#
+#   conn = db.connect()                        # one dedicated connection
+#   with db.connection() as conn: ...          # borrowed from the pool
+#   db.execute_prepared_batch(cur, "insert_transaction", rows)
+
+import configparser
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+DB_CONFIG = os.environ.get("FRAUD_DB_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "db.ini"))
+DEFAULTS = {"host": "localhost", "port": "5432", "database": "postgres", "user": "postgres", "password": None,
+            "pool_min": "1", "pool_max": "10"}
+ENV_KEYS = {"host": "PGHOST", "port": "PGPORT", "database": "PGDATABASE", "user": "PGUSER",
+            "password": "PGPASSWORD", "pool_max": "FRAUD_DB_POOL_MAX"}
+BATCH_PAGE_SIZE = 500   # statements per round trip in execute_prepared_batch
+
+TXN_INSERT_COLUMNS = ("account_id", "merchant_id", "device_id", "amount", "txn_timestamp", "channel",
+                      "location", "ip_address", "geo_lat", "geo_lng", "merchant_category", "metadata")
+ALERT_INSERT_COLUMNS = ("txn_id", "txn_timestamp", "account_id", "rule_id", "reason", "severity", "score", "status")
+# One alert per transaction and rule (unique index, see dedupe_alerts.py). A
+# rerun refreshes the verdict, keeps the analyst's status, and leaves rows
+# whose verdict is unchanged untouched (no updated_at bump, no dead tuple).
+ALERT_KEY = ("txn_id", "rule_id", "txn_timestamp")
+ALERT_ON_CONFLICT = (f"ON CONFLICT ({', '.join(ALERT_KEY)}) DO UPDATE SET "
+                     "reason = EXCLUDED.reason, severity = EXCLUDED.severity, score = EXCLUDED.score "
+                     "WHERE (fraud_alerts.reason, fraud_alerts.severity, fraud_alerts.score) "
+                     "IS DISTINCT FROM (EXCLUDED.reason, EXCLUDED.severity, EXCLUDED.score)")
+
+# Hot statements, PREPAREd once per connection on first use
+PREPARED = {
+    "insert_transaction": (f"INSERT INTO transactions({', '.join(TXN_INSERT_COLUMNS)}) "
+                           f"VALUES ({', '.join(f'${i}' for i in range(1, len(TXN_INSERT_COLUMNS) + 1))})"),
+    "insert_alert": (f"INSERT INTO fraud_alerts({', '.join(ALERT_INSERT_COLUMNS)}) "
+                     f"VALUES ({', '.join(f'${i}' for i in range(1, len(ALERT_INSERT_COLUMNS) + 1))}) "
+                     f"{ALERT_ON_CONFLICT}"),
+}
+
+
+# ---------------------------
+# 1️⃣ Settings
+# ---------------------------
+def settings():
+    config = dict(DEFAULTS)
+    parser = configparser.ConfigParser()
+    if parser.read(DB_CONFIG) and parser.has_section("postgres"):
+        config.update(parser["postgres"])
+    for key, var in ENV_KEYS.items():
+        if os.environ.get(var):
+            config[key] = os.environ[var]
+    return config
+
+
+def connect_kwargs(**overrides):
+    # psycopg2.connect() arguments; overrides win over the settings
+    config = settings()
+    kwargs = {k: config[k] for k in ("host", "port", "database", "user", "password")}
+    kwargs.update(overrides)
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+
+def asyncpg_settings():
+    # Same settings for asyncpg.create_pool()
+    kwargs = connect_kwargs()
+    kwargs["port"] = int(kwargs["port"])
+    return kwargs
+
+
+# ---------------------------
+# 2️⃣ Connections and pool
+# ---------------------------
+def connect(**overrides):
+    # A dedicated connection, for long-running work such as server-side cursors
+    return psycopg2.connect(**connect_kwargs(**overrides))
+
+
+_pool = None
+_pool_pid = None
+_pool_slots = None      # ThreadedConnectionPool raises when exhausted; callers wait here instead
+_pool_lock = threading.Lock()
+
+
+def pool():
+    # One ThreadedConnectionPool per process (recreated after a fork)
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            config = settings()
+            _pool = psycopg2.pool.ThreadedConnectionPool(int(config["pool_min"]), int(config["pool_max"]),
+                                                         **connect_kwargs())
+            _pool_slots = threading.BoundedSemaphore(int(config["pool_max"]))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@contextmanager
+def connection():
+    # Borrow a pooled connection (blocks while all are in use);
+    # commit on success, roll back on error
+    p = pool()
+    slots = _pool_slots
+    slots.acquire()
+    try:
+        conn = p.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            p.putconn(conn)
+    finally:
+        slots.release()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+# ---------------------------
+# 3️⃣ Prepared statements and batches
+# ---------------------------
+_prepared = weakref.WeakKeyDictionary()   # connection -> names PREPAREd on it
+
+
+def prepare(cur, name):
+    # PREPARE a statement from PREPARED on this cursor's connection, once
+    done = _prepared.setdefault(cur.connection, set())
+    if name not in done:
+        cur.execute(f"PREPARE {name} AS {PREPARED[name]}")
+        done.add(name)
+
+
+def _execute_sql(name):
+    n = PREPARED[name].count("$")
+    return f"EXECUTE {name} ({', '.join(['%s'] * n)})"
+
+
+def execute_prepared(cur, name, params):
+    prepare(cur, name)
+    cur.execute(_execute_sql(name), params)
+
+
+def execute_prepared_batch(cur, name, rows, page_size=BATCH_PAGE_SIZE):
+    # Pipelined: page_size EXECUTEs are sent together in one round trip, each
+    # skipping parse and plan on the server. Row triggers still fire per row.
+    prepare(cur, name)
+    psycopg2.extras.execute_batch(cur, _execute_sql(name), rows, page_size=page_size)
@@ -0,0 +1,225 @@
+# dedupe_alerts.py
+#
+# One-off migration to one alert per transaction and rule. Reruns of the
+# detectors used to insert every alert again; all writers now upsert on
+# (txn_id, rule_id, txn_timestamp) (db.ALERT_ON_CONFLICT), which needs a
+# unique index on those columns. This script removes the duplicates and
+# builds that index while the detectors and the dashboard keep running:
+#
+#   1. One read-only pass lists every duplicate; for each key the survivor is
+#      the alert an analyst has touched (status not 'new' or analyst_id set),
+#      else the oldest one.
+#   2. The others are deleted --batch at a time, each batch its own short
+#      transaction holding row locks only; their alert_actions move to the
+#      survivor first. The rollup triggers (alert_rollup.py) subtract them.
+#   3. CREATE UNIQUE INDEX CONCURRENTLY, per partition when fraud_alerts is
+#      partitioned (partition_manager.py), attached to an index created ON
+#      ONLY the parent, so no step blocks inserts for longer than a catalog
+#      update.
+#
+# A duplicate written between steps 1 and 3 makes the build fail; the
+# invalid index is dropped and the passes repeat (--retries).
+#
+#   python dedupe_alerts.py --dry-run          # count duplicates, change nothing
+#   python dedupe_alerts.py                    # dedupe, then build the index
+#   python dedupe_alerts.py --batch 20000
+
+import argparse
+import time
+
+import psycopg2.errors
+
+import db
+from partition_manager import has_alert_txn_timestamp, install_alert_txn_timestamp
+
+ALERT_KEY_INDEX = "idx_alert_txn_rule"
+DEDUPE_BATCH = 10000   # alerts deleted per transaction
+
+# A valid, non-partial unique index on exactly the key columns, which is
+# what ON CONFLICT (txn_id, rule_id, txn_timestamp) needs
+ALERT_KEY_SQL = f"""
+SELECT EXISTS (
+    SELECT 1
+    FROM pg_index i
+    CROSS JOIN LATERAL (
+        SELECT array_agg(a.attnum) AS cols
+        FROM pg_attribute a
+        WHERE a.attrelid = i.indrelid AND a.attname IN ({', '.join(f"'{c}'" for c in db.ALERT_KEY)})
+    ) k
+    WHERE i.indrelid = to_regclass('fraud_alerts')
+      AND i.indisunique AND i.indisvalid
+      AND i.indpred IS NULL AND i.indexprs IS NULL
+      AND i.indkey::int2[] @> k.cols AND i.indkey::int2[] <@ k.cols
+)
+"""
+
+# Losers of every duplicated key, with the alert they fold into
+DUPLICATES_SQL = f"""
+CREATE TEMP TABLE alert_duplicates AS
+SELECT alert_id, txn_timestamp, keep_id
+FROM (
+    SELECT alert_id, txn_timestamp,
+           first_value(alert_id) OVER w AS keep_id,
+           row_number() OVER w AS n
+    FROM fraud_alerts
+    WINDOW w AS (PARTITION BY {', '.join(db.ALERT_KEY)}
+                 ORDER BY (status IS DISTINCT FROM 'new' OR analyst_id IS NOT NULL) DESC, alert_id)
+) ranked
+WHERE n > 1;
+CREATE INDEX ON alert_duplicates (alert_id);
+ANALYZE alert_duplicates;
+"""
+
+
+def has_alert_key(cur):
+    cur.execute(ALERT_KEY_SQL)
+    return cur.fetchone()[0]
+
+
+# ---------------------------
+# 1️⃣ Duplicates
+# ---------------------------
+def count_duplicates(cur):
+    cur.execute(f"""
+        SELECT COALESCE(SUM(n - 1), 0), COUNT(*)
+        FROM (SELECT COUNT(*) AS n FROM fraud_alerts GROUP BY {', '.join(db.ALERT_KEY)} HAVING COUNT(*) > 1) d
+    """)
+    return cur.fetchone()
+
+def delete_duplicates(conn, batch=DEDUPE_BATCH):
+    # Returns the number of alerts deleted
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS alert_duplicates")
+    cur.execute(DUPLICATES_SQL)
+    cur.execute("SELECT to_regclass('alert_actions') IS NOT NULL")
+    has_actions = cur.fetchone()[0]
+    conn.commit()
+
+    deleted, last_id = 0, 0
+    while True:
+        cur.execute("""
+            SELECT alert_id FROM alert_duplicates
+            WHERE alert_id > %s ORDER BY alert_id LIMIT %s
+        """, (last_id, batch))
+        ids = [row[0] for row in cur.fetchall()]
+        if not ids:
+            break
+        if has_actions:
+            cur.execute("""
+                UPDATE alert_actions a SET alert_id = d.keep_id
+                FROM alert_duplicates d
+                WHERE d.alert_id = ANY(%s) AND a.alert_id = d.alert_id
+            """, (ids,))
+        cur.execute("""
+            DELETE FROM fraud_alerts f
+            USING alert_duplicates d
+            WHERE d.alert_id = ANY(%s) AND f.alert_id = d.alert_id AND f.txn_timestamp = d.txn_timestamp
+        """, (ids,))
+        deleted += cur.rowcount
+        conn.commit()
+        last_id = ids[-1]
+    cur.execute("DROP TABLE alert_duplicates")
+    conn.commit()
+    cur.close()
+    return deleted
+
+
+# ---------------------------
+# 2️⃣ Unique index, without blocking writers
+# ---------------------------
+def partitions(cur):
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'fraud_alerts'::regclass
+        ORDER BY 1
+    """)
+    return [row[0] for row in cur.fetchall()]
+
+def drop_invalid_indexes(cur):
+    # Left behind by a failed CONCURRENTLY build; they would still reject inserts
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relkind = 'i'
+          AND (i.indrelid = 'fraud_alerts'::regclass
+               OR i.indrelid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'fraud_alerts'::regclass))
+          AND (c.relname = %s OR c.relname LIKE %s)
+    """, (ALERT_KEY_INDEX, f"%\\_{ALERT_KEY_INDEX}"))
+    for (name,) in cur.fetchall():
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+def build_alert_key(cur):
+    # cur on an autocommit connection (CONCURRENTLY cannot run in a transaction)
+    columns = ", ".join(db.ALERT_KEY)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'fraud_alerts'::regclass)")
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {ALERT_KEY_INDEX} ON fraud_alerts ({columns})")
+        return
+    # Invalid until every partition's index is attached; partitions created
+    # in the meantime get theirs from the parent
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {ALERT_KEY_INDEX} ON ONLY fraud_alerts ({columns})")
+    cur.execute(f"""
+        SELECT x.indrelid::regclass::text
+        FROM pg_inherits i
+        JOIN pg_index x ON x.indexrelid = i.inhrelid
+        WHERE i.inhparent = '{ALERT_KEY_INDEX}'::regclass
+    """)
+    attached = {row[0] for row in cur.fetchall()}   # partitions that have theirs
+    for part in partitions(cur):
+        if part in attached:
+            continue
+        name = f"{part}_{ALERT_KEY_INDEX}"
+        cur.execute(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {part} ({columns})')
+        cur.execute(f'ALTER INDEX {ALERT_KEY_INDEX} ATTACH PARTITION "{name}"')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicate fraud alerts and add the unique alert key.")
+    parser.add_argument("--batch", type=int, default=DEDUPE_BATCH, help="alerts deleted per transaction")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="dedupe passes to try when new duplicates break the index build")
+    parser.add_argument("--dry-run", action="store_true", help="count duplicates, change nothing")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    cur = conn.cursor()
+    if has_alert_key(cur):
+        raise SystemExit("fraud_alerts already has a unique alert key.")
+    # The key includes txn_timestamp: add it / fill it in on databases that predate it
+    if args.dry_run:
+        if not has_alert_txn_timestamp(cur):
+            raise SystemExit("fraud_alerts.txn_timestamp is missing or incomplete; run without --dry-run to fill it.")
+    else:
+        filled = install_alert_txn_timestamp(cur)
+        conn.commit()
+        if filled:
+            print(f"Filled in txn_timestamp for {filled} alerts.")
+    extra, keys = count_duplicates(cur)
+    print(f"{extra} duplicate alerts over {keys} (txn_id, rule_id, txn_timestamp) keys.")
+    if args.dry_run:
+        raise SystemExit(0)
+    conn.commit()
+
+    ddl = db.connect()
+    ddl.autocommit = True
+    ddl_cur = ddl.cursor()
+    start = time.perf_counter()
+    for attempt in range(1, args.retries + 1):
+        print(f"Deleted {delete_duplicates(conn, args.batch)} duplicate alerts.")
+        drop_invalid_indexes(ddl_cur)
+        try:
+            build_alert_key(ddl_cur)
+            break
+        except psycopg2.errors.UniqueViolation as e:
+            print(f"Index build hit a new duplicate ({e.diag.message_detail}); retrying.")
+    else:
+        drop_invalid_indexes(ddl_cur)
+        raise SystemExit(f"New duplicates kept arriving; {ALERT_KEY_INDEX} was not built.")
+    print(f"Unique alert key {ALERT_KEY_INDEX} is ready ({time.perf_counter() - start:.1f}s).")
+    ddl_cur.close()
+    ddl.close()
+    cur.close()
+    conn.close()
@@ -0,0 +1,324 @@
+# detection_daemon.py
+#
+# Real-time scoring outside the writer's transaction. With
+#   python fraud_detect.py --mode notify
+# a statement-level AFTER INSERT trigger only sends NOTIFY fraud_txns with
+# the new rows' txn_id:account_id pairs (NOTIFY_CHUNK per notification), so
+# an insert no longer pays for scoring. This daemon LISTENs, coalesces the
+# notifications into micro-batches (--batch-size rows or --batch-wait-ms,
+# whichever comes first), fetches each batch in one query, scores it with
+# the Python rules (rules.json, same profile as fraud_alerts.py) and writes
+# the alerts through AlertWriter.
+#
+# Notifications are delivered on commit, so every notified row is visible
+# when it is fetched. Each daemon keeps a checkpoint in detector_state
+# (detector_state.py): on start it LISTENs, scores everything inserted after
+# the checkpoint, then follows the notifications, so a restart or a lost
+# connection leaves no gap (with the same late-commit caveat as the batch
+# detectors); the process exits on connection errors and is meant to be
+# restarted by its supervisor. Alerts are upserts (db.ALERT_ON_CONFLICT),
+# so a row in flight during start-up that gets scored twice does not
+# duplicate them.
+#
+# Scale out with --num-shards: each daemon scores the accounts with
+# account_id % num_shards == shard (read from the payload, so other shards'
+# rows are never fetched) and has its own checkpoint.
+#
+#   python fraud_detect.py --mode notify
+#   python detection_daemon.py
+#   python detection_daemon.py --shard 0 --num-shards 4 &  # ... up to --shard 3
+#
+# With no checkpoint yet, the daemon starts after the newest transaction;
+# older rows are the batch detectors' job.
+
+import argparse
+import select
+import signal
+import statistics
+import time
+
+import db
+import metrics
+from account_devices import DeviceIndex
+from alert_sink import AlertWriter
+from detector_state import load_watermark, save_watermark
+from rules import RuleEngine, Txn
+
+DETECTOR = "detection_daemon"
+CHANNEL = "fraud_txns"
+NOTIFY_CHUNK = 200        # pairs per notification: at most ~8 KB, the payload limit
+RULE_PROFILE = "fraud_alerts"
+BATCH_SIZE = 1000         # transactions per micro-batch
+BATCH_WAIT_MS = 100       # max wait after the first pending notification
+CATCH_UP_BATCH = 10000    # transactions per batch while catching up
+REPORT_EVERY_S = 10       # seconds between progress lines
+
+TXN_COLUMNS = "t.txn_id, t.account_id, t.amount, t.txn_timestamp, t.geo_lat, t.geo_lng, t.device_id"   # rules.Txn
+
+
+# ---------------------------
+# 1️⃣ Notify trigger
+# ---------------------------
+# Installed by fraud_detect.py --mode notify. Payload: 'txn_id:account_id,...'
+NOTIFY_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION trg_notify_new_txns()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', chunk)
+    FROM (
+        SELECT string_agg(txn_id || ':' || account_id, ',') AS chunk
+        FROM (SELECT txn_id, account_id, (row_number() OVER () - 1) / {NOTIFY_CHUNK} AS part
+              FROM new_txns) n
+        GROUP BY part
+    ) c;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_txn_notify ON transactions;
+CREATE TRIGGER trg_txn_notify
+AFTER INSERT ON transactions
+REFERENCING NEW TABLE AS new_txns
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_notify_new_txns();
+"""
+
+
+# ---------------------------
+# 2️⃣ Daemon
+# ---------------------------
+class DetectionDaemon:
+
+    def __init__(self, args):
+        self.shard, self.num_shards = args.shard, args.num_shards
+        self.detector = DETECTOR if self.num_shards == 1 else f"{DETECTOR}_{self.shard}_of_{self.num_shards}"
+        self.batch_size = args.batch_size
+        self.batch_wait = args.batch_wait_ms / 1000
+        self.conn = db.connect()
+        self.cur = self.conn.cursor()
+        # One daemon per checkpoint; the session lock goes away with the connection
+        self.cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (self.detector,))
+        if not self.cur.fetchone()[0]:
+            raise SystemExit(f"Another {self.detector} is already running.")
+        self.engine = RuleEngine.load(args.profile)
+        if self.engine.uses_devices:
+            with metrics.timed("load_devices"):
+                self.engine.attach_devices(DeviceIndex.load(self.cur, self.shard, self.num_shards))
+            print(f"Loaded {len(self.engine.devices)} account/device pairs.")
+        # Alerts on their own connection; each batch is flushed (and committed)
+        # before its checkpoint is saved
+        self.alert_writer = AlertWriter(db.connect(), flush_size=max(5000, self.batch_size * 10),
+                                        flush_interval=float("inf"), method=args.write_method)
+        self.pending = {}            # txn_id -> monotonic time its notification arrived
+        self.high_water = 0          # highest txn_id notified or scored so far
+        self.listen_max = 0          # newest txn_id before LISTEN
+        self.skip = set()            # notified rows the catch-up already scored
+        self.scored = 0
+        self.alerts = 0
+        self.latencies_ms = []       # notification to alerts committed, since the last report
+        self.stop = False
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self.pending), "notified_transactions")
+
+    # --- input ---
+    def listen(self):
+        # Before catching up, so rows inserted meanwhile are notified rather than missed
+        self.cur.execute("SELECT COALESCE(max(txn_id), 0) FROM transactions")
+        self.listen_max = self.cur.fetchone()[0]
+        self.conn.commit()
+        self.listen_conn = db.connect()
+        self.listen_conn.autocommit = True
+        self.listen_conn.cursor().execute(f"LISTEN {CHANNEL}")
+
+    def receive(self, timeout):
+        # Wait up to `timeout` seconds; queue the notified txn_ids of this shard
+        if select.select([self.listen_conn], [], [], timeout) == ([], [], []):
+            return
+        self.listen_conn.poll()
+        now = time.monotonic()
+        for notify in self.listen_conn.notifies:
+            for pair in notify.payload.split(","):
+                txn_id, account_id = map(int, pair.split(":"))
+                if account_id % self.num_shards != self.shard:
+                    continue
+                if txn_id in self.skip:
+                    self.skip.discard(txn_id)
+                    continue
+                self.pending.setdefault(txn_id, now)
+                self.high_water = max(self.high_water, txn_id)
+        self.listen_conn.notifies.clear()
+
+    # --- scoring ---
+    def warm_accounts(self, rows, txn_ids):
+        # Context of accounts seen for the first time: their recent rows, the
+        # rows inside the rules' lookback, and the last located row, excluding
+        # rows still to be scored (this batch, pending, not yet notified)
+        new_ids = list({r[1] for r in rows if not self.engine.knows(r[1])})
+        if not new_ids:
+            return
+        params = {"accounts": new_ids, "batch": txn_ids + list(self.pending), "high_water": self.high_water,
+                  "recent": self.engine.history_size or 0,
+                  "since": min(r[3] for r in rows) - self.engine.lookback, "until": max(r[3] for r in rows)}
+        scope = """t.account_id = a.account_id AND t.txn_id <= %(high_water)s
+                   AND t.txn_id <> ALL(%(batch)s::BIGINT[]) AND t.txn_timestamp <= %(until)s"""
+        with metrics.timed("warm_accounts"):
+            self.cur.execute(f"""
+                SELECT t.* FROM unnest(%(accounts)s::BIGINT[]) AS a(account_id)
+                CROSS JOIN LATERAL (
+                    (SELECT {TXN_COLUMNS} FROM transactions t WHERE {scope}
+                     ORDER BY t.txn_timestamp DESC, t.txn_id DESC LIMIT %(recent)s)
+                    UNION
+                    (SELECT {TXN_COLUMNS} FROM transactions t WHERE {scope} AND t.txn_timestamp >= %(since)s)
+                    UNION
+                    (SELECT {TXN_COLUMNS} FROM transactions t WHERE {scope} AND t.geo_lat IS NOT NULL
+                     ORDER BY t.txn_timestamp DESC, t.txn_id DESC LIMIT 1)
+                ) t
+                ORDER BY t.txn_timestamp, t.txn_id
+            """, params)
+            history = self.cur.fetchall()
+        for account_id in new_ids:
+            self.engine.context(account_id)
+        for row in history:
+            self.engine.observe(Txn._make(row))
+
+    def score(self, rows, notified_at=None):
+        # Score rows (already fetched, time ordered), commit their alerts, then the checkpoint
+        if not rows:
+            return
+        self.warm_accounts(rows, [r[0] for r in rows])
+        with metrics.timed("score_batch"):
+            for row in rows:
+                txn = Txn._make(row)
+                for alert in self.engine.evaluate(txn):
+                    self.alert_writer.add(txn.txn_id, txn.txn_timestamp, txn.account_id, alert['rule_id'],
+                                          alert['reason'], alert['severity'], alert['score'])
+                    self.alerts += 1
+        self.alert_writer.flush()
+        last = max(rows, key=lambda r: r[0])
+        if last[0] > self.last_txn_id:
+            self.last_txn_id = last[0]
+            save_watermark(self.cur, self.detector, last[0], last[3])
+        self.conn.commit()
+        self.scored += len(rows)
+        self.high_water = max(self.high_water, last[0])
+        metrics.count_rows(len(rows))
+        if notified_at:
+            done = time.monotonic()
+            self.latencies_ms.extend((done - t) * 1000 for t in notified_at)
+
+    def score_pending(self):
+        batch = sorted(self.pending, key=self.pending.get)[:self.batch_size]
+        notified_at = [self.pending.pop(txn_id) for txn_id in batch]
+        with metrics.timed("fetch_batch"):
+            self.cur.execute(f"""
+                SELECT {TXN_COLUMNS} FROM transactions t
+                WHERE t.txn_id = ANY(%s::BIGINT[])
+                ORDER BY t.txn_timestamp, t.txn_id
+            """, (batch,))
+            rows = self.cur.fetchall()
+        self.score(rows, notified_at)
+
+    def catch_up(self):
+        # Score this shard's rows inserted after the checkpoint, CATCH_UP_BATCH at a time
+        self.last_txn_id, last_ts = load_watermark(self.cur, self.detector)
+        if last_ts is None:
+            self.cur.execute("SELECT txn_id, txn_timestamp FROM transactions ORDER BY txn_id DESC LIMIT 1")
+            newest = self.cur.fetchone()
+            if newest:
+                self.last_txn_id = newest[0]
+                save_watermark(self.cur, self.detector, *newest)
+            print(f"No checkpoint yet: starting after txn_id {self.last_txn_id}.")
+        self.conn.commit()
+        self.cur.execute("SELECT COALESCE(max(txn_id), 0) FROM transactions")
+        upto = self.cur.fetchone()[0]
+        shard_filter = "AND t.account_id %% %(num_shards)s = %(shard)s" if self.num_shards > 1 else ""
+        start, caught_up = time.perf_counter(), 0
+        after = self.last_txn_id
+        while after < upto:
+            with metrics.timed("fetch_catch_up"):
+                self.cur.execute(f"""
+                    SELECT * FROM (
+                        SELECT {TXN_COLUMNS} FROM transactions t
+                        WHERE t.txn_id > %(after)s AND t.txn_id <= %(upto)s {shard_filter}
+                        ORDER BY t.txn_id
+                        LIMIT %(limit)s
+                    ) b
+                    ORDER BY txn_timestamp, txn_id
+                """, {"after": after, "upto": upto, "num_shards": self.num_shards, "shard": self.shard,
+                      "limit": CATCH_UP_BATCH})
+                rows = self.cur.fetchall()
+            if not rows:
+                break
+            after = max(r[0] for r in rows)
+            self.high_water = after
+            self.score(rows)
+            # Rows inserted since LISTEN are also notified
+            self.skip.update(r[0] for r in rows if r[0] > self.listen_max)
+            caught_up += len(rows)
+        self.high_water = upto
+        print(f"Caught up: {caught_up} transactions scored ({time.perf_counter() - start:.1f}s); "
+              f"listening on {CHANNEL}.", flush=True)
+
+    # --- main loop ---
+    def report(self):
+        latencies, self.latencies_ms = self.latencies_ms, []
+        line = f"scored={self.scored} alerts={self.alerts} pending={len(self.pending)} checkpoint={self.last_txn_id}"
+        if latencies:
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            line += (f" notify_to_alert_ms p50={statistics.median(latencies):.1f} "
+                     f"p95={p95:.1f} max={latencies[-1]:.1f}")
+        print(line, flush=True)
+        metrics.flush()
+
+    def run(self):
+        self.listen()
+        self.catch_up()
+        next_report = time.monotonic() + REPORT_EVERY_S
+        while not self.stop:
+            if self.pending:
+                # Coalesce: wait until the oldest pending row is batch_wait old or the batch is full
+                wait = min(self.pending.values()) + self.batch_wait - time.monotonic()
+                if len(self.pending) >= self.batch_size or wait <= 0:
+                    self.score_pending()
+                    continue
+            else:
+                wait = max(0.0, next_report - time.monotonic())
+            self.receive(min(wait, 1.0))
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report = time.monotonic() + REPORT_EVERY_S
+        # Drain what was already notified
+        while self.pending:
+            self.score_pending()
+        self.report()
+        print(self.engine.summary())
+        self.alert_writer.close()
+        self.alert_writer.conn.close()
+        self.listen_conn.close()
+        self.cur.close()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score transactions as they are inserted (LISTEN/NOTIFY).")
+    parser.add_argument("--profile", default=RULE_PROFILE, help="rule profile in rules.json")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="transactions per micro-batch")
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS,
+                        help="max wait after the first pending notification before scoring")
+    parser.add_argument("--shard", type=int, default=0, help="this daemon's shard (account_id %% num-shards)")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--write-method", choices=["copy", "values", "prepared"], default="values",
+                        help="alert write method (see alert_sink.py)")
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.num_shards:
+        parser.error("--shard must be in [0, --num-shards)")
+
+    metrics.init(DETECTOR)   # no-op unless FRAUD_METRICS_* is set
+    daemon = DetectionDaemon(args)
+
+    def request_stop(signum, frame):
+        daemon.stop = True
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, request_stop)
+    daemon.run()
+    metrics.finish()
@@ -0,0 +1,129 @@
+# detector_state.py
+#
+# Scoring checkpoints for the batch detectors (fraud_generate*.py).
+# Each detector remembers the highest txn_id it has scored, so a run only
+# reads transactions inserted since the previous run instead of
+# re-checking every transaction that never produced an alert.
+#
+# txn_id comes from a sequence, so a transaction whose insert commits after
+# a later txn_id has already been scored is not picked up; run the detectors
+# against committed, quiesced data (e.g. after the daily load).
+#
+# New rows are found by txn_id alone, however old their txn_timestamp (a
+# backfill of last year's data is still scored); on the partitioned
+# transactions table (partition_manager.py) that is one probe of each
+# partition's txn_id index. The velocity history query carries explicit
+# txn_timestamp bounds, so the planner only visits the partitions inside the
+# rules' window. The last-location lookup is bounded from above only: the
+# latest located row may be arbitrarily old, so it can reach every older
+# partition.
+
+import metrics
+from partition_manager import has_alert_txn_timestamp
+
+DETECTOR_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS detector_state (
+    detector            TEXT PRIMARY KEY,           -- e.g. 'fraud_generate_advanced'
+    last_txn_id         BIGINT NOT NULL DEFAULT 0,  -- highest txn_id already scored
+    last_txn_timestamp  TIMESTAMPTZ,                -- its txn_timestamp (informational)
+    updated_at          TIMESTAMPTZ DEFAULT now()
+);
+"""
+
+
+def load_watermark(cur, detector):
+    # Returns (last_txn_id, last_txn_timestamp); the timestamp is None until the
+    # first run saves a checkpoint. The state row stays locked until commit,
+    # so two runs of the same detector cannot overlap.
+    with metrics.timed("load_watermark"):
+        cur.execute(DETECTOR_STATE_SQL)
+        cur.execute("""
+            INSERT INTO detector_state(detector) VALUES (%s)
+            ON CONFLICT (detector) DO NOTHING
+        """, (detector,))
+        cur.execute("""
+            SELECT last_txn_id, last_txn_timestamp FROM detector_state
+            WHERE detector = %s
+            FOR UPDATE
+        """, (detector,))
+        return cur.fetchone()
+
+
+def save_watermark(cur, detector, last_txn_id, last_txn_timestamp):
+    with metrics.timed("save_watermark"):
+        cur.execute("""
+            UPDATE detector_state
+            SET last_txn_id = %s, last_txn_timestamp = %s, updated_at = now()
+            WHERE detector = %s
+        """, (last_txn_id, last_txn_timestamp, detector))
+
+
+def fetch_new_transactions(cur, columns, last_txn_id, last_txn_timestamp):
+    # On the very first run there is no checkpoint yet, so keep the old
+    # behaviour of skipping transactions that already carry an alert.
+    # Alerts older than fraud_alerts.txn_timestamp may not have it filled in:
+    # then they are matched on txn_id alone.
+    with metrics.timed("fetch_new_transactions"):
+        if last_txn_timestamp is None:
+            same_txn = "fa.txn_id = t.txn_id"
+            if has_alert_txn_timestamp(cur):
+                same_txn += " AND fa.txn_timestamp = t.txn_timestamp"   # partition pruning
+            cur.execute(f"""
+                SELECT {columns}
+                FROM transactions t
+                WHERE t.txn_id > %s
+                  AND NOT EXISTS (SELECT 1 FROM fraud_alerts fa WHERE {same_txn})
+                ORDER BY t.txn_timestamp, t.txn_id
+            """, (last_txn_id,))
+        else:
+            cur.execute(f"""
+                SELECT {columns}
+                FROM transactions t
+                WHERE t.txn_id > %s
+                ORDER BY t.txn_timestamp, t.txn_id
+            """, (last_txn_id,))
+        return cur.fetchall()
+
+
+def fetch_history(cur, columns, last_txn_id, window, batch_start=None, with_last_location=False):
+    # Already-scored rows the rules need to see at the batch boundary:
+    #  - every older row inside `window` before each account's first new txn
+    #    (and any older row interleaved with the new ones), for velocity;
+    #  - optionally the latest located row before that, for geo mismatch.
+    # batch_start is the earliest txn_timestamp among the new rows; it bounds
+    # the window scan by time so partitions outside the window are pruned.
+    # The last-location scan has no lower bound (compare: "last" wants the
+    # latest located row however old), only the upper one.
+    if batch_start is None:
+        return []
+    last_location = f"""
+        UNION ALL
+        SELECT * FROM (
+            SELECT DISTINCT ON (t.account_id) {columns}
+            FROM transactions t
+            JOIN batch b ON b.account_id = t.account_id
+            WHERE t.txn_id <= %(last_txn_id)s
+              AND t.txn_timestamp < b.first_ts - %(window)s
+              AND t.geo_lat IS NOT NULL AND t.geo_lat <> 0
+              AND t.geo_lng IS NOT NULL AND t.geo_lng <> 0
+            ORDER BY t.account_id, t.txn_timestamp DESC, t.txn_id DESC
+        ) last_located
+    """ if with_last_location else ""
+    with metrics.timed("fetch_history"):
+        cur.execute(f"""
+            WITH batch AS (
+                SELECT account_id, MIN(txn_timestamp) AS first_ts
+                FROM transactions
+                WHERE txn_id > %(last_txn_id)s
+                  AND txn_timestamp >= %(batch_start)s
+                GROUP BY account_id
+            )
+            SELECT {columns}
+            FROM transactions t
+            JOIN batch b ON b.account_id = t.account_id
+            WHERE t.txn_id <= %(last_txn_id)s
+              AND t.txn_timestamp >= %(batch_start)s - %(window)s
+              AND t.txn_timestamp >= b.first_ts - %(window)s
+            {last_location}
+        """, {"last_txn_id": last_txn_id, "window": window, "batch_start": batch_start})
+        return cur.fetchall()
@@ -0,0 +1,304 @@
+# export_parquet.py
+#
+# Offline copy of transactions and fraud_alerts for investigations and
+# model work, so analysts read Parquet files instead of the OLTP tables.
+# Rows leave PostgreSQL through COPY ... TO STDOUT, are typed on the way
+# (int64 ids, float64 amounts / scores / coordinates, UTC microsecond
+# timestamps, strings for the rest) and land in one directory per UTC day:
+#
+#   exports/transactions/day=2025-10-18/part-000000017001-000000017572.parquet
+#   exports/fraud_alerts/day=2025-10-18/alerts.parquet
+#   exports/_manifest.json
+#
+# Runs are incremental. _manifest.json keeps the highest txn_id exported and
+# the fraud_alerts updated_at watermark:
+#   transactions - rows above the last txn_id are appended as a new part per
+#                  day, named after its txn_id range (transactions are not updated);
+#   fraud_alerts - every day holding an alert inserted or updated since the
+#                  watermark is rewritten (status changes touch old days).
+#                  Deleted alerts leave no trace in updated_at: --recount
+#                  compares every day's alert count with the export and
+#                  rewrites the days that differ (e.g. after dedupe_alerts.py).
+# Part files of a run that did not finish are not in the manifest; the next
+# run removes every part above the manifest's txn_id before exporting.
+# Everything is read in one repeatable-read transaction, so a run is a
+# consistent snapshot. As with detector_state.py, a transaction whose
+# insert commits after a later txn_id was exported is not picked up.
+#
+#   python export_parquet.py                    # incremental, into ./exports
+#   python export_parquet.py --recount          # also pick up deleted alerts
+#   python export_parquet.py --out /data/fraud --full
+#
+# Reading it back (columns without nulls convert to NumPy without copying):
+#   pd.read_parquet("exports/transactions")
+#   pq.read_table("exports/fraud_alerts", filters=[("day", ">=", "2025-10-01")], memory_map=True)
+
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+import db
+
+EXPORT_DIR = "exports"
+MANIFEST = "_manifest.json"
+UPDATE_LAG = timedelta(minutes=10)   # updated_at is the writer's transaction start, not its commit time
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+TXN_SCHEMA = pa.schema([
+    ("txn_id", pa.int64()),
+    ("account_id", pa.int64()),
+    ("merchant_id", pa.int64()),
+    ("device_id", pa.int64()),
+    ("amount", pa.float64()),
+    ("currency", pa.string()),
+    ("txn_timestamp", TIMESTAMP),
+    ("channel", pa.string()),
+    ("status", pa.string()),
+    ("location", pa.string()),
+    ("ip_address", pa.string()),
+    ("geo_lat", pa.float64()),
+    ("geo_lng", pa.float64()),
+    ("merchant_category", pa.string()),
+    ("metadata", pa.string()),   # JSON text
+])
+ALERT_SCHEMA = pa.schema([
+    ("alert_id", pa.int64()),
+    ("txn_id", pa.int64()),
+    ("txn_timestamp", TIMESTAMP),
+    ("account_id", pa.int64()),
+    ("rule_id", pa.string()),
+    ("reason", pa.string()),
+    ("severity", pa.string()),
+    ("score", pa.float64()),
+    ("status", pa.string()),
+    ("created_at", TIMESTAMP),
+    ("updated_at", TIMESTAMP),
+    ("analyst_id", pa.int64()),
+])
+
+
+# ---------------------------
+# 1️⃣ COPY into Arrow
+# ---------------------------
+def select_list(schema):
+    # Column expressions matching `schema`: timestamps as epoch microseconds
+    # (no DateStyle parsing) and numerics as float8; inet and jsonb keep
+    # their COPY text form
+    exprs = []
+    for field in schema:
+        if field.type == TIMESTAMP:
+            exprs.append(f"(extract(epoch FROM {field.name}) * 1000000)::bigint")
+        elif field.type == pa.float64():
+            exprs.append(f"{field.name}::float8")
+        else:
+            exprs.append(field.name)
+    return ", ".join(exprs)
+
+
+def copy_batches(cur, query, schema, params=None):
+    # COPY (query) TO STDOUT into a temp file, then yield typed record batches
+    sql = cur.mogrify(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", params).decode()
+    csv_types = {f.name: pa.int64() if f.type == TIMESTAMP else f.type for f in schema}
+    with tempfile.TemporaryFile() as spool:
+        cur.copy_expert(sql, spool)
+        if spool.tell() == 0:   # pyarrow refuses to open an empty CSV
+            return
+        spool.seek(0)
+        reader = pacsv.open_csv(
+            spool,
+            read_options=pacsv.ReadOptions(column_names=schema.names),
+            # COPY writes NULL unquoted and '' quoted
+            convert_options=pacsv.ConvertOptions(column_types=csv_types, strings_can_be_null=True,
+                                                 quoted_strings_can_be_null=False),
+        )
+        for batch in reader:
+            yield pa.RecordBatch.from_arrays(
+                [batch.column(i).cast(field.type) for i, field in enumerate(schema)], schema=schema)
+
+
+def write_parquet(path, schema, batches):
+    # Atomic: readers see the old file or the new one, never half of one
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    rows = 0
+    with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(tmp, path)
+    return rows
+
+
+def day_bounds(day):
+    start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+# ---------------------------
+# 2️⃣ Incremental export
+# ---------------------------
+def empty_manifest():
+    # days: exported part files per day (transactions) / rows per day (fraud_alerts)
+    return {"transactions": {"last_txn_id": 0, "last_txn_timestamp": None, "days": {}},
+            "fraud_alerts": {"last_updated_at": None, "days": {}}}
+
+
+def load_manifest(out):
+    path = os.path.join(out, MANIFEST)
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(out, manifest):
+    tmp = os.path.join(out, f"{MANIFEST}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(out, MANIFEST))
+
+
+def remove_unpublished_parts(out, last_txn_id):
+    # Parts (and .tmp files) of an interrupted run: their range goes past the
+    # manifest's txn_id, and the rerun exports those rows again under new names
+    removed = 0
+    root = os.path.join(out, "transactions")
+    for day_dir in os.listdir(root) if os.path.isdir(root) else []:
+        for name in os.listdir(os.path.join(root, day_dir)):
+            m = re.fullmatch(r"part-(\d+)-(\d+)\.parquet(\.tmp)?", name)
+            if m and (int(m.group(2)) > last_txn_id or m.group(3)):
+                os.remove(os.path.join(root, day_dir, name))
+                removed += 1
+    return removed
+
+
+def export_transactions(cur, out, state):
+    # New txn_ids only, one part file per day they fall on
+    # By txn_id alone, so backfilled rows land in their (old) days too
+    last_txn_id = state["last_txn_id"]
+    removed = remove_unpublished_parts(out, last_txn_id)
+    if removed:
+        print(f"transactions: removed {removed} part files of an unfinished run")
+    cur.execute("""
+        SELECT (txn_timestamp AT TIME ZONE 'UTC')::date AS day, min(txn_id), max(txn_id)
+        FROM transactions
+        WHERE txn_id > %s
+        GROUP BY 1
+        ORDER BY 1
+    """, (last_txn_id,))
+    days = cur.fetchall()
+    rows = 0
+    for day, lo, hi in days:
+        start, end = day_bounds(day)
+        path = os.path.join(out, "transactions", f"day={day}", f"part-{lo:012d}-{hi:012d}.parquet")
+        n = write_parquet(path, TXN_SCHEMA, copy_batches(cur, f"""
+            SELECT {select_list(TXN_SCHEMA)}
+            FROM transactions
+            WHERE txn_timestamp >= %s AND txn_timestamp < %s
+              AND txn_id > %s AND txn_id <= %s
+            ORDER BY txn_id
+        """, TXN_SCHEMA, (start, end, last_txn_id, hi)))
+        state["days"].setdefault(str(day), []).append(os.path.basename(path))
+        rows += n
+    if days:
+        # Checkpoint on the highest txn_id, as detector_state.py does
+        cur.execute("SELECT txn_id, txn_timestamp FROM transactions WHERE txn_id = %s",
+                    (max(hi for _, _, hi in days),))
+        txn_id, txn_timestamp = cur.fetchone()
+        state["last_txn_id"], state["last_txn_timestamp"] = txn_id, txn_timestamp.isoformat()
+    return len(days), rows
+
+
+def export_alerts(cur, out, state, recount=False):
+    # Rewrite each day that has an alert inserted or updated since the watermark
+    # (with recount: or whose alert count differs from the export)
+    last = datetime.fromisoformat(state["last_updated_at"]) if state["last_updated_at"] else None
+    cur.execute("SELECT max(updated_at) FROM fraud_alerts")
+    watermark = cur.fetchone()[0]
+    # Alerts written before txn_timestamp existed and not filled in yet have no day
+    cur.execute("SELECT count(*) FROM fraud_alerts WHERE txn_timestamp IS NULL")
+    undated = cur.fetchone()[0]
+    if undated:
+        print(f"fraud_alerts: skipped {undated} alerts without txn_timestamp; "
+              "fill them in with python partition_manager.py")
+    cur.execute(f"""
+        SELECT DISTINCT (txn_timestamp AT TIME ZONE 'UTC')::date AS day
+        FROM fraud_alerts
+        WHERE txn_timestamp IS NOT NULL {"AND updated_at > %s" if last else ""}
+        ORDER BY 1
+    """, (last - UPDATE_LAG,) if last else None)
+    days = {row[0] for row in cur.fetchall()}
+    if recount:
+        cur.execute("""
+            SELECT (txn_timestamp AT TIME ZONE 'UTC')::date AS day, count(*)
+            FROM fraud_alerts
+            WHERE txn_timestamp IS NOT NULL
+            GROUP BY 1
+        """)
+        counts = {str(day): n for day, n in cur.fetchall()}
+        days |= {date.fromisoformat(day) for day in counts.keys() | state["days"].keys()
+                 if counts.get(day, 0) != state["days"].get(day, 0)}
+    days = sorted(days)
+    rows = 0
+    for day in days:
+        start, end = day_bounds(day)
+        path = os.path.join(out, "fraud_alerts", f"day={day}", "alerts.parquet")
+        # Bounded on txn_timestamp, the partition key, so one partition is read per day
+        n = write_parquet(path, ALERT_SCHEMA, copy_batches(cur, f"""
+            SELECT {select_list(ALERT_SCHEMA)}
+            FROM fraud_alerts
+            WHERE txn_timestamp >= %s AND txn_timestamp < %s
+            ORDER BY alert_id
+        """, ALERT_SCHEMA, (start, end)))
+        state["days"][str(day)] = n
+        rows += n
+    if watermark is not None:
+        state["last_updated_at"] = watermark.isoformat()
+    return len(days), rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export transactions and fraud_alerts to day-partitioned Parquet.")
+    parser.add_argument("--out", default=EXPORT_DIR, help="export directory")
+    parser.add_argument("--tables", nargs="+", choices=["transactions", "fraud_alerts"],
+                        default=["transactions", "fraud_alerts"])
+    parser.add_argument("--full", action="store_true", help="drop the previous export and start over")
+    parser.add_argument("--recount", action="store_true",
+                        help="also rewrite alert days whose count changed, e.g. after deletes (scans fraud_alerts)")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest = load_manifest(args.out)
+    if args.full:
+        fresh = empty_manifest()
+        for table in args.tables:
+            shutil.rmtree(os.path.join(args.out, table), ignore_errors=True)
+            manifest[table] = fresh[table]
+
+    conn = db.connect()
+    # One snapshot for both tables; nothing is written to the database
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    cur = conn.cursor()
+    start = time.perf_counter()
+    for table in args.tables:
+        if table == "transactions":
+            days, rows = export_transactions(cur, args.out, manifest[table])
+        else:
+            days, rows = export_alerts(cur, args.out, manifest[table], recount=args.recount)
+        print(f"{table}: {rows} rows exported over {days} days")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    manifest["exported_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    save_manifest(args.out, manifest)
+    print(f"Export in {args.out} is up to date ({time.perf_counter() - start:.1f}s).")
@@ -56,8 +56,8 @@ CREATE TABLE merchants (
   category      TEXT, -- merchant category code or description
   city          TEXT,
   country       TEXT,
-  -- optional: geometry for geo-enabled merchant location (PostGIS)
-  -- geom       geography(POINT,4326),
+  -- optional: geo_lat / geo_lng and a generated geography column `geog`
+  -- for geo-enabled merchant location (PostGIS, added by geo_postgis.py)
   created_at    TIMESTAMPTZ DEFAULT now()
 );
 
@@ -169,13 +169,12 @@ CREATE TABLE audit_logs (
   created_at  TIMESTAMPTZ DEFAULT now()
 );
 
-CREATE MATERIALIZED VIEW mv_fraud_by_day AS
-SELECT date_trunc('day', fa.created_at) AS day,
-       COUNT(*) AS total_alerts,
-       SUM(CASE WHEN fa.severity IN ('high','critical') THEN 1 ELSE 0 END) AS high_severity
-FROM fraud_alerts fa
-GROUP BY 1
-WITH NO DATA;
+-- Alerts per day: mv_fraud_by_day was never refreshed and a refresh rescans
+-- every alert. Replaced by alert_rollup_hourly, kept current by statement
+-- triggers on fraud_alerts, with the views alert_rollup_daily and
+-- fraud_by_day (day, total_alerts, high_severity) on top. Install and
+-- backfill with:
+--   python alert_rollup.py
 
 
 CREATE OR REPLACE FUNCTION trg_set_updated_at()
@@ -377,3 +376,53 @@ CREATE TRIGGER trg_check_txn
 AFTER INSERT ON transactions
 FOR EACH ROW
 EXECUTE FUNCTION trg_check_txn_for_fraud();
+
+-- Scoring checkpoints for the batch detectors (see detector_state.py)
+CREATE TABLE IF NOT EXISTS detector_state (
+    detector            TEXT PRIMARY KEY,           -- e.g. 'fraud_generate_advanced'
+    last_txn_id         BIGINT NOT NULL DEFAULT 0,  -- highest txn_id already scored
+    last_txn_timestamp  TIMESTAMPTZ,                -- its txn_timestamp (informational)
+    updated_at          TIMESTAMPTZ DEFAULT now()
+);
+
+-- Statement-level variant of the fraud check (trg_check_txns_for_fraud,
+-- FOR EACH STATEMENT ... REFERENCING NEW TABLE AS new_txns) scores a whole
+-- INSERT batch with set-based SQL. Switch between the two with:
+--   python fraud_detect.py --mode row | --mode statement
+-- or only NOTIFY fraud_txns with the new txn_id:account_id pairs, scored
+-- outside the insert by detection_daemon.py:
+--   python fraud_detect.py --mode notify
+
+-- Per-account rolling state read by both fraud triggers (last location and
+-- event-time 1m/10m/1h/24h count and amount windows, see windows.py). Table
+-- and functions live in account_state.py; rebuild from transactions with:
+--   python account_state.py --rebuild
+
+-- Every device each account has used (account_devices: first_seen, last_seen,
+-- use_count), the NEW_DEVICE lookup of both triggers. fraud_detect.py installs
+-- it with a statement-level maintenance trigger; rebuild with:
+--   python account_devices.py --rebuild
+
+-- Dashboard support (see alert_watermark.py): updated_at trigger on fraud_alerts
+-- and keyset indexes for the paginated alert tables. Install with:
+--   python alert_watermark.py
+
+-- Alerts carry their transaction's timestamp, the partition key of both tables
+-- once they are partitioned by txn_timestamp (see partition_manager.py).
+-- fraud_detect.py and dedupe_alerts.py add and fill it on their own as well:
+ALTER TABLE fraud_alerts ADD COLUMN IF NOT EXISTS txn_timestamp TIMESTAMPTZ;
+UPDATE fraud_alerts fa SET txn_timestamp = t.txn_timestamp
+FROM transactions t WHERE t.txn_id = fa.txn_id AND fa.txn_timestamp IS NULL;
+-- NULLs never match each other in the unique key below, so writers must set it
+ALTER TABLE fraud_alerts ALTER COLUMN txn_timestamp SET NOT NULL;
+-- One alert per transaction and rule; every writer upserts on this key.
+-- On a table that already has duplicates use: python dedupe_alerts.py
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alert_txn_rule ON fraud_alerts(txn_id, rule_id, txn_timestamp);
+--   python partition_manager.py --convert --granularity month   -- one-off
+--   python partition_manager.py --premake 3 --retain 13          -- cron
+
+-- PostGIS geography columns (transactions.geog, merchants.geog, generated from
+-- geo_lat / geo_lng) with GiST indexes; the triggers' geo_distance_km() then
+-- uses ST_Distance. Impossible-travel alerts for rows loaded without triggers:
+--   python geo_postgis.py
+--   python geo_postgis.py --backlog --since 2025-10-01
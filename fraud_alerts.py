@@ -1,104 +1,162 @@
-import psycopg2
-from datetime import datetime, timedelta
-from geopy.distance import geodesic
+import argparse
+import db
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from account_devices import DeviceIndex
+from alert_sink import AlertWriter
+from rules import RuleEngine, Txn, merge_stats
+from stage_timer import StageTimer
+import metrics
 
 # ---------------------------
-# 1️⃣ Connect to PostgreSQL
+# 1️⃣ Connection settings
 # ---------------------------
-conn = psycopg2.connect(
-    host="localhost",
-    database="postgres",  # your DB name
-    user="postgres",
-    password="Paused.0"
-)
-cur = conn.cursor()
+# Every shard opens its own connections (one to read, one for alerts)
 
 # ---------------------------
-# 2️⃣ Parameters / Thresholds
+# 2️⃣ Parameters
 # ---------------------------
-HIGH_VALUE_THRESHOLD = 1000000     # transactions above this flagged
-VELOCITY_COUNT = 3                 # >3 txns in short period
-VELOCITY_WINDOW_MIN = 10           # minutes
-GEO_DISTANCE_KM = 500              # km for geo-mismatch
+RULE_PROFILE = "fraud_alerts"      # rule thresholds: see rules.json
+STREAM_CHUNK_SIZE = 10000          # rows per fetch in --stream mode
+ALERT_FLUSH_SIZE = 5000            # alerts buffered per write
+ALERT_FLUSH_INTERVAL_S = 5.0       # max seconds between alert writes
 
-# ---------------------------
-# 3️⃣ Fetch recent transactions
-# ---------------------------
-cur.execute("""
+parser = argparse.ArgumentParser(description="Score all transactions and write fraud alerts.")
+parser.add_argument("--stream", action="store_true",
+                    help="read transactions through a server-side cursor instead of loading them all")
+parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE,
+                    help="rows fetched per round trip in --stream mode")
+parser.add_argument("--flush-size", type=int, default=ALERT_FLUSH_SIZE,
+                    help="alerts buffered before they are written and committed")
+parser.add_argument("--flush-interval", type=float, default=ALERT_FLUSH_INTERVAL_S,
+                    help="max seconds between alert flushes")
+parser.add_argument("--write-method", choices=["copy", "values", "prepared"], default="copy",
+                    help="COPY FROM STDIN, multi-row INSERT, or batched prepared INSERTs for alert flushes")
+parser.add_argument("--workers", type=int, default=1,
+                    help="score accounts in N processes, sharded by account_id %% N (implies --stream)")
+
+# Rule state is per account, so accounts can be split across processes.
+# txn_id breaks timestamp ties so every run sees the same order.
+TXN_QUERY = """
     SELECT txn_id, account_id, amount, txn_timestamp, geo_lat, geo_lng, device_id
     FROM transactions
-    ORDER BY txn_timestamp ASC
-""")
-transactions = cur.fetchall()
+    {shard_filter}
+    ORDER BY txn_timestamp ASC, txn_id ASC
+"""
 
-# Store last transaction per account for velocity / geo check
-account_last_txns = {}   # account_id -> list of (timestamp, lat, lng, device_id)
+# ---------------------------
+# 3️⃣ Score one transaction
+# ---------------------------
+# The rules and their thresholds live in rules.json (profile "fraud_alerts");
+# the engine keeps the last 10 transactions per account for them, and the
+# device check looks the account's devices up in account_devices.
+def process_transaction(txn, engine, alert_writer):
+    txn = Txn._make(txn)
+    alerts = engine.evaluate(txn)
+    for alert in alerts:
+        alert_writer.add(txn.txn_id, txn.txn_timestamp, txn.account_id,
+                         alert['rule_id'], alert['reason'], alert['severity'], alert['score'])
+    return len(alerts)
 
 # ---------------------------
 # 4️⃣ Process transactions
 # ---------------------------
-for txn in transactions:
-    txn_id, account_id, amount, txn_time, geo_lat, geo_lng, device_id = txn
-    alerts = []
-
-    # --- High Value ---
-    if amount > HIGH_VALUE_THRESHOLD:
-        alerts.append({
-            'rule_id': 'HIGH_VALUE',
-            'reason': f'Transaction amount {amount} exceeds threshold',
-            'severity': 'high',
-            'score': 90
-        })
+def score_shard(shard, num_shards, args):
+    label = f"[shard {shard + 1}/{num_shards}] " if num_shards > 1 else ""
+    if num_shards > 1:
+        metrics.reset()   # forked from the parent; this shard's values are merged back there
+    conn = db.connect()
+    timer = StageTimer()   # fetch / score / write wall time
+    # Alerts go through their own connection: each flush commits, while the
+    # read transaction (and its server-side cursor) stays open on `conn`.
+    alert_writer = AlertWriter(db.connect(), flush_size=args.flush_size,
+                               flush_interval=args.flush_interval, method=args.write_method,
+                               timer=timer)
+    # Per-account state for velocity / geo / device checks
+    engine = RuleEngine.load(RULE_PROFILE)
+    if engine.uses_devices:
+        # This shard's accounts only: the same account_id % num_shards split as the query below
+        with timer.stage("fetch"), metrics.timed("load_devices"):
+            engine.attach_devices(DeviceIndex.load(conn.cursor(), shard, num_shards))
 
-    # --- Velocity / Rapid Transactions ---
-    last_txns = account_last_txns.get(account_id, [])
-    recent_txns = [t for t in last_txns if (txn_time - t[0]).total_seconds()/60 <= VELOCITY_WINDOW_MIN]
+    if num_shards > 1:
+        query = TXN_QUERY.format(shard_filter="WHERE account_id %% %s = %s")
+        params = (num_shards, shard)
+    else:
+        query = TXN_QUERY.format(shard_filter="")
+        params = None
 
-    if len(recent_txns) >= VELOCITY_COUNT - 1:  # current txn makes it VELOCITY_COUNT
-        alerts.append({
-            'rule_id': 'VELOCITY',
-            'reason': f'{len(recent_txns)+1} transactions within {VELOCITY_WINDOW_MIN} minutes',
-            'severity': 'medium',
-            'score': 70
-        })
+    rows_done = 0
+    if args.stream:
+        # Server-side cursor: only one chunk of rows is held in memory at a time,
+        # so memory is bounded by the rule engine (10 rows per account) and
+        # the device index.
+        txn_cur = conn.cursor(name=f"fraud_alerts_txns_{shard}")
+        txn_cur.itersize = args.chunk_size
+        with timer.stage("fetch"), metrics.timed("open_cursor"):
+            txn_cur.execute(query, params)
+        chunk_no = 0
+        alerts_done = 0
+        while True:
+            with timer.stage("fetch"), metrics.timed("fetch_chunk"):
+                chunk = txn_cur.fetchmany(args.chunk_size)
+            if not chunk:
+                break
+            chunk_no += 1
+            with timer.stage("score"):
+                for txn in chunk:
+                    alerts_done += process_transaction(txn, engine, alert_writer)
+            rows_done += len(chunk)
+            metrics.count_rows(len(chunk))
+            print(f"{label}Chunk {chunk_no}: {rows_done} transactions scored, {alerts_done} alerts, "
+                  f"{len(engine.contexts)} accounts tracked")
+        txn_cur.close()
+    else:
+        cur = conn.cursor()
+        with timer.stage("fetch"), metrics.timed("fetch_all"):
+            cur.execute(query, params)
+            transactions = cur.fetchall()
+        with timer.stage("score"):
+            for txn in transactions:
+                process_transaction(txn, engine, alert_writer)
+        rows_done = len(transactions)
+        metrics.count_rows(rows_done)
+        cur.close()
 
-    # --- Geo Mismatch ---
-    for t in last_txns:
-        prev_lat, prev_lng = t[1], t[2]
-        if prev_lat is not None and geo_lat is not None:
-            distance = geodesic((prev_lat, prev_lng), (geo_lat, geo_lng)).km
-            if distance > GEO_DISTANCE_KM:
-                alerts.append({
-                    'rule_id': 'GEO_MISMATCH',
-                    'reason': f'Transaction {distance:.1f} km from last txn',
-                    'severity': 'medium',
-                    'score': 75
-                })
-                break  # one alert is enough per txn
+    alert_writer.close()
+    alert_writer.conn.close()
+    print(f"{label}{alert_writer.summary()}")
+    if num_shards == 1:
+        print(engine.summary())
 
-    # --- Device Anomaly ---
-    known_devices = [t[3] for t in last_txns]
-    if device_id not in known_devices and known_devices:
-        alerts.append({
-            'rule_id': 'DEVICE_ANOMALY',
-            'reason': f'New device used for this account',
-            'severity': 'medium',
-            'score': 65
-        })
-
-    # --- Insert alerts ---
-    for alert in alerts:
-        cur.execute("""
-            INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (txn_id, account_id, alert['rule_id'], alert['reason'], alert['severity'], alert['score']))
+    conn.commit()
+    conn.close()
+    return rows_done, alert_writer.alerts_written, engine.stats(), timer.seconds, metrics.snapshot()
 
-    # Update last_txns
-    last_txns.append((txn_time, geo_lat, geo_lng, device_id))
-    # Keep only last 10 transactions per account to save memory
-    account_last_txns[account_id] = last_txns[-10:]
 
-conn.commit()
-cur.close()
-conn.close()
-print("Fraud alerts generated successfully!")
+if __name__ == "__main__":
+    args = parser.parse_args()
+    metrics.init("fraud_alerts")   # no-op unless FRAUD_METRICS_* is set
+    timer = StageTimer()   # with --workers, stage times are summed over the shards
+    if args.workers > 1:
+        args.stream = True
+        # Fork, not spawn: score_shard relies on the parent's metrics.init state
+        # (and resets its inherited values); macOS / Python 3.14 default to spawn
+        with ProcessPoolExecutor(max_workers=args.workers,
+                                 mp_context=multiprocessing.get_context("fork")) as pool:
+            results = list(pool.map(score_shard, range(args.workers),
+                                    [args.workers] * args.workers, [args] * args.workers))
+        print(f"{sum(r[0] for r in results)} transactions scored, "
+              f"{sum(r[1] for r in results)} alerts across {args.workers} shards")
+        print(RuleEngine.load(RULE_PROFILE).summary(merge_stats(r[2] for r in results),
+                                                    sum(r[0] for r in results)))
+        for r in results:
+            metrics.merge(r[4])
+    else:
+        results = [score_shard(0, 1, args)]
+    for r in results:
+        timer.merge(r[3])
+    timer.dump()
+    metrics.record_stages(timer.seconds)
+    metrics.finish()
+    print("Fraud alerts generated successfully!")
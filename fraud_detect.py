@@ -1,85 +1,147 @@
-import psycopg2
-
-conn = psycopg2.connect(
-    host="localhost",
-    database="postgres",
-    user="postgres",
-    password="Paused.0"
-)
+import argparse
+import db
+import metrics
+from account_devices import DEVICES_TRIGGER_SQL, install_account_devices
+from account_state import install_account_state
+from detection_daemon import NOTIFY_TRIGGER_SQL
+from geo_postgis import install_geo_distance
+from partition_manager import install_alert_txn_timestamp
+from rules import profile_config
+from windows import FINEST_WIDTH, WINDOWS, WINDOW_NAMES
+
+metrics.init("fraud_detect")   # no-op unless FRAUD_METRICS_* is set
+conn = db.connect()
 cur = conn.cursor()
 
-sql = """
--- Drop old trigger and function first
+parser = argparse.ArgumentParser(description="Install the fraud-check trigger on transactions.")
+parser.add_argument("--mode", choices=["row", "statement", "notify", "off"], default="row",
+                    help="row: FOR EACH ROW trigger; statement: one set-based pass per INSERT statement; "
+                         "notify: only NOTIFY the new txn_ids, scored by detection_daemon.py; "
+                         "off: no scoring trigger (an external scorer such as ingest_service.py writes alerts); "
+                         "account_devices is still kept up to date")
+args = parser.parse_args()
+
+# Only one of the scoring triggers (or the notify trigger) is attached at a
+# time. account_devices is upserted by the row trigger itself, otherwise by
+# trg_txn_devices.
+DROP_TRIGGERS_SQL = """
 DROP TRIGGER IF EXISTS trg_check_txn ON transactions;
+DROP TRIGGER IF EXISTS trg_check_txn_stmt ON transactions;
+DROP TRIGGER IF EXISTS trg_txn_devices ON transactions;
+DROP TRIGGER IF EXISTS trg_txn_notify ON transactions;
+"""
+
+# The thresholds are the Python detectors' ones, from the "base" profile of
+# rules.json; the velocity window has to be one of the account_txn_state
+# windows (windows.py)
+def trigger_thresholds():
+    params = {r["rule_id"]: r["params"] for r in profile_config("base")["rules"]}
+    minutes = params["VELOCITY"]["window_minutes"]
+    window = next((name for name, seconds, _ in WINDOWS if seconds == minutes * 60), None)
+    if window is None:
+        raise SystemExit(f"VELOCITY window_minutes={minutes} in rules.json: the triggers need one of "
+                         f"the account_txn_state windows ({', '.join(WINDOW_NAMES)})")
+    return {
+        "high_value": params["HIGH_VALUE"]["threshold"],
+        "velocity_window": window,
+        "velocity_minutes": minutes,
+        "velocity_above": params["VELOCITY"]["min_count"] - 1,
+        "geo_km": params["GEO_MISMATCH"]["max_km"],
+        "finest_width": FINEST_WIDTH,   # account_txn_state bucket width, seconds
+    }
+
+# Alerts are inserted ON CONFLICT DO NOTHING: with the unique alert key
+# (dedupe_alerts.py) an alert already written for the same transaction and
+# rule is kept as it is; without the key it is a plain insert.
+ROW_TRIGGER_SQL = """
+-- Drop old function first
 DROP FUNCTION IF EXISTS trg_check_txn_for_fraud();
 
 -- Create enhanced fraud-check function
 CREATE OR REPLACE FUNCTION trg_check_txn_for_fraud()
 RETURNS TRIGGER LANGUAGE plpgsql AS $$
 DECLARE
-    last_txn TIMESTAMP;
-    txn_count INT; 
+    txn_count INT;
+    window_complete BOOLEAN;
     distance_km DOUBLE PRECISION;
+    prev_geo_ts TIMESTAMPTZ;
     prev_lat DOUBLE PRECISION;
     prev_lng DOUBLE PRECISION;
 BEGIN
     -- High-value transaction
-    IF NEW.amount > 100000 THEN
-        INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score)
-        VALUES (NEW.txn_id, NEW.account_id, 'HIGH_VALUE', 'Amount exceeds threshold', 'high', 90.0);
+    IF NEW.amount > {high_value} THEN
+        INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+        VALUES (NEW.txn_id, NEW.txn_timestamp, NEW.account_id, 'HIGH_VALUE', 'Amount exceeds threshold', 'high', 90.0)
+        ON CONFLICT DO NOTHING;
     END IF;
 
-    -- Rapid multiple transactions (velocity)
-    SELECT MAX(txn_timestamp) INTO last_txn
-    FROM transactions
-    WHERE account_id = NEW.account_id
-      AND txn_timestamp > now() - INTERVAL '1 hour';
+    -- Velocity and last location come from the per-account state row; the
+    -- window is the velocity window before this transaction's own timestamp
+    SELECT w.txn_count, w.complete, s.last_geo_ts, s.last_lat, s.last_lng
+    INTO txn_count, window_complete, prev_geo_ts, prev_lat, prev_lng
+    FROM account_txn_state s
+    CROSS JOIN LATERAL txn_windows_get(s.windows, '{velocity_window}', NEW.txn_timestamp) w
+    WHERE s.account_id = NEW.account_id
+    FOR UPDATE OF s;
 
-    SELECT COUNT(*) INTO txn_count
-    FROM transactions
-    WHERE account_id = NEW.account_id
-      AND txn_timestamp > now() - INTERVAL '1 hour';
+    -- Rapid multiple transactions (velocity), this one included. A late
+    -- transaction the state has moved past is counted from the table.
+    IF window_complete IS NOT FALSE THEN
+        txn_count := COALESCE(txn_count, 0) + 1;
+    ELSE
+        SELECT COUNT(*) INTO txn_count
+        FROM transactions
+        WHERE account_id = NEW.account_id
+          AND txn_timestamp > NEW.txn_timestamp - INTERVAL '{velocity_minutes} minutes'
+          AND txn_timestamp <= NEW.txn_timestamp;
+    END IF;
 
-    IF txn_count > 3 THEN
-        INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score)
-        VALUES (NEW.txn_id, NEW.account_id, 'VELOCITY', 'More than 3 transactions in 1 hour', 'medium', 70.0);
+    IF txn_count > {velocity_above} THEN
+        INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+        VALUES (NEW.txn_id, NEW.txn_timestamp, NEW.account_id, 'VELOCITY', 'More than {velocity_above} transactions in {velocity_minutes} minutes', 'medium', 70.0)
+        ON CONFLICT DO NOTHING;
     END IF;
 
-    -- Geo-mismatch
-    SELECT geo_lat, geo_lng INTO prev_lat, prev_lng
-    FROM transactions
-    WHERE account_id = NEW.account_id
-    ORDER BY txn_timestamp DESC
-    LIMIT 1;
-
-    IF prev_lat IS NOT NULL AND prev_lng IS NOT NULL THEN
-        distance_km := 6371 * acos(
-            cos(radians(prev_lat)) * cos(radians(NEW.geo_lat)) *
-            cos(radians(NEW.geo_lng) - radians(prev_lng)) +
-            sin(radians(prev_lat)) * sin(radians(NEW.geo_lat))
-        );
-        IF distance_km > 500 THEN
-            INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score)
-            VALUES (NEW.txn_id, NEW.account_id, 'GEO_MISMATCH', 'Transaction location far from last txn', 'high', 85.0);
+    -- Geo-mismatch and impossible travel against the last known location
+    -- (geo_distance_km: PostGIS ST_Distance when installed, see geo_postgis.py)
+    IF prev_lat IS NOT NULL AND prev_lng IS NOT NULL
+       AND NEW.geo_lat IS NOT NULL AND NEW.geo_lng IS NOT NULL THEN
+        distance_km := geo_distance_km(prev_lat, prev_lng, NEW.geo_lat, NEW.geo_lng);
+        IF distance_km > {geo_km} THEN
+            INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+            VALUES (NEW.txn_id, NEW.txn_timestamp, NEW.account_id, 'GEO_MISMATCH', 'Transaction location far from last txn', 'high', 85.0)
+            ON CONFLICT DO NOTHING;
+        END IF;
+        -- Faster than 900 km/h since then; hops under 100 km are location noise
+        IF distance_km > 100
+           AND distance_km > 900 * abs(extract(epoch FROM NEW.txn_timestamp - prev_geo_ts)) / 3600 THEN
+            INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+            VALUES (NEW.txn_id, NEW.txn_timestamp, NEW.account_id, 'IMPOSSIBLE_TRAVEL', 'Too far from last location for the time elapsed', 'high', 95.0)
+            ON CONFLICT DO NOTHING;
         END IF;
     END IF;
 
-    -- New/unknown device
-    IF NOT EXISTS (
-        SELECT 1 FROM transactions t
-        WHERE t.account_id = NEW.account_id
-          AND t.device_id = NEW.device_id
-    ) THEN
-        INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score)
-        VALUES (NEW.txn_id, NEW.account_id, 'NEW_DEVICE', 'Transaction from new device', 'medium', 60.0);
+    -- New/unknown device: the account_devices upsert reports a first use
+    IF NEW.device_id IS NOT NULL
+       AND account_devices_push(NEW.account_id, NEW.device_id, NEW.txn_timestamp) THEN
+        INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+        VALUES (NEW.txn_id, NEW.txn_timestamp, NEW.account_id, 'NEW_DEVICE', 'Transaction from new device', 'medium', 60.0)
+        ON CONFLICT DO NOTHING;
     END IF;
 
     -- Suspicious merchant category
     IF NEW.merchant_category IN ('Gambling', 'Crypto') THEN
-        INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score)
-        VALUES (NEW.txn_id, NEW.account_id, 'SUSPICIOUS_MERCHANT', 'High-risk merchant category', 'high', 80.0);
+        INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+        VALUES (NEW.txn_id, NEW.txn_timestamp, NEW.account_id, 'SUSPICIOUS_MERCHANT', 'High-risk merchant category', 'high', 80.0)
+        ON CONFLICT DO NOTHING;
     END IF;
 
+    -- Fold this transaction into the account state
+    PERFORM account_txn_state_push(
+        NEW.account_id, NEW.txn_timestamp,
+        CASE WHEN NEW.geo_lat IS NOT NULL AND NEW.geo_lng IS NOT NULL THEN NEW.txn_timestamp END,
+        NEW.geo_lat, NEW.geo_lng, NEW.amount);
+
     RETURN NEW;
 END;
 $$;
@@ -91,9 +153,180 @@ FOR EACH ROW
 EXECUTE FUNCTION trg_check_txn_for_fraud();
 """
 
-cur.execute(sql)
-conn.commit()
+# Same rules as the row trigger, evaluated once per INSERT statement over the
+# transition table. Velocity, geo and travel read account_txn_state plus
+# earlier rows of the batch; new-device looks the batch's pairs up in
+# account_devices, which trg_txn_devices updates after this trigger. All
+# alerts go in one INSERT.
+STATEMENT_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION trg_check_txns_for_fraud()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    -- Serialise concurrent batches touching the same accounts
+    PERFORM 1 FROM account_txn_state
+    WHERE account_id IN (SELECT account_id FROM new_txns)
+    ORDER BY account_id
+    FOR UPDATE;
+
+    INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+    WITH batch AS (
+        SELECT txn_id, account_id, amount, txn_timestamp, geo_lat, geo_lng, device_id, merchant_category
+        FROM new_txns
+    ),
+    state AS (
+        SELECT s.*
+        FROM account_txn_state s
+        WHERE s.account_id IN (SELECT account_id FROM batch)
+    ),
+    -- Velocity per transaction, over the window before its own timestamp:
+    -- the state's window plus the batch rows in that window (itself included).
+    -- Late rows the state has moved past are counted from the table.
+    velocity AS (
+        SELECT b.txn_id,
+               CASE WHEN w.complete
+                    THEN w.txn_count + COUNT(*) OVER (PARTITION BY b.account_id ORDER BY b.txn_timestamp
+                                                      RANGE BETWEEN INTERVAL '{velocity_minutes} minutes' PRECEDING AND CURRENT ROW)
+                    ELSE (SELECT COUNT(*)
+                          FROM transactions t
+                          WHERE t.account_id = b.account_id
+                            AND t.txn_timestamp > b.txn_timestamp - INTERVAL '{velocity_minutes} minutes'
+                            AND t.txn_timestamp <= b.txn_timestamp)
+               END AS txn_count
+        FROM batch b
+        LEFT JOIN state s ON s.account_id = b.account_id
+        CROSS JOIN LATERAL txn_windows_get(s.windows, '{velocity_window}', b.txn_timestamp) w
+    ),
+    -- Geo: located rows of the batch, preceded by the last known location
+    timeline AS (
+        SELECT txn_id, account_id, txn_timestamp, geo_lat, geo_lng
+        FROM batch
+        WHERE geo_lat IS NOT NULL AND geo_lng IS NOT NULL
+        UNION ALL
+        SELECT NULL, account_id, last_geo_ts, last_lat, last_lng
+        FROM state
+        WHERE last_geo_ts IS NOT NULL
+    ),
+    prev AS (
+        SELECT txn_id, txn_timestamp, geo_lat, geo_lng,
+               LAG(geo_lat) OVER w AS prev_lat,
+               LAG(geo_lng) OVER w AS prev_lng,
+               LAG(txn_timestamp) OVER w AS prev_ts
+        FROM timeline
+        WINDOW w AS (PARTITION BY account_id ORDER BY txn_timestamp, txn_id NULLS FIRST)
+    ),
+    moves AS (
+        SELECT txn_id,
+               geo_distance_km(prev_lat, prev_lng, geo_lat, geo_lng) AS distance_km,
+               abs(extract(epoch FROM txn_timestamp - prev_ts)) / 3600 AS hours
+        FROM prev
+        WHERE txn_id IS NOT NULL AND prev_lat IS NOT NULL AND prev_lng IS NOT NULL
+    ),
+    -- New device: not in account_devices before this batch, first use inside it
+    known_devices AS (
+        SELECT d.account_id, d.device_id
+        FROM account_devices d
+        JOIN (SELECT DISTINCT account_id, device_id FROM batch) b
+          ON b.account_id = d.account_id AND b.device_id = d.device_id
+    ),
+    first_use AS (
+        SELECT txn_id,
+               ROW_NUMBER() OVER (PARTITION BY account_id, device_id ORDER BY txn_timestamp, txn_id) AS use_no
+        FROM batch
+    ),
+    scored AS (
+        SELECT b.txn_id, b.txn_timestamp, b.account_id,
+               b.amount > {high_value} AS high_value,
+               COALESCE(v.txn_count, 0) > {velocity_above} AS velocity,
+               COALESCE(m.distance_km > {geo_km}, false) AS geo_mismatch,
+               COALESCE(m.distance_km > 100 AND m.distance_km > 900 * m.hours, false) AS impossible_travel,
+               b.device_id IS NOT NULL AND f.use_no = 1 AND k.device_id IS NULL AS new_device,
+               COALESCE(b.merchant_category IN ('Gambling', 'Crypto'), false) AS suspicious_merchant
+        FROM batch b
+        JOIN first_use f ON f.txn_id = b.txn_id
+        LEFT JOIN velocity v ON v.txn_id = b.txn_id
+        LEFT JOIN moves m ON m.txn_id = b.txn_id
+        LEFT JOIN known_devices k ON k.account_id = b.account_id AND k.device_id = b.device_id
+    )
+    SELECT s.txn_id, s.txn_timestamp, s.account_id, r.rule_id, r.reason, r.severity, r.score
+    FROM scored s
+    CROSS JOIN LATERAL (VALUES
+        ('HIGH_VALUE', 'Amount exceeds threshold', 'high', 90.0, s.high_value),
+        ('VELOCITY', 'More than {velocity_above} transactions in {velocity_minutes} minutes', 'medium', 70.0, s.velocity),
+        ('GEO_MISMATCH', 'Transaction location far from last txn', 'high', 85.0, s.geo_mismatch),
+        ('IMPOSSIBLE_TRAVEL', 'Too far from last location for the time elapsed', 'high', 95.0, s.impossible_travel),
+        ('NEW_DEVICE', 'Transaction from new device', 'medium', 60.0, s.new_device),
+        ('SUSPICIOUS_MERCHANT', 'High-risk merchant category', 'high', 80.0, s.suspicious_merchant)
+    ) AS r(rule_id, reason, severity, score, hit)
+    WHERE r.hit
+    ON CONFLICT DO NOTHING;
+
+    -- Fold the batch into the account state, one push per account and finest bucket ({finest_width} s)
+    PERFORM account_txn_state_push(g.account_id, g.last_ts, g.geo_ts, g.geo_lat, g.geo_lng, g.amount, g.txn_count)
+    FROM (
+        SELECT account_id,
+               MAX(txn_timestamp) AS last_ts,
+               SUM(amount) AS amount,
+               COUNT(*)::INT AS txn_count,
+               (array_agg(txn_timestamp ORDER BY txn_timestamp DESC, txn_id DESC)
+                    FILTER (WHERE geo_lat IS NOT NULL AND geo_lng IS NOT NULL))[1] AS geo_ts,
+               (array_agg(geo_lat ORDER BY txn_timestamp DESC, txn_id DESC)
+                    FILTER (WHERE geo_lat IS NOT NULL AND geo_lng IS NOT NULL))[1] AS geo_lat,
+               (array_agg(geo_lng ORDER BY txn_timestamp DESC, txn_id DESC)
+                    FILTER (WHERE geo_lat IS NOT NULL AND geo_lng IS NOT NULL))[1] AS geo_lng
+        FROM new_txns
+        GROUP BY account_id, floor(extract(epoch FROM txn_timestamp) / {finest_width})
+    ) g;
+
+    RETURN NULL;
+END;
+$$;
+
+-- Attach statement-level trigger to transactions table
+CREATE TRIGGER trg_check_txn_stmt
+AFTER INSERT ON transactions
+REFERENCING NEW TABLE AS new_txns
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_check_txns_for_fraud();
+"""
+
+with metrics.timed("drop_triggers"):
+    cur.execute(DROP_TRIGGERS_SQL)
+with metrics.timed("install_account_devices"):
+    install_account_devices(cur)
+if args.mode != "row":
+    with metrics.timed("create_devices_trigger"):
+        cur.execute(DEVICES_TRIGGER_SQL)
+if args.mode in ("row", "statement"):
+    # The triggers write fraud_alerts.txn_timestamp: add it (and fill it for older alerts) first
+    with metrics.timed("install_alert_txn_timestamp"):
+        filled = install_alert_txn_timestamp(cur)
+    if filled:
+        print(f"Filled in txn_timestamp for {filled} existing alerts.")
+    with metrics.timed("install_account_state"):
+        install_account_state(cur)
+    with metrics.timed("install_geo_distance"):
+        install_geo_distance(cur)
+    with metrics.timed(f"create_{args.mode}_trigger"):
+        cur.execute((ROW_TRIGGER_SQL if args.mode == "row" else STATEMENT_TRIGGER_SQL).format(**trigger_thresholds()))
+else:
+    # Nothing maintains the state without a scoring trigger; empty it so the
+    # next install rebuilds it from transactions
+    with metrics.timed("truncate_account_state"):
+        cur.execute("SELECT to_regclass('account_txn_state') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("TRUNCATE account_txn_state")
+    if args.mode == "notify":
+        with metrics.timed("create_notify_trigger"):
+            cur.execute(NOTIFY_TRIGGER_SQL)
+with metrics.timed("commit"):
+    conn.commit()
 cur.close()
 conn.close()
+metrics.finish()
 
-print("Trigger and function created successfully.")
+if args.mode == "off":
+    print("Fraud-check triggers removed.")
+elif args.mode == "notify":
+    print("Notify trigger created; score with python detection_daemon.py.")
+else:
+    print(f"Trigger and function created successfully ({args.mode}-level).")
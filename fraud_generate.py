@@ -1,73 +1,74 @@
 # fraud_generate.py
 
-import psycopg2
-from datetime import datetime, timedelta
-from geopy.distance import geodesic
-import random
+import db
+from datetime import timedelta
+import metrics
+from alert_sink import AlertWriter
+from detector_state import load_watermark, save_watermark, fetch_new_transactions, fetch_history
+from rules import RuleEngine, replay
+from stage_timer import StageTimer
 
 # ---------------------------
 # 1️⃣ Connect to PostgreSQL
 # ---------------------------
-conn = psycopg2.connect(
-    host="localhost",
-    database="postgres",
-    user="postgres",
-    password="Paused.0"
-)
+metrics.init("fraud_generate")   # no-op unless FRAUD_METRICS_* is set
+conn = db.connect()
 cur = conn.cursor()
+timer = StageTimer()   # fetch / score / write wall time
 
-# ---------------------------
-# 2️⃣ Fetch transactions
-# ---------------------------
-cur.execute("""
-    SELECT txn_id, account_id, amount, txn_timestamp, location
-    FROM transactions
-    WHERE txn_id NOT IN (SELECT txn_id FROM fraud_alerts)
-""")
-transactions = cur.fetchall()
-print(f"Transactions to check: {len(transactions)}")
+ALERT_FLUSH_SIZE = 5000          # alerts buffered per write
+ALERT_FLUSH_INTERVAL_S = 5.0     # max seconds between alert writes
 
 # ---------------------------
-# 3️⃣ Define fraud rules
+# 2️⃣ Load fraud rules
 # ---------------------------
+DETECTOR = "fraud_generate"
+TXN_COLUMNS = "t.txn_id, t.account_id, t.amount, t.txn_timestamp, t.geo_lat, t.geo_lng, t.device_id"   # rules.Txn
 
-def high_value_rule(txn):
-    # Amount > 100,000
-    return txn[2] > 100000
-
-def velocity_rule(txn_list, account_id, current_txn):
-    # >5 transactions in last 1 hour
-    one_hour_ago = current_txn[3] - timedelta(hours=1)
-    recent_txns = [t for t in txn_list if t[1] == account_id and one_hour_ago <= t[3] < current_txn[3]]
-    return len(recent_txns) >= 5
+# Rules and thresholds: profile "fraud_generate" in rules.json
+engine = RuleEngine.load("fraud_generate")
 
-# For demo, skip geo-mismatch for simplicity
+# ---------------------------
+# 3️⃣ Fetch transactions
+# ---------------------------
+# Only transactions inserted since the last run are scored; already-scored
+# rows within the rules' longest window are loaded as history.
+with timer.stage("fetch"):
+    last_txn_id, last_txn_timestamp = load_watermark(cur, DETECTOR)
+    transactions = fetch_new_transactions(cur, TXN_COLUMNS, last_txn_id, last_txn_timestamp)
+    history = fetch_history(cur, TXN_COLUMNS, last_txn_id, max(engine.lookback, timedelta(hours=1)),
+                            batch_start=min((t[3] for t in transactions), default=None))
+print(f"Transactions to check: {len(transactions)} (after txn_id {last_txn_id}, {len(history)} history rows)")
 
 # ---------------------------
 # 4️⃣ Generate alerts
 # ---------------------------
-alerts_inserted = 0
+# Own connection: flushes commit while the detector_state row stays locked on `conn`
+alert_writer = AlertWriter(db.connect(), flush_size=ALERT_FLUSH_SIZE,
+                           flush_interval=ALERT_FLUSH_INTERVAL_S, timer=timer)
+
+# History rows only feed the account context; new rows are scored in time order
+with timer.stage("score"):
+    for txn, alerts in replay(engine, history, transactions):
+        for alert in alerts:
+            alert_writer.add(txn.txn_id, txn.txn_timestamp, txn.account_id, alert['rule_id'],
+                             alert['reason'], alert['severity'], alert['score'], 'new')
+metrics.count_rows(len(transactions))
 
-for txn in transactions:
-    txn_id, account_id, amount, txn_time, location = txn
-    rules_triggered = []
-    
-    if high_value_rule(txn):
-        rules_triggered.append(("HIGH_VALUE", "Amount exceeds 100,000", "high", 90.0))
-    
-    if velocity_rule(transactions, account_id, txn):
-        rules_triggered.append(("VELOCITY", "Too many transactions in 1 hour", "medium", 70.0))
-    
-    # Insert alerts
-    for rule_id, reason, severity, score in rules_triggered:
-        cur.execute("""
-            INSERT INTO fraud_alerts(txn_id, account_id, rule_id, reason, severity, score, status)
-            VALUES (%s, %s, %s, %s, %s, %s, 'new')
-        """, (txn_id, account_id, rule_id, reason, severity, score))
-        alerts_inserted += 1
+# Alerts are committed before the checkpoint moves past their transactions
+alert_writer.close()
+alert_writer.conn.close()
+print(alert_writer.summary())
+print(engine.summary())
 
-conn.commit()
-print(f"Total fraud alerts inserted: {alerts_inserted}")
+with timer.stage("write"):
+    if transactions:
+        last_scored = max(transactions, key=lambda t: t[0])
+        save_watermark(cur, DETECTOR, last_scored[0], last_scored[3])
+    conn.commit()
+timer.dump()
+metrics.record_stages(timer.seconds)
+metrics.finish()
 
 # ---------------------------
 # 5️⃣ Close connection
@@ -1,40 +1,121 @@
-import psycopg2
-from faker import Faker
+import argparse
+import csv
+import hashlib
+import io
+import json
 import random
-from tqdm import tqdm
 from datetime import datetime, timedelta
 
+import db
+from faker import Faker
+from tqdm import tqdm
+
+parser = argparse.ArgumentParser(description="Generate users, accounts, merchants, devices and transactions.")
+parser.add_argument("--users", type=int, default=50)
+parser.add_argument("--accounts-per-user", type=int, default=3,
+                    help="each user gets between 1 and this many accounts")
+parser.add_argument("--merchants", type=int, default=20)
+parser.add_argument("--devices", type=int, default=50)
+parser.add_argument("--transactions", type=int, default=1000)
+parser.add_argument("--bulk", action="store_true",
+                    help="load with COPY FROM STDIN instead of one INSERT per row; for large scales "
+                         "run fraud_detect.py --mode statement (or off) first")
+parser.add_argument("--chunk-rows", type=int, default=50000,
+                    help="rows generated and copied per COPY in --bulk mode")
+parser.add_argument("--seed", type=int, help="seed random and Faker for a reproducible dataset")
+args = parser.parse_args()
+
 fake = Faker()
+if args.seed is not None:
+    random.seed(args.seed)
+    Faker.seed(args.seed)
 
 # ---------------------------
 # 1️⃣ Connect to PostgreSQL
 # ---------------------------
-conn = psycopg2.connect(
-    host="localhost",
-    database="postgres",  # or your DB name
-    user="postgres",
-    password="Paused.0"   # change this
-)
+conn = db.connect()
 cur = conn.cursor()
 
+# --- Bulk helpers ---
+# Faker is slow per call, so bulk mode draws from small pools of fake values
+# and derives the UNIQUE columns from the reserved ids instead of fake.unique.
+POOL_SIZE = 2000
+
+def faker_pool(make, size=POOL_SIZE):
+    return [make() for _ in range(size)]
+
+def reserve_ids(table, column, count):
+    # Claim `count` consecutive ids from the table's sequence in one round trip.
+    # The lock keeps other inserts from taking ids inside the range until commit.
+    if count == 0:
+        return range(0)
+    cur.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute("""
+        SELECT nextval(pg_get_serial_sequence(%(t)s, %(c)s)),
+               setval(pg_get_serial_sequence(%(t)s, %(c)s),
+                      currval(pg_get_serial_sequence(%(t)s, %(c)s)) + %(n)s - 1)
+    """, {"t": table, "c": column, "n": count})
+    first_id = cur.fetchone()[0]
+    return range(first_id, first_id + count)
+
+def copy_rows(table, columns, rows, total):
+    # Stream generated rows through an in-memory CSV buffer, one COPY per chunk
+    copied = 0
+    with tqdm(total=total, desc=table) as progress:
+        while True:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            n = 0
+            for row in rows:
+                writer.writerow(row)
+                n += 1
+                if n == args.chunk_rows:
+                    break
+            if n == 0:
+                break
+            buf.seek(0)
+            cur.copy_expert(f"COPY {table}({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+            copied += n
+            progress.update(n)
+    conn.commit()
+    return copied
+
+def random_timestamp(days_back=30):
+    return datetime.now() - timedelta(days=random.randint(0, days_back), hours=random.randint(0, 23))
+
 # ---------------------------
 # 2️⃣ Generate Users
 # ---------------------------
-NUM_USERS = 50
+NUM_USERS = args.users
 user_ids = []
 
-for _ in range(NUM_USERS):
-    full_name = fake.name()
-    email = fake.unique.email()
-    phone = fake.phone_number()
-    dob = fake.date_of_birth(minimum_age=18, maximum_age=70)
-    kyc_level = random.randint(0, 5)
-    cur.execute("""
-        INSERT INTO users(full_name, email, phone, dob, kyc_level)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING user_id
-    """, (full_name, email, phone, dob, kyc_level))
-    user_ids.append(cur.fetchone()[0])
+if args.bulk:
+    names = faker_pool(fake.name)
+    phones = faker_pool(fake.phone_number)
+    domains = faker_pool(fake.free_email_domain, 50)
+    user_ids = reserve_ids("users", "user_id", NUM_USERS)
+
+    def user_rows():
+        for user_id in user_ids:
+            full_name = random.choice(names)
+            email = f"{full_name.split()[0].lower()}.{user_id}@{random.choice(domains)}"
+            dob = (datetime.now() - timedelta(days=random.randint(18 * 365, 70 * 365))).date()
+            yield (user_id, full_name, email, random.choice(phones), dob, random.randint(0, 5))
+
+    copy_rows("users", ["user_id", "full_name", "email", "phone", "dob", "kyc_level"], user_rows(), NUM_USERS)
+else:
+    for _ in range(NUM_USERS):
+        full_name = fake.name()
+        email = fake.unique.email()
+        phone = fake.phone_number()
+        dob = fake.date_of_birth(minimum_age=18, maximum_age=70)
+        kyc_level = random.randint(0, 5)
+        cur.execute("""
+            INSERT INTO users(full_name, email, phone, dob, kyc_level)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING user_id
+        """, (full_name, email, phone, dob, kyc_level))
+        user_ids.append(cur.fetchone()[0])
 
 conn.commit()
 print(f"Inserted {len(user_ids)} users.")
@@ -47,18 +128,34 @@ account_ids = []
 
 account_types_list = ['savings', 'current', 'credit']
 
-for user_id in user_ids:
-    num_accounts = random.randint(1, 3)
-    for _ in range(num_accounts):
-        account_type = random.choice(account_types_list)
-        balance = round(random.uniform(1000, 500000), 2)
-        account_no = str(random.randint(1000000000, 9999999999))  # 10-digit unique number
-        cur.execute("""
-            INSERT INTO accounts(user_id, account_no, account_type, balance)
-            VALUES (%s, %s, %s, %s)
-            RETURNING account_id
-        """, (user_id, account_no, account_type, balance))
-        account_ids.append(cur.fetchone()[0])
+if args.bulk:
+    accounts_per_user = [random.randint(1, args.accounts_per_user) for _ in user_ids]
+    account_ids = reserve_ids("accounts", "account_id", sum(accounts_per_user))
+
+    def account_rows():
+        account_iter = iter(account_ids)
+        for user_id, num_accounts in zip(user_ids, accounts_per_user):
+            for _ in range(num_accounts):
+                account_id = next(account_iter)
+                # 12 digits: cannot clash with the random 10-digit numbers of row mode
+                yield (account_id, user_id, f"{account_id:012d}", random.choice(account_types_list),
+                       round(random.uniform(1000, 500000), 2))
+
+    copy_rows("accounts", ["account_id", "user_id", "account_no", "account_type", "balance"],
+              account_rows(), len(account_ids))
+else:
+    for user_id in user_ids:
+        num_accounts = random.randint(1, args.accounts_per_user)
+        for _ in range(num_accounts):
+            account_type = random.choice(account_types_list)
+            balance = round(random.uniform(1000, 500000), 2)
+            account_no = str(random.randint(1000000000, 9999999999))  # 10-digit unique number
+            cur.execute("""
+                INSERT INTO accounts(user_id, account_no, account_type, balance)
+                VALUES (%s, %s, %s, %s)
+                RETURNING account_id
+            """, (user_id, account_no, account_type, balance))
+            account_ids.append(cur.fetchone()[0])
 
 conn.commit()
 print(f"Inserted {len(account_ids)} accounts.")
@@ -66,22 +163,32 @@ print(f"Inserted {len(account_ids)} accounts.")
 # ---------------------------
 # 4️⃣ Generate Merchants
 # ---------------------------
-NUM_MERCHANTS = 20
+NUM_MERCHANTS = args.merchants
 merchant_ids = []
 categories = ['Retail', 'Travel', 'Electronics', 'Food', 'Health']
 
-for _ in range(NUM_MERCHANTS):
-    name = fake.company()
-    merchant_code = fake.unique.bothify(text='MC####')
-    category = random.choice(categories)
-    city = fake.city()
-    country = fake.country()
-    cur.execute("""
-        INSERT INTO merchants(name, merchant_code, category, city, country)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING merchant_id
-    """, (name, merchant_code, category, city, country))
-    merchant_ids.append(cur.fetchone()[0])
+if args.bulk:
+    companies = faker_pool(fake.company)
+    cities = faker_pool(fake.city)
+    countries = faker_pool(fake.country, 200)
+    merchant_ids = reserve_ids("merchants", "merchant_id", NUM_MERCHANTS)
+    copy_rows("merchants", ["merchant_id", "name", "merchant_code", "category", "city", "country"],
+              ((merchant_id, random.choice(companies), f"MC{merchant_id:08d}", random.choice(categories),
+                random.choice(cities), random.choice(countries)) for merchant_id in merchant_ids),
+              NUM_MERCHANTS)
+else:
+    for _ in range(NUM_MERCHANTS):
+        name = fake.company()
+        merchant_code = fake.unique.bothify(text='MC####')
+        category = random.choice(categories)
+        city = fake.city()
+        country = fake.country()
+        cur.execute("""
+            INSERT INTO merchants(name, merchant_code, category, city, country)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING merchant_id
+        """, (name, merchant_code, category, city, country))
+        merchant_ids.append(cur.fetchone()[0])
 
 conn.commit()
 print(f"Inserted {len(merchant_ids)} merchants.")
@@ -89,24 +196,32 @@ print(f"Inserted {len(merchant_ids)} merchants.")
 # ---------------------------
 # 5️⃣ Generate Devices
 # ---------------------------
-NUM_DEVICES = 50
+NUM_DEVICES = args.devices
 device_ids = []
 
-import json
-
-# Inside your devices loop:
-for _ in range(NUM_DEVICES):
-    device_fingerprint = fake.unique.sha1()
-    device_info = {
-        'os': random.choice(['Windows', 'Linux', 'MacOS', 'Android', 'iOS']),
-        'browser': random.choice(['Chrome', 'Firefox', 'Safari', 'Edge'])
-    }
-    cur.execute("""
-        INSERT INTO devices(device_fingerprint, device_info)
-        VALUES (%s, %s)
-        RETURNING device_id
-    """, (device_fingerprint, json.dumps(device_info)))  # ✅ use json.dumps
-    device_ids.append(cur.fetchone()[0])
+if args.bulk:
+    device_ids = reserve_ids("devices", "device_id", NUM_DEVICES)
+    device_infos = [json.dumps({'os': os_name, 'browser': browser})
+                    for os_name in ['Windows', 'Linux', 'MacOS', 'Android', 'iOS']
+                    for browser in ['Chrome', 'Firefox', 'Safari', 'Edge']]
+    copy_rows("devices", ["device_id", "device_fingerprint", "device_info"],
+              ((device_id, hashlib.sha1(f"device-{device_id}".encode()).hexdigest(), random.choice(device_infos))
+               for device_id in device_ids),
+              NUM_DEVICES)
+else:
+    # Inside your devices loop:
+    for _ in range(NUM_DEVICES):
+        device_fingerprint = fake.unique.sha1()
+        device_info = {
+            'os': random.choice(['Windows', 'Linux', 'MacOS', 'Android', 'iOS']),
+            'browser': random.choice(['Chrome', 'Firefox', 'Safari', 'Edge'])
+        }
+        cur.execute("""
+            INSERT INTO devices(device_fingerprint, device_info)
+            VALUES (%s, %s)
+            RETURNING device_id
+        """, (device_fingerprint, json.dumps(device_info)))  # ✅ use json.dumps
+        device_ids.append(cur.fetchone()[0])
 
 
 conn.commit()
@@ -115,35 +230,50 @@ print(f"Inserted {len(device_ids)} devices.")
 # ---------------------------
 # 6️⃣ Generate Transactions
 # ---------------------------
-NUM_TRANSACTIONS = 1000
+NUM_TRANSACTIONS = args.transactions
 channels = ['atm','pos','web','mobile','bank_transfer','cheque']
+TXN_COLUMNS = db.TXN_INSERT_COLUMNS
+
+if args.bulk:
+    locations = [f"{fake.city()}, {fake.country()}" for _ in range(POOL_SIZE)]
+    ips = faker_pool(fake.ipv4_public)
+    notes = faker_pool(fake.sentence)
+
+    def transaction_rows():
+        for _ in range(NUM_TRANSACTIONS):
+            device_id = random.choice(device_ids)
+            yield (random.choice(account_ids), random.choice(merchant_ids), device_id,
+                   round(random.uniform(10, 2000000), 2), random_timestamp(), random.choice(channels),
+                   random.choice(locations), random.choice(ips),
+                   round(random.uniform(-90, 90), 6), round(random.uniform(-180, 180), 6),
+                   random.choice(categories),
+                   json.dumps({'note': random.choice(notes), 'device_id': device_id}))
 
-transactions = []
-for _ in tqdm(range(NUM_TRANSACTIONS)):
-    account_id = random.choice(account_ids)
-    merchant_id = random.choice(merchant_ids)
-    device_id = random.choice(device_ids)
-    amount = round(random.uniform(10, 2000000), 2)  # include high-value for fraud testing
-    txn_time = datetime.now() - timedelta(days=random.randint(0, 30), hours=random.randint(0,23))
-    channel = random.choice(channels)
-    location = f"{fake.city()}, {fake.country()}"
-    ip_address = fake.ipv4_public()
-    geo_lat = float(fake.latitude())
-    geo_lng = float(fake.longitude())
-    merchant_category = random.choice(categories)
-    metadata = {
-        'note': fake.sentence(),
-        'device_id': device_id
-    }
-    # Inside transactions loop:
-cur.execute("""
-    INSERT INTO transactions(account_id, merchant_id, device_id, amount, txn_timestamp,
-                              channel, location, ip_address, geo_lat, geo_lng, merchant_category, metadata)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-""", (
-    account_id, merchant_id, device_id, amount, txn_time, channel, location,
-    ip_address, geo_lat, geo_lng, merchant_category, json.dumps(metadata)  # ✅ fix here
-))
+    copy_rows("transactions", TXN_COLUMNS, transaction_rows(), NUM_TRANSACTIONS)
+else:
+    rows = []
+    for _ in tqdm(range(NUM_TRANSACTIONS)):
+        account_id = random.choice(account_ids)
+        merchant_id = random.choice(merchant_ids)
+        device_id = random.choice(device_ids)
+        amount = round(random.uniform(10, 2000000), 2)  # include high-value for fraud testing
+        txn_time = random_timestamp()
+        channel = random.choice(channels)
+        location = f"{fake.city()}, {fake.country()}"
+        ip_address = fake.ipv4_public()
+        geo_lat = float(fake.latitude())
+        geo_lng = float(fake.longitude())
+        merchant_category = random.choice(categories)
+        metadata = {
+            'note': fake.sentence(),
+            'device_id': device_id
+        }
+        rows.append((
+            account_id, merchant_id, device_id, amount, txn_time, channel, location,
+            ip_address, geo_lat, geo_lng, merchant_category, json.dumps(metadata)  # ✅ fix here
+        ))
+    # Prepared INSERT, many EXECUTEs per round trip (row triggers still fire per row)
+    db.execute_prepared_batch(cur, "insert_transaction", rows)
 conn.commit()
 print(f"Inserted {NUM_TRANSACTIONS} transactions.")
 
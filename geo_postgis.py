@@ -0,0 +1,193 @@
+# geo_postgis.py
+#
+# PostGIS for the geo checks. fraud detect.sql creates the extension; this
+# adds a generated geography(Point, 4326) column `geog` to transactions and
+# merchants (merchants also get geo_lat / geo_lng to derive it from), with
+# GiST indexes for radius lookups such as
+#   SELECT ... FROM transactions WHERE ST_DWithin(geog, ST_MakePoint(77.59, 12.97)::geography, 5000)
+# Adding a stored column rewrites the table: run it in a maintenance window.
+#
+# Both fraud triggers measure distances with geo_distance_km(). It is
+# ST_Distance on the sphere when PostGIS is installed, otherwise the
+# haversine formula (same radius as geo_distance.py), so the triggers install
+# either way and pick PostGIS up when this script is run.
+#
+# IMPOSSIBLE_TRAVEL: the account moved from its previous located transaction
+# faster than TRAVEL_MAX_KMH (hops under TRAVEL_MIN_KM are location noise).
+# The triggers check it on insert; --backlog scores transactions that were
+# loaded without them in one set-based query.
+#
+#   python geo_postgis.py                                  # columns, indexes, geo_distance_km()
+#   python geo_postgis.py --backlog --since 2025-10-01     # IMPOSSIBLE_TRAVEL alerts for older rows
+#   python geo_postgis.py --backlog --dry-run              # count only
+
+import argparse
+from datetime import datetime, timedelta
+
+import db
+
+TRAVEL_MAX_KMH = 900      # airliner cruising speed
+TRAVEL_MIN_KM = 100
+# No move is impossible after this long: half the Earth's circumference at TRAVEL_MAX_KMH
+TRAVEL_LOOKBACK = timedelta(hours=20015 / TRAVEL_MAX_KMH)
+
+
+# ---------------------------
+# 1️⃣ Geography columns and the distance function
+# ---------------------------
+GEOGRAPHY_SQL = """
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+-- NULL for missing or out-of-range coordinates, so an insert never fails on them
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS geog geography(Point, 4326)
+    GENERATED ALWAYS AS (
+        CASE WHEN geo_lat BETWEEN -90 AND 90 AND geo_lng BETWEEN -180 AND 180
+             THEN ST_SetSRID(ST_MakePoint(geo_lng, geo_lat), 4326)::geography END
+    ) STORED;
+
+ALTER TABLE merchants
+    ADD COLUMN IF NOT EXISTS geo_lat DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS geo_lng DOUBLE PRECISION;
+ALTER TABLE merchants ADD COLUMN IF NOT EXISTS geog geography(Point, 4326)
+    GENERATED ALWAYS AS (
+        CASE WHEN geo_lat BETWEEN -90 AND 90 AND geo_lng BETWEEN -180 AND 180
+             THEN ST_SetSRID(ST_MakePoint(geo_lng, geo_lat), 4326)::geography END
+    ) STORED;
+"""
+
+GEO_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_txn_geog ON transactions USING GIST (geog);
+CREATE INDEX IF NOT EXISTS idx_merchants_geog ON merchants USING GIST (geog);
+"""
+
+# Great-circle distance in km; use_spheroid => false keeps it on the sphere
+# like the haversine version, so switching does not move alert thresholds
+DISTANCE_POSTGIS_SQL = """
+CREATE OR REPLACE FUNCTION geo_distance_km(
+    lat1 DOUBLE PRECISION, lng1 DOUBLE PRECISION, lat2 DOUBLE PRECISION, lng2 DOUBLE PRECISION
+) RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT ST_Distance(ST_SetSRID(ST_MakePoint(lng1, lat1), 4326)::geography,
+                       ST_SetSRID(ST_MakePoint(lng2, lat2), 4326)::geography, false) / 1000
+$$;
+"""
+
+DISTANCE_HAVERSINE_SQL = """
+CREATE OR REPLACE FUNCTION geo_distance_km(
+    lat1 DOUBLE PRECISION, lng1 DOUBLE PRECISION, lat2 DOUBLE PRECISION, lng2 DOUBLE PRECISION
+) RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT 2 * 6371 * asin(LEAST(1.0, sqrt(
+        sin(radians(lat2 - lat1) / 2) ^ 2
+        + cos(radians(lat1)) * cos(radians(lat2)) * sin(radians(lng2 - lng1) / 2) ^ 2
+    )))
+$$;
+"""
+
+
+def has_postgis(cur):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'postgis')")
+    return cur.fetchone()[0]
+
+
+def has_geography(cur):
+    cur.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_attribute
+                       WHERE attrelid = 'transactions'::regclass AND attname = 'geog' AND NOT attisdropped)
+    """)
+    return cur.fetchone()[0]
+
+
+def install_geo_distance(cur):
+    # geo_distance_km() for the triggers; returns True when it is the PostGIS one
+    postgis = has_postgis(cur)
+    cur.execute(DISTANCE_POSTGIS_SQL if postgis else DISTANCE_HAVERSINE_SQL)
+    return postgis
+
+
+def install_geography(cur):
+    cur.execute(GEOGRAPHY_SQL)
+    cur.execute(GEO_INDEXES_SQL)
+    cur.execute(DISTANCE_POSTGIS_SQL)
+
+
+# ---------------------------
+# 2️⃣ Backlog: IMPOSSIBLE_TRAVEL for transactions already loaded
+# ---------------------------
+# Each located transaction against the previous located one of its account
+# (the triggers' last_geo_ts / last_lat / last_lng). Rows from TRAVEL_LOOKBACK
+# before --since are read only as predecessors. Transactions that already
+# have the alert are skipped (and ON CONFLICT covers alerts a trigger writes
+# meanwhile), so the job can be re-run over the same range.
+BACKLOG_SQL = """
+WITH located AS (
+    SELECT txn_id, account_id, txn_timestamp, geog,
+           LAG(geog) OVER w AS prev_geog,
+           LAG(txn_timestamp) OVER w AS prev_ts
+    FROM transactions
+    WHERE geog IS NOT NULL {range_filter}
+    WINDOW w AS (PARTITION BY account_id ORDER BY txn_timestamp, txn_id)
+),
+moves AS (
+    SELECT txn_id, account_id, txn_timestamp,
+           ST_Distance(geog, prev_geog, false) / 1000 AS distance_km,
+           extract(epoch FROM txn_timestamp - prev_ts) / 3600 AS hours
+    FROM located
+    WHERE prev_geog IS NOT NULL {since_filter}
+      -- cheap bound test before the exact distance
+      AND NOT ST_DWithin(geog, prev_geog, %(min_km)s * 1000, false)
+)
+SELECT m.txn_id, m.txn_timestamp, m.account_id, 'IMPOSSIBLE_TRAVEL',
+       'Too far from last location for the time elapsed', 'high', 95.0
+FROM moves m
+WHERE m.distance_km > %(max_kmh)s * m.hours
+  AND NOT EXISTS (
+      SELECT 1 FROM fraud_alerts a
+      WHERE a.txn_id = m.txn_id AND a.txn_timestamp = m.txn_timestamp AND a.rule_id = 'IMPOSSIBLE_TRAVEL'
+  )
+"""
+
+
+def score_backlog(cur, since=None, until=None, dry_run=False):
+    # Returns the number of alerts written (or that would be, with dry_run)
+    range_filter, since_filter = "", ""
+    if since is not None:
+        range_filter += " AND txn_timestamp >= %(since)s::timestamptz - %(lookback)s"
+        since_filter = " AND txn_timestamp >= %(since)s"
+    if until is not None:
+        range_filter += " AND txn_timestamp < %(until)s"
+    query = BACKLOG_SQL.format(range_filter=range_filter, since_filter=since_filter)
+    params = {"since": since, "until": until, "lookback": TRAVEL_LOOKBACK,
+              "min_km": TRAVEL_MIN_KM, "max_kmh": TRAVEL_MAX_KMH}
+    if dry_run:
+        cur.execute(f"SELECT count(*) FROM ({query}) q", params)
+        return cur.fetchone()[0]
+    cur.execute(f"""
+        INSERT INTO fraud_alerts(txn_id, txn_timestamp, account_id, rule_id, reason, severity, score)
+        {query}
+        ON CONFLICT DO NOTHING
+    """, params)
+    return cur.rowcount
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add PostGIS geography columns and score impossible travel.")
+    parser.add_argument("--backlog", action="store_true",
+                        help="write IMPOSSIBLE_TRAVEL alerts for transactions already in the table")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="backlog: first txn_timestamp to score")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="backlog: score txn_timestamp before this")
+    parser.add_argument("--dry-run", action="store_true", help="backlog: count the alerts, write nothing")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    cur = conn.cursor()
+    if not args.backlog:
+        install_geography(cur)
+        conn.commit()
+        print("Geography columns, GiST indexes and geo_distance_km() (PostGIS) are ready.")
+    else:
+        if not has_geography(cur):
+            raise SystemExit("transactions.geog does not exist: run python geo_postgis.py first (needs PostGIS)")
+        n = score_backlog(cur, args.since, args.until, args.dry_run)
+        conn.commit()
+        print(f"{n} IMPOSSIBLE_TRAVEL alerts {'found' if args.dry_run else 'written'}.")
+    cur.close()
+    conn.close()
@@ -0,0 +1,474 @@
+# ingest_service.py
+#
+# Long-running ingest-and-score service.
+# Reads newline-delimited JSON transactions from stdin or a local unix
+# socket, validates them against the transactions schema, scores them in
+# memory with the same rules as fraud_alerts.py (rules.json), and writes transactions
+# plus alerts in micro-batches through an asyncpg connection pool.
+#
+# Backpressure: parsed transactions wait in a bounded queue, and scored
+# batches wait for a free writer. When the database falls behind, the
+# queues fill up and the service stops reading input until they drain.
+#
+# Rejected input (invalid JSON or UTF-8, over-long lines, schema errors) is
+# reported and skipped. A batch the database refuses (e.g. a foreign key
+# violation) is rolled back and split until the offending rows are found;
+# those are written to stderr as {"error": ..., "transaction": ...} lines
+# and the rest of the batch is written. If every writer dies (the database
+# stays unreachable), the service stops with an error instead of hanging.
+#
+# The service scores transactions itself, so switch the database trigger
+# off first (python fraud_detect.py --mode off), otherwise every
+# transaction is scored twice.
+#
+#   python ingest_service.py < transactions.ndjson
+#   python ingest_service.py --socket /tmp/fraud_ingest.sock
+#
+# Example line:
+#   {"account_id": 12, "merchant_id": 3, "device_id": 7, "amount": 2500.0,
+#    "txn_timestamp": "2025-10-21T10:15:00+05:30", "channel": "pos",
+#    "geo_lat": 17.385, "geo_lng": 78.4867, "merchant_category": "Retail"}
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import signal
+import statistics
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import asyncpg
+
+import db
+import metrics
+from account_devices import DeviceIndex
+from alert_sink import ALERT_FROM_STAGE_SQL, ALERT_STAGE_SQL
+from dedupe_alerts import ALERT_KEY_SQL
+from rules import RuleEngine, Txn
+
+# ---------------------------
+# 1️⃣ Settings
+# ---------------------------
+BATCH_SIZE = 500          # transactions per micro-batch
+BATCH_WAIT_MS = 50        # max time a transaction waits for its batch to fill
+QUEUE_SIZE = 10000        # parsed transactions waiting to be scored
+POOL_SIZE = 4             # concurrent batch writers / DB connections
+WRITE_RETRIES = 3         # attempts per batch on connection errors
+REPORT_EVERY_S = 10       # seconds between progress lines
+
+TXN_COLUMNS = [
+    "txn_id", "account_id", "merchant_id", "device_id", "amount", "currency", "txn_timestamp",
+    "channel", "status", "location", "ip_address", "geo_lat", "geo_lng", "merchant_category", "metadata",
+]
+ALERT_COLUMNS = ["txn_id", "txn_timestamp", "account_id", "rule_id", "reason", "severity", "score", "status"]
+# Errors caused by the rows themselves: retrying the same batch cannot help
+ROW_ERRORS = (asyncpg.exceptions.DataError, asyncpg.exceptions.IntegrityConstraintViolationError)
+
+# ---------------------------
+# 2️⃣ Validation
+# ---------------------------
+class InvalidTransaction(ValueError):
+    pass
+
+
+def _optional_int(record, key):
+    value = record.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidTransaction(f"{key} must be an integer")
+    return value
+
+
+def _optional_float(record, key, low, high):
+    value = record.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        raise InvalidTransaction(f"{key} must be a number between {low} and {high}")
+    return float(value)
+
+
+def _optional_text(record, key, max_len=None):
+    value = record.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, str) or (max_len and len(value) > max_len):
+        raise InvalidTransaction(f"{key} must be a string" + (f" of at most {max_len} chars" if max_len else ""))
+    return value
+
+
+def parse_transaction(line):
+    # One NDJSON line -> dict keyed by TXN_COLUMNS (txn_id assigned at write time)
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise InvalidTransaction(f"not valid JSON: {e}")
+    except UnicodeDecodeError as e:
+        raise InvalidTransaction(f"not valid UTF-8: {e}")
+    if not isinstance(record, dict):
+        raise InvalidTransaction("expected a JSON object")
+
+    account_id = _optional_int(record, "account_id")
+    if account_id is None:
+        raise InvalidTransaction("account_id is required")
+
+    try:
+        amount = Decimal(str(record["amount"]))
+    except (KeyError, InvalidOperation):
+        raise InvalidTransaction("amount is required and must be numeric")
+    if not amount.is_finite() or abs(amount) >= Decimal("1e16"):   # NUMERIC(18,2)
+        raise InvalidTransaction("amount out of range")
+
+    channel = _optional_text(record, "channel", max_len=50)
+    if not channel:
+        raise InvalidTransaction("channel is required")
+
+    if record.get("txn_timestamp") is None:
+        txn_timestamp = datetime.now().astimezone()
+    else:
+        try:
+            txn_timestamp = datetime.fromisoformat(record["txn_timestamp"])
+        except (TypeError, ValueError):
+            raise InvalidTransaction("txn_timestamp must be an ISO 8601 timestamp")
+        if txn_timestamp.tzinfo is None:
+            txn_timestamp = txn_timestamp.astimezone()   # local time, like the batch scripts
+
+    ip_address = record.get("ip_address")
+    if ip_address is not None:
+        try:
+            ip_address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            raise InvalidTransaction("ip_address is not a valid IP address")
+
+    metadata = record.get("metadata")
+    if metadata is not None and not isinstance(metadata, dict):
+        raise InvalidTransaction("metadata must be a JSON object")
+
+    return {
+        "txn_id": None,
+        "account_id": account_id,
+        "merchant_id": _optional_int(record, "merchant_id"),
+        "device_id": _optional_int(record, "device_id"),
+        "amount": amount.quantize(Decimal("0.01")),
+        "currency": _optional_text(record, "currency") or "INR",
+        "txn_timestamp": txn_timestamp,
+        "channel": channel,
+        "status": _optional_text(record, "status") or "posted",
+        "location": _optional_text(record, "location"),
+        "ip_address": ip_address,
+        "geo_lat": _optional_float(record, "geo_lat", -90, 90),
+        "geo_lng": _optional_float(record, "geo_lng", -180, 180),
+        "merchant_category": _optional_text(record, "merchant_category"),
+        "metadata": json.dumps(metadata) if metadata is not None else None,
+    }
+
+# ---------------------------
+# 3️⃣ Service
+# ---------------------------
+class IngestService:
+
+    def __init__(self, pool, batch_size, batch_wait_ms, queue_size, writers):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.txn_queue = asyncio.Queue(maxsize=queue_size)     # (txn, received_at)
+        self.write_queue = asyncio.Queue(maxsize=writers)      # scored batches
+        self.writers = writers
+        self.scorer = None
+        self.writer_tasks = []
+        self.engine = RuleEngine.load("fraud_alerts")   # same rules and account state as fraud_alerts.py
+        self.received = 0
+        self.rejected = 0
+        self.written = 0
+        self.alerts_written = 0
+        self.alert_latencies_ms = []  # since the last report
+
+    def start(self):
+        self.writer_tasks = [asyncio.create_task(self.write_batches()) for _ in range(self.writers)]
+        self.scorer = asyncio.create_task(self.score_batches())
+
+    # --- input ---
+    def reject(self, error, writer=None):
+        self.rejected += 1
+        if writer is not None:
+            writer.write(json.dumps({"error": error}).encode() + b"\n")
+        else:
+            print(f"Rejected transaction: {error}", file=sys.stderr)
+
+    async def read_lines(self, reader, writer=None):
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError as e:
+                # Over the reader's limit (LimitOverrunError); if the rest of the
+                # line is still to come, it is rejected as a line of its own
+                self.reject(f"line too long: {e}", writer)
+                continue
+            if not line:
+                break
+            if not line.strip():
+                continue
+            received_at = time.perf_counter()
+            try:
+                txn = parse_transaction(line)
+            except InvalidTransaction as e:
+                self.reject(str(e), writer)
+                continue
+            self.received += 1
+            await self.txn_queue.put((txn, received_at))   # blocks when scoring/writing is behind
+        if writer is not None:
+            writer.close()
+
+    # --- scoring ---
+    async def warm_accounts(self, account_ids, since):
+        # Load the recent transactions of accounts seen for the first time, plus
+        # everything after `since` when rules read event-time windows
+        new_ids = [a for a in account_ids if not self.engine.knows(a)]
+        if not new_ids:
+            return
+        window_rows = """
+                    UNION
+                    SELECT txn_timestamp, txn_id, amount, geo_lat, geo_lng, device_id
+                    FROM transactions
+                    WHERE account_id = a.account_id AND txn_timestamp >= $3
+        """ if self.engine.uses_windows else ""
+        args = (new_ids, self.engine.history_size) + ((since,) if self.engine.uses_windows else ())
+        with metrics.timed("warm_accounts"):
+            rows = await self.pool.fetch(f"""
+                SELECT a.account_id, t.txn_id, t.amount, t.txn_timestamp, t.geo_lat, t.geo_lng, t.device_id
+                FROM unnest($1::BIGINT[]) AS a(account_id)
+                CROSS JOIN LATERAL (
+                    (SELECT txn_timestamp, txn_id, amount, geo_lat, geo_lng, device_id
+                     FROM transactions
+                     WHERE account_id = a.account_id
+                     ORDER BY txn_timestamp DESC, txn_id DESC
+                     LIMIT $2)
+                    {window_rows}
+                ) t
+                ORDER BY a.account_id, t.txn_timestamp, t.txn_id
+            """, *args)
+        for account_id in new_ids:
+            self.engine.context(account_id)
+        for r in rows:
+            self.engine.observe(Txn(r["txn_id"], r["account_id"], r["amount"], r["txn_timestamp"],
+                                    r["geo_lat"], r["geo_lng"], r["device_id"]))
+
+    async def score_batches(self):
+        while True:
+            txn, received_at = await self.txn_queue.get()
+            if txn is None:
+                break
+            batch = [(txn, received_at)]
+            deadline = time.perf_counter() + self.batch_wait
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    txn, received_at = await asyncio.wait_for(self.txn_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if txn is None:
+                    stop = True
+                    break
+                batch.append((txn, received_at))
+
+            await self.warm_accounts({t["account_id"] for t, _ in batch},
+                                     min(t["txn_timestamp"] for t, _ in batch) - self.engine.lookback)
+            scored = []
+            for t, received_at in batch:
+                alerts = self.engine.evaluate(
+                    Txn(None, t["account_id"], t["amount"], t["txn_timestamp"],
+                        t["geo_lat"], t["geo_lng"], t["device_id"]))
+                scored.append((t, alerts, received_at))
+            await self.hand_off(scored)   # blocks while all writers are busy
+            if stop:
+                break
+        for _ in range(self.writers):
+            await self.write_queue.put(None)
+
+    async def hand_off(self, scored):
+        # Queue a scored batch for the writers; raises once none is left to take it
+        put = asyncio.ensure_future(self.write_queue.put(scored))
+        while not put.done():
+            live = [w for w in self.writer_tasks if not w.done()]
+            if not live:
+                put.cancel()
+                errors = [w.exception() for w in self.writer_tasks if not w.cancelled()]
+                raise RuntimeError(f"every batch writer has failed (last error: {errors[-1] if errors else None})")
+            await asyncio.wait([put, *live], return_when=asyncio.FIRST_COMPLETED)
+
+    # --- output ---
+    async def write_batches(self):
+        while True:
+            scored = await self.write_queue.get()
+            if scored is None:
+                break
+            await self.write_scored(scored)
+
+    async def write_scored(self, scored):
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                await self.write_batch(scored)
+                return
+            except ROW_ERRORS as e:
+                # Rolled back; halve the batch until the offending rows are alone
+                if len(scored) == 1:
+                    self.reject_scored(scored, e)
+                    return
+                half = len(scored) // 2
+                await self.write_scored(scored[:half])
+                await self.write_scored(scored[half:])
+                return
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+                if attempt == WRITE_RETRIES:
+                    # Nothing is lost silently: the batch goes to stderr, then this writer stops
+                    self.reject_scored(scored, e)
+                    raise
+                print(f"Batch write failed ({e!r}); retrying in {attempt}s", file=sys.stderr)
+                await asyncio.sleep(attempt)
+
+    def reject_scored(self, scored, error):
+        for t, _, _ in scored:
+            self.rejected += 1
+            record = {c: t[c] for c in TXN_COLUMNS if c != "txn_id"}
+            print(json.dumps({"error": f"{type(error).__name__}: {error}", "transaction": record}, default=str),
+                  file=sys.stderr)
+            # Its context already holds the unwritten row: reload it from the table next time
+            self.engine.forget(t["account_id"])
+
+    async def write_batch(self, scored):
+        async with self.pool.acquire() as conn, metrics.timed("write_batch"):
+            async with conn.transaction():
+                # Reserve txn_ids up front so alerts can reference them in the same COPY round
+                txn_ids = await conn.fetchval("""
+                    SELECT array_agg(nextval(pg_get_serial_sequence('transactions', 'txn_id')))
+                    FROM generate_series(1, $1)
+                """, len(scored))
+                txn_rows, alert_rows = [], []
+                for txn_id, (t, alerts, _) in zip(txn_ids, scored):
+                    t["txn_id"] = txn_id
+                    txn_rows.append([t[c] for c in TXN_COLUMNS])
+                    for a in alerts:
+                        alert_rows.append((txn_id, t["txn_timestamp"], t["account_id"], a["rule_id"], a["reason"],
+                                           a["severity"], a["score"], "new"))
+                await conn.copy_records_to_table("transactions", records=txn_rows, columns=TXN_COLUMNS)
+                if alert_rows:
+                    # Upserted through the session's staging table, as AlertWriter does
+                    await conn.execute(ALERT_STAGE_SQL)
+                    await conn.copy_records_to_table("fraud_alerts_stage", records=alert_rows,
+                                                     columns=ALERT_COLUMNS)
+                    await conn.execute(ALERT_FROM_STAGE_SQL)
+        done_at = time.perf_counter()
+        self.written += len(scored)
+        self.alerts_written += sum(len(alerts) for _, alerts, _ in scored)
+        self.alert_latencies_ms.extend(
+            (done_at - received_at) * 1000 for _, alerts, received_at in scored if alerts)
+        metrics.count_rows(len(scored))
+        if metrics.enabled():
+            latency = metrics.ALERT_LATENCY_SECONDS.labels()
+            for _, alerts, received_at in scored:
+                if alerts:
+                    latency.observe(done_at - received_at)
+
+    async def report(self, final=False):
+        while True:
+            if not final:
+                await asyncio.sleep(REPORT_EVERY_S)
+            latencies, self.alert_latencies_ms = self.alert_latencies_ms, []
+            line = (f"received={self.received} rejected={self.rejected} written={self.written} "
+                    f"alerts={self.alerts_written} queue={self.txn_queue.qsize()}/{self.txn_queue.maxsize}")
+            if latencies:
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                line += (f" alert_latency_ms p50={statistics.median(latencies):.1f} "
+                         f"p95={p95:.1f} max={latencies[-1]:.1f}")
+            print(line, flush=True)
+            metrics.flush()
+            if final:
+                print(self.engine.summary(), flush=True)
+                return
+
+# ---------------------------
+# 4️⃣ Entry point
+# ---------------------------
+async def unless_failed(task, aw):
+    # Await aw, but stop with task's error if task (the scorer) dies first
+    waiter = asyncio.ensure_future(aw)
+    await asyncio.wait([waiter, task], return_when=asyncio.FIRST_COMPLETED)
+    if not waiter.done():
+        waiter.cancel()
+        raise SystemExit(f"Ingest stopped: {task.exception()!r}")
+    return waiter.result()
+
+
+class FileLineReader:
+    # readline() for a regular file, which asyncio cannot watch like a pipe
+    def __init__(self, f):
+        self.f = f
+
+    async def readline(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.f.readline)
+
+
+async def main(args):
+    metrics.init("ingest_service")   # no-op unless FRAUD_METRICS_* is set
+    pool = await asyncpg.create_pool(min_size=1, max_size=args.pool_size + 1, **db.asyncpg_settings())
+    if not await pool.fetchval(ALERT_KEY_SQL):
+        raise SystemExit("fraud_alerts has no unique alert key: run python dedupe_alerts.py first")
+    service = IngestService(pool, args.batch_size, args.batch_wait_ms, args.queue_size, args.pool_size)
+    if service.engine.uses_devices:
+        # Preloaded once; devices of transactions scored here are added as they are seen
+        conn = db.connect()
+        with metrics.timed("load_devices"):
+            service.engine.attach_devices(DeviceIndex.load(conn.cursor()))
+        conn.close()
+        print(f"Loaded {len(service.engine.devices)} account/device pairs.")
+    metrics.QUEUE_DEPTH.set_function(service.txn_queue.qsize, "transactions")
+    metrics.QUEUE_DEPTH.set_function(service.write_queue.qsize, "scored_batches")
+    service.start()
+    reporter = asyncio.create_task(service.report())
+
+    loop = asyncio.get_running_loop()
+    if args.socket:
+        server = await asyncio.start_unix_server(service.read_lines, path=args.socket)
+        print(f"Listening on {args.socket}")
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await unless_failed(service.scorer, stop.wait())
+        server.close()
+        await server.wait_closed()
+    else:
+        reader = asyncio.StreamReader(limit=2 ** 20)
+        try:
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        except ValueError:
+            reader = FileLineReader(sys.stdin.buffer)   # stdin redirected from a regular file
+        await unless_failed(service.scorer, service.read_lines(reader))
+
+    # Drain: everything already queued is scored and written before exit
+    await unless_failed(service.scorer, service.txn_queue.put((None, None)))
+    await service.scorer
+    errors = [e for e in await asyncio.gather(*service.writer_tasks, return_exceptions=True) if e is not None]
+    reporter.cancel()
+    await service.report(final=True)
+    if errors:
+        print(f"{len(errors)} batch writers stopped on errors, last: {errors[-1]!r}", file=sys.stderr)
+    await pool.close()
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest NDJSON transactions, score them and write alerts.")
+    parser.add_argument("--socket", help="listen on this unix socket instead of reading stdin")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help="concurrent batch writers")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,367 @@
+# metrics.py
+#
+# Hot-path metrics for the detectors, the trigger install and the ingest
+# service: per-rule latency histograms, alerts per rule, per-query timings,
+# rows processed / rows per second, stage times and queue depths.
+#
+# Off unless one of these is set, and then every call below is a no-op
+# (one flag check, no allocation):
+#   FRAUD_METRICS_FILE=/var/lib/node_exporter/fraud.prom   Prometheus text file, written at
+#                                                          finish() / flush() (textfile collector)
+#   FRAUD_METRICS_PORT=9108                                Prometheus HTTP endpoint (GET /metrics)
+#   FRAUD_METRICS_SUMMARY=run.json                         JSON summary at finish() ('-': stdout)
+#
+#   metrics.init("fraud_alerts")            # once per process; adds detector="fraud_alerts"
+#   with metrics.timed("fetch_transactions"):
+#       ...
+#   metrics.finish()
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RULE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3, 1e-2)
+QUERY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_enabled = False
+_const_labels = {}
+_server = None
+_lock = threading.Lock()
+
+
+# ---------------------------
+# 1️⃣ Metric types
+# ---------------------------
+class _Noop:
+    # Returned by labels() while metrics are off
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+_NOOP = _Noop()
+_NULL_CONTEXT = nullcontext()   # reusable, so timed() allocates nothing while off
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metric:
+
+    def __init__(self, kind, name, help, labelnames=(), buckets=None):
+        self.kind = kind            # counter | gauge | histogram
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.children = {}          # label values -> _Value / _Buckets
+        self.functions = {}         # label values -> callable, gauges read at export time
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        # Child for one label combination; keep it when calling on a hot path
+        if not _enabled:
+            return _NOOP
+        child = self.children.get(values)
+        if child is None:
+            with _lock:
+                child = self.children.setdefault(
+                    values, _Buckets(self.buckets) if self.kind == "histogram" else _Value())
+        return child
+
+    def set_function(self, fn, *values):
+        # Gauge computed when exported, e.g. a queue's current size
+        if _enabled:
+            with _lock:
+                self.functions[values] = fn
+
+    def items(self):
+        # Sorted copies of children and functions, taken under _lock: the
+        # exporter thread reads them while other threads add label values
+        with _lock:
+            return sorted(self.children.items()), sorted(self.functions.items())
+
+    def samples(self):
+        # (suffix, label dict, value) in Prometheus text order
+        children, functions = self.items()
+        for values, child in children:
+            labels = dict(zip(self.labelnames, values))
+            if self.kind == "histogram":
+                cumulative = 0
+                for bound, n in zip(self.bounds_with_inf(), child.counts):
+                    cumulative += n
+                    yield "_bucket", dict(labels, le=bound), cumulative
+                yield "_sum", labels, child.sum
+                yield "_count", labels, child.count
+            else:
+                yield "", labels, child.value
+        for values, fn in functions:
+            yield "", dict(zip(self.labelnames, values)), fn()
+
+    def bounds_with_inf(self):
+        return [_format_value(b) for b in self.buckets] + ["+Inf"]
+
+
+REGISTRY = []
+
+RULE_SECONDS = Metric("histogram", "fraud_rule_seconds", "Time to evaluate one rule for one transaction.",
+                      ["rule"], RULE_BUCKETS)
+ALERTS = Metric("counter", "fraud_alerts_emitted_total", "Alerts emitted, per rule.", ["rule"])
+QUERY_SECONDS = Metric("histogram", "fraud_query_seconds", "Wall time of database calls.",
+                       ["query"], QUERY_BUCKETS)
+ROWS = Metric("counter", "fraud_rows_processed_total", "Transactions scored.")
+ROWS_PER_SECOND = Metric("gauge", "fraud_rows_per_second", "Transactions scored per second over the run.")
+STAGE_SECONDS = Metric("gauge", "fraud_stage_seconds", "Wall time per stage (fetch / score / write).", ["stage"])
+QUEUE_DEPTH = Metric("gauge", "fraud_queue_depth", "Items waiting in an in-process queue.", ["queue"])
+ALERT_LATENCY_SECONDS = Metric("histogram", "fraud_alert_latency_seconds",
+                               "Time from receiving a transaction to its alert being committed (ingest).",
+                               buckets=QUERY_BUCKETS)
+RUN_SECONDS = Metric("gauge", "fraud_run_seconds", "Seconds since the process called metrics.init().")
+
+
+# ---------------------------
+# 2️⃣ Setup and helpers
+# ---------------------------
+_started = None
+
+
+def init(detector):
+    # Turn metrics on if any FRAUD_METRICS_* variable is set; returns whether they are on
+    global _enabled, _started, _server
+    if not any(os.environ.get(v) for v in ("FRAUD_METRICS_FILE", "FRAUD_METRICS_PORT", "FRAUD_METRICS_SUMMARY")):
+        return False
+    _enabled = True
+    _const_labels["detector"] = detector
+    _started = time.perf_counter()
+    RUN_SECONDS.set_function(lambda: time.perf_counter() - _started)
+    port = os.environ.get("FRAUD_METRICS_PORT")
+    if port and _server is None:
+        _server = ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return True
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    # Drop recorded values, e.g. in a forked worker that reports back to its parent
+    for metric in REGISTRY:
+        metric.children = {}
+        metric.functions = {}
+    if _enabled:
+        RUN_SECONDS.set_function(lambda: time.perf_counter() - _started)
+
+
+class _QueryTimer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+    # Also usable with "async with" (asyncpg calls in ingest_service.py)
+    async def __aenter__(self):
+        self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+def timed(query):
+    # with metrics.timed("fetch_history"): ... -> fraud_query_seconds{query="fetch_history"}
+    if not _enabled:
+        return _NULL_CONTEXT
+    return _QueryTimer(QUERY_SECONDS.labels(query))
+
+
+def count_rows(n):
+    if _enabled:
+        ROWS.labels().inc(n)
+
+
+def record_stages(seconds):
+    # Stage totals from a StageTimer
+    if _enabled:
+        for stage, s in seconds.items():
+            STAGE_SECONDS.labels(stage).set(s)
+
+
+def snapshot():
+    # Picklable counters and histograms of this process, for merge() in the parent
+    return {m.name: {values: (child.value if isinstance(child, _Value) else (child.counts, child.sum, child.count))
+                     for values, child in m.items()[0]}
+            for m in REGISTRY if m.kind != "gauge"}
+
+
+def merge(snap):
+    if not _enabled:
+        return
+    for metric in REGISTRY:
+        for values, data in snap.get(metric.name, {}).items():
+            child = metric.labels(*values)
+            if metric.kind == "histogram":
+                counts, total, count = data
+                child.counts = [a + b for a, b in zip(child.counts, counts)]
+                child.sum += total
+                child.count += count
+            else:
+                child.inc(data)
+
+
+# ---------------------------
+# 3️⃣ Export
+# ---------------------------
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def _format_labels(labels):
+    labels = dict(_const_labels, **labels)
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def render():
+    # Prometheus text exposition format (version 0.0.4)
+    rows = ROWS.children.get(())
+    if _started is not None and rows:
+        ROWS_PER_SECOND.labels().set(rows.value / (time.perf_counter() - _started))
+    lines = []
+    for metric in REGISTRY:
+        samples = list(metric.samples())
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    # Structured end-of-run view: totals, and count / mean / p50 / p95 / p99 per histogram
+    render()   # refreshes rows per second
+    out = {"labels": dict(_const_labels)}
+    for metric in REGISTRY:
+        entries = {}
+        children, functions = metric.items()
+        for values, child in children:
+            key = ",".join(map(str, values)) or "total"
+            if metric.kind == "histogram":
+                entries[key] = {
+                    "count": child.count,
+                    "sum": child.sum,
+                    "mean": child.sum / child.count if child.count else None,
+                    "p50": child.quantile(0.50),
+                    "p95": child.quantile(0.95),
+                    "p99": child.quantile(0.99),
+                }
+            else:
+                entries[key] = child.value
+        for values, fn in functions:
+            entries[",".join(map(str, values)) or "total"] = fn()
+        if entries:
+            out[metric.name] = entries
+    return out
+
+
+def flush():
+    # Rewrite the text file (atomically, so the collector never reads half a file)
+    path = os.environ.get("FRAUD_METRICS_FILE")
+    if _enabled and path:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(render())
+        os.replace(tmp, path)
+
+
+def finish():
+    # End of run: text file, JSON summary, stop the HTTP endpoint
+    global _server
+    if not _enabled:
+        return
+    flush()
+    path = os.environ.get("FRAUD_METRICS_SUMMARY")
+    if path:
+        data = json.dumps(summary(), indent=2, default=str)
+        if path == "-":
+            print(data)
+        else:
+            with open(path, "w") as f:
+                f.write(data)
+    if _server is not None:
+        _server.shutdown()
+        _server = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass   # keep scrapes out of the detector output
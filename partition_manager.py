@@ -0,0 +1,494 @@
+# partition_manager.py
+#
+# Time-range partitioning for transactions and fraud_alerts.
+# Both tables are partitioned on txn_timestamp with the same bounds, so an
+# alert always lives in the partition matching its transaction, the
+# composite foreign key fraud_alerts(txn_id, txn_timestamp) ->
+# transactions(txn_id, txn_timestamp) routes to one partition pair, and a
+# whole period can be detached or dropped at once.
+#
+#   python partition_manager.py --convert --granularity month   # one-off migration
+#   python partition_manager.py                                 # maintenance (cron)
+#   python partition_manager.py --premake 3 --retain 13 --retention-action archive
+#
+# Maintenance creates partitions --premake periods ahead and applies the
+# retention policy (stored in partition_policy) to periods that ended more
+# than --retain periods ago:
+#   detach  - keep the partitions as standalone tables
+#   archive - detach and move them to the `archive` schema
+#   drop    - drop them
+# Alert partitions go first, because the foreign key forbids detaching a
+# transactions partition that alerts still reference. Rows leaving this
+# way are not subtracted from alert_rollup_hourly, so the rollup keeps
+# the history.
+#
+# Rows outside every period (historical loads, backfills, periods retention
+# removed) land in the DEFAULT partitions transactions_default and
+# fraud_alerts_default instead of failing the insert. Maintenance moves
+# them into their own period partitions; rows of periods retention has
+# already retired get the retention action instead (appended to the
+# detached or archived table, or deleted).
+
+import argparse
+import re
+from datetime import datetime, timezone
+
+import db
+from geo_postgis import GEO_INDEXES_SQL, has_geography
+
+PARENTS = ("transactions", "fraud_alerts")   # referenced table first
+
+POLICY_SQL = """
+CREATE TABLE IF NOT EXISTS partition_policy (
+    id                BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),   -- single row
+    granularity       TEXT NOT NULL CHECK (granularity IN ('month', 'day')),
+    premake           INT NOT NULL DEFAULT 3,       -- periods created ahead of now
+    retain            INT,                          -- periods kept; NULL = keep everything
+    retention_action  TEXT NOT NULL DEFAULT 'detach' CHECK (retention_action IN ('detach', 'archive', 'drop')),
+    updated_at        TIMESTAMPTZ DEFAULT now()
+);
+"""
+
+# Alerts carry their transaction's timestamp (the partition key), and every
+# alert writer sets it. Databases created before it get the column and have
+# it filled in and set NOT NULL by install_alert_txn_timestamp();
+# fraud_detect.py, dedupe_alerts.py and this script all run it.
+ALERT_TXN_TIMESTAMP_BACKFILL_SQL = """
+UPDATE fraud_alerts fa
+SET txn_timestamp = t.txn_timestamp
+FROM transactions t
+WHERE t.txn_id = fa.txn_id AND fa.txn_timestamp IS NULL
+"""
+
+PARTITIONED_SQL = """
+CREATE TABLE transactions (LIKE transactions_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+                           INCLUDING GENERATED)
+    PARTITION BY RANGE (txn_timestamp);
+ALTER TABLE transactions
+    ADD PRIMARY KEY (txn_id, txn_timestamp),
+    ADD FOREIGN KEY (account_id) REFERENCES accounts(account_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (merchant_id) REFERENCES merchants(merchant_id),
+    ADD FOREIGN KEY (device_id) REFERENCES devices(device_id);
+ALTER SEQUENCE transactions_txn_id_seq OWNED BY transactions.txn_id;
+CREATE INDEX ON transactions (account_id, txn_timestamp DESC);
+CREATE INDEX ON transactions (txn_id);
+CREATE INDEX ON transactions (merchant_id);
+CREATE INDEX ON transactions (amount);
+
+CREATE TABLE fraud_alerts (LIKE fraud_alerts_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (txn_timestamp);
+ALTER TABLE fraud_alerts
+    ALTER COLUMN txn_timestamp SET NOT NULL,
+    ADD PRIMARY KEY (alert_id, txn_timestamp),
+    ADD FOREIGN KEY (txn_id, txn_timestamp) REFERENCES transactions(txn_id, txn_timestamp) ON DELETE CASCADE,
+    ADD FOREIGN KEY (account_id) REFERENCES accounts(account_id) ON DELETE CASCADE;
+ALTER SEQUENCE fraud_alerts_alert_id_seq OWNED BY fraud_alerts.alert_id;
+CREATE INDEX ON fraud_alerts (account_id);
+CREATE INDEX ON fraud_alerts (status);
+CREATE INDEX ON fraud_alerts (txn_id);
+CREATE UNIQUE INDEX ON fraud_alerts (txn_id, rule_id, txn_timestamp);   -- alert key, see dedupe_alerts.py
+"""
+
+
+# ---------------------------
+# 1️⃣ Period arithmetic
+# ---------------------------
+def period_start(ts, granularity):
+    ts = ts.astimezone(timezone.utc)
+    if granularity == "month":
+        return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+    return datetime(ts.year, ts.month, ts.day, tzinfo=timezone.utc)
+
+def add_periods(start, n, granularity):
+    if granularity == "month":
+        month = start.year * 12 + start.month - 1 + n
+        return datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return datetime.fromordinal(start.toordinal() + n).replace(tzinfo=timezone.utc)
+
+def partition_name(parent, start, granularity):
+    return f"{parent}_p{start:%Y%m}" if granularity == "month" else f"{parent}_p{start:%Y%m%d}"
+
+def parse_partition_start(parent, name):
+    m = re.fullmatch(rf"{parent}_p(\d{{6}}|\d{{8}})", name)
+    if not m:
+        return None
+    fmt = "%Y%m" if len(m.group(1)) == 6 else "%Y%m%d"
+    return datetime.strptime(m.group(1), fmt).replace(tzinfo=timezone.utc)
+
+
+# ---------------------------
+# 2️⃣ Catalog helpers
+# ---------------------------
+def alert_txn_timestamp_not_null(cur):
+    # None when fraud_alerts.txn_timestamp does not exist, else whether it is NOT NULL
+    cur.execute("""
+        SELECT attnotnull FROM pg_attribute
+        WHERE attrelid = 'fraud_alerts'::regclass AND attname = 'txn_timestamp' AND NOT attisdropped
+    """)
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+def has_alert_txn_timestamp(cur):
+    # True when fraud_alerts.txn_timestamp exists and no alert lacks it; until
+    # then, match alerts to transactions on txn_id alone
+    not_null = alert_txn_timestamp_not_null(cur)
+    if not_null is None:
+        return False
+    if not_null:
+        return True
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM fraud_alerts WHERE txn_timestamp IS NULL)")
+    return cur.fetchone()[0]
+
+def install_alert_txn_timestamp(cur):
+    # Add and fill fraud_alerts.txn_timestamp, then make it NOT NULL: rows
+    # with a NULL timestamp never collide on the unique alert key. Returns
+    # the number of alerts filled in
+    if alert_txn_timestamp_not_null(cur):
+        return 0
+    cur.execute("ALTER TABLE fraud_alerts ADD COLUMN IF NOT EXISTS txn_timestamp TIMESTAMPTZ")
+    # A backfill, not an analyst change: keep updated_at and the rollup triggers out of it
+    cur.execute("ALTER TABLE fraud_alerts DISABLE TRIGGER USER")
+    cur.execute(ALERT_TXN_TIMESTAMP_BACKFILL_SQL)
+    filled = cur.rowcount
+    cur.execute("ALTER TABLE fraud_alerts ENABLE TRIGGER USER")
+    cur.execute("SELECT count(*) FROM fraud_alerts WHERE txn_timestamp IS NULL")
+    orphans = cur.fetchone()[0]
+    if orphans:
+        raise SystemExit(f"{orphans} alerts have no matching transaction, so txn_timestamp cannot be filled; "
+                         "delete them and rerun.")
+    cur.execute("ALTER TABLE fraud_alerts ALTER COLUMN txn_timestamp SET NOT NULL")
+    return filled
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", (table,))
+    return cur.fetchone()[0]
+
+def list_partitions(cur, parent):
+    # {period start: partition name}, for partitions following the naming scheme
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (parent,))
+    partitions = {}
+    for (name,) in cur.fetchall():
+        start = parse_partition_start(parent, name)
+        if start is not None:
+            partitions[start] = name
+    return partitions
+
+def default_name(parent):
+    return f"{parent}_default"
+
+def create_default_partitions(cur):
+    for parent in PARENTS:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {default_name(parent)} PARTITION OF {parent} DEFAULT")
+
+def default_periods(cur, granularity):
+    # Period starts of the rows held by transactions_default
+    cur.execute("SELECT to_regclass(%s)", (default_name("transactions"),))
+    if cur.fetchone()[0] is None:
+        return []
+    cur.execute(f"""
+        SELECT DISTINCT date_trunc(%s, txn_timestamp AT TIME ZONE 'UTC')
+        FROM {default_name("transactions")}
+    """, (granularity,))
+    return sorted(ts.replace(tzinfo=timezone.utc) for (ts,) in cur.fetchall())
+
+def generated_free_columns(cur, table):
+    # Column list without generated columns (geog), which are recomputed, not copied
+    cur.execute("""
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0
+          AND NOT attisdropped AND attgenerated = ''
+    """, (table,))
+    return cur.fetchone()[0]
+
+def create_partition(cur, start, granularity):
+    end = add_periods(start, 1, granularity)
+    cur.execute("SELECT to_regclass(%s)", (default_name("transactions"),))
+    if cur.fetchone()[0] is not None:
+        cur.execute(f"""
+            SELECT EXISTS (SELECT 1 FROM {default_name("transactions")}
+                           WHERE txn_timestamp >= %s AND txn_timestamp < %s)
+        """, (start, end))
+        if cur.fetchone()[0]:
+            return split_default(cur, start, end, granularity)
+    for parent in PARENTS:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(parent, start, granularity)}
+            PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)
+        """, (start, end))
+    return 0
+
+def split_default(cur, start, end, granularity):
+    # A partition cannot be created while the default holds rows of its
+    # range: build it as a plain table, move the rows over, then attach it.
+    # The rows are moved, not new, so the fraud and rollup triggers stay off.
+    # Alerts go first so that no ON DELETE CASCADE reaches them.
+    moved = 0
+    for parent in reversed(PARENTS):
+        part, default = partition_name(parent, start, granularity), default_name(parent)
+        # A table detached by an earlier retention run is attached again
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {part} "
+                    f"(LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)")
+        columns = generated_free_columns(cur, parent)
+        cur.execute(f"ALTER TABLE {default} DISABLE TRIGGER USER")
+        cur.execute(f"""
+            WITH moved AS (
+                DELETE FROM {default} WHERE txn_timestamp >= %s AND txn_timestamp < %s RETURNING *
+            )
+            INSERT INTO {part} ({columns}) SELECT {columns} FROM moved
+        """, (start, end))
+        if parent == "transactions":
+            moved = cur.rowcount
+        cur.execute(f"ALTER TABLE {default} ENABLE TRIGGER USER")
+    for parent in PARENTS:
+        cur.execute(f"""
+            ALTER TABLE {parent} ATTACH PARTITION {partition_name(parent, start, granularity)}
+            FOR VALUES FROM (%s) TO (%s)
+        """, (start, end))
+    return moved
+
+def load_policy(cur):
+    cur.execute(POLICY_SQL)
+    cur.execute("SELECT granularity, premake, retain, retention_action FROM partition_policy")
+    return cur.fetchone()
+
+
+# ---------------------------
+# 3️⃣ One-off conversion
+# ---------------------------
+def convert(conn, granularity, premake):
+    # Rebuild both tables as partitioned tables and copy the rows over.
+    # Runs in one transaction holding exclusive locks: schedule downtime.
+    cur = conn.cursor()
+    if is_partitioned(cur, "transactions"):
+        raise SystemExit("transactions is already partitioned.")
+
+    cur.execute("LOCK TABLE transactions, fraud_alerts IN ACCESS EXCLUSIVE MODE")
+    install_alert_txn_timestamp(cur)
+
+    # Foreign keys from other tables (e.g. alert_actions -> fraud_alerts.alert_id)
+    # cannot point at a partitioned table without its partition key; drop them.
+    cur.execute("""
+        SELECT conrelid::regclass::text, conname
+        FROM pg_constraint
+        WHERE contype = 'f'
+          AND confrelid IN ('transactions'::regclass, 'fraud_alerts'::regclass)
+          AND conrelid NOT IN ('transactions'::regclass, 'fraud_alerts'::regclass)
+    """)
+    for table, constraint in cur.fetchall():
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"')
+        print(f"Dropped foreign key {constraint} on {table} (references a table being partitioned).")
+
+    cur.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    cur.execute("ALTER TABLE fraud_alerts RENAME TO fraud_alerts_unpartitioned")
+    cur.execute(PARTITIONED_SQL)
+    create_default_partitions(cur)
+
+    cur.execute("SELECT min(txn_timestamp), max(txn_timestamp) FROM transactions_unpartitioned")
+    first_ts, last_ts = cur.fetchone()
+    now = datetime.now(timezone.utc)
+    start = period_start(first_ts or now, granularity)
+    end = add_periods(period_start(max(last_ts or now, now), granularity), premake + 1, granularity)
+    n = 0
+    while start < end:
+        create_partition(cur, start, granularity)
+        start = add_periods(start, 1, granularity)
+        n += 1
+
+    if has_geography(cur):
+        cur.execute(GEO_INDEXES_SQL)   # GiST index on geog (geo_postgis.py)
+    columns = generated_free_columns(cur, "transactions_unpartitioned")
+    cur.execute(f"INSERT INTO transactions ({columns}) SELECT {columns} FROM transactions_unpartitioned")
+    print(f"Copied {cur.rowcount} transactions into {n} partitions.")
+    # Duplicates keep their first copy; dedupe_alerts.py beforehand keeps the
+    # ones analysts worked on instead
+    cur.execute("""
+        INSERT INTO fraud_alerts
+        SELECT * FROM fraud_alerts_unpartitioned WHERE txn_timestamp IS NOT NULL ORDER BY alert_id
+        ON CONFLICT DO NOTHING
+    """)
+    print(f"Copied {cur.rowcount} alerts.")
+
+    cur.execute(POLICY_SQL)
+    cur.execute("""
+        INSERT INTO partition_policy(granularity, premake) VALUES (%s, %s)
+        ON CONFLICT (id) DO UPDATE SET granularity = EXCLUDED.granularity,
+                                       premake = EXCLUDED.premake, updated_at = now()
+    """, (granularity, premake))
+    cur.execute("DROP TABLE fraud_alerts_unpartitioned, transactions_unpartitioned CASCADE")
+    conn.commit()
+    cur.close()
+    print("Conversion complete. Re-install the triggers on the new tables:\n"
+          "  python fraud_detect.py --mode row|statement\n"
+          "  python alert_watermark.py\n"
+          "  python alert_rollup.py --rebuild")
+
+
+# ---------------------------
+# 4️⃣ Maintenance
+# ---------------------------
+def retention_cutoff(granularity, retain):
+    # Periods that ended before the start of the retain-th period back are expired
+    return add_periods(period_start(datetime.now(timezone.utc), granularity), -retain, granularity)
+
+def plan_periods(existing, in_default, now_start, premake, granularity, cutoff=None):
+    # (periods to create, expired periods whose rows sit in the default).
+    # Forward from the newest existing partition (or this period) to now +
+    # premake, plus every period found in the default; expired ones are not
+    # created again, their partition was retired and may still exist detached
+    start = add_periods(max(existing), 1, granularity) if existing else now_start
+    end = add_periods(now_start, premake + 1, granularity)
+    create = []
+    while start < end:
+        create.append(start)
+        start = add_periods(start, 1, granularity)
+    expired = []
+    for p in in_default:
+        if p in existing or p in create:
+            continue
+        if cutoff is not None and add_periods(p, 1, granularity) <= cutoff:
+            expired.append(p)
+        else:
+            create.append(p)
+    return sorted(create), sorted(expired)
+
+def premake_partitions(cur, granularity, premake, cutoff=None):
+    # Create the planned partitions, moving rows out of the default. Returns
+    # (created partitions, rows moved, expired periods left in the default)
+    create_default_partitions(cur)
+    existing = list_partitions(cur, "transactions")
+    now_start = period_start(datetime.now(timezone.utc), granularity)
+    periods, expired = plan_periods(existing, default_periods(cur, granularity), now_start, premake,
+                                    granularity, cutoff)
+    created, moved = [], 0
+    for start in periods:
+        moved += create_partition(cur, start, granularity)
+        created.append(partition_name("transactions", start, granularity))
+    return created, moved, expired
+
+def retire_default(cur, start, granularity, action):
+    # Apply the retention action to the default's rows of an expired period:
+    # append them to the period's detached / archived table (created if it
+    # is gone), or delete them. Alerts first, as in split_default. Returns
+    # the number of transactions
+    end = add_periods(start, 1, granularity)
+    if action == "archive":
+        cur.execute("CREATE SCHEMA IF NOT EXISTS archive")
+    rows = 0
+    for parent in reversed(PARENTS):
+        default = default_name(parent)
+        cur.execute(f"ALTER TABLE {default} DISABLE TRIGGER USER")
+        if action == "drop":
+            cur.execute(f"DELETE FROM {default} WHERE txn_timestamp >= %s AND txn_timestamp < %s", (start, end))
+        else:
+            part = partition_name(parent, start, granularity)
+            target = f"archive.{part}" if action == "archive" else part
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {target} "
+                        f"(LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)")
+            columns = generated_free_columns(cur, parent)
+            cur.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {default} WHERE txn_timestamp >= %s AND txn_timestamp < %s RETURNING *
+                )
+                INSERT INTO {target} ({columns}) SELECT {columns} FROM moved
+            """, (start, end))
+        if parent == "transactions":
+            rows = cur.rowcount
+        cur.execute(f"ALTER TABLE {default} ENABLE TRIGGER USER")
+    return rows
+
+def apply_retention(cur, granularity, retain, action):
+    cutoff = retention_cutoff(granularity, retain)
+    if action == "archive":
+        cur.execute("CREATE SCHEMA IF NOT EXISTS archive")
+    alert_parts = list_partitions(cur, "fraud_alerts")
+    expired = []
+    for start, txn_part in sorted(list_partitions(cur, "transactions").items()):
+        if add_periods(start, 1, granularity) > cutoff:
+            continue
+        for parent, part in (("fraud_alerts", alert_parts.get(start)), ("transactions", txn_part)):
+            if part is None:
+                continue
+            # Partitions under a foreign key cannot be dropped in place; detach first
+            cur.execute(f"ALTER TABLE {parent} DETACH PARTITION {part}")
+            if action == "drop":
+                cur.execute(f"DROP TABLE {part}")
+                continue
+            if parent == "fraud_alerts":
+                # The detached table keeps a copy of the foreign key; it would
+                # block detaching the transactions partition it points to
+                cur.execute("""
+                    SELECT conname FROM pg_constraint
+                    WHERE conrelid = to_regclass(%s) AND contype = 'f'
+                """, (part,))
+                for (constraint,) in cur.fetchall():
+                    cur.execute(f'ALTER TABLE {part} DROP CONSTRAINT "{constraint}"')
+            if action == "archive":
+                cur.execute("SELECT to_regclass(%s)", (f"archive.{part}",))
+                if cur.fetchone()[0] is None:
+                    cur.execute(f"ALTER TABLE {part} SET SCHEMA archive")
+                else:
+                    # Archived before: add to that table instead of clashing with it
+                    columns = generated_free_columns(cur, part)
+                    cur.execute(f"INSERT INTO archive.{part} ({columns}) SELECT {columns} FROM {part}")
+                    cur.execute(f"DROP TABLE {part}")
+        expired.append(txn_part)
+    return expired
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and retire time partitions of transactions and fraud_alerts.")
+    parser.add_argument("--convert", action="store_true",
+                        help="one-off: rebuild the unpartitioned tables as partitioned tables")
+    parser.add_argument("--granularity", choices=["month", "day"], default="month",
+                        help="partition size for --convert")
+    parser.add_argument("--premake", type=int, help="periods to create ahead of now (stored in the policy)")
+    parser.add_argument("--retain", type=int, help="periods to keep (stored in the policy)")
+    parser.add_argument("--retention-action", choices=["detach", "archive", "drop"],
+                        help="what to do with expired periods (stored in the policy)")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    if args.convert:
+        convert(conn, args.granularity, args.premake if args.premake is not None else 3)
+
+    cur = conn.cursor()
+    if not is_partitioned(cur, "transactions"):
+        # Still a single heap: only make sure alerts carry txn_timestamp
+        install_alert_txn_timestamp(cur)
+        conn.commit()
+        raise SystemExit("transactions is not partitioned; run with --convert first.")
+
+    policy = load_policy(cur)
+    if policy is None:
+        raise SystemExit("No partition_policy row; run with --convert first.")
+    cur.execute("""
+        UPDATE partition_policy
+        SET premake = COALESCE(%s, premake),
+            retain = COALESCE(%s, retain),
+            retention_action = COALESCE(%s, retention_action),
+            updated_at = now()
+        RETURNING granularity, premake, retain, retention_action
+    """, (args.premake, args.retain, args.retention_action))
+    granularity, premake, retain, action = cur.fetchone()
+
+    cutoff = retention_cutoff(granularity, retain) if retain is not None else None
+    created, moved, expired_defaults = premake_partitions(cur, granularity, premake, cutoff)
+    print(f"Created {len(created)} partitions ({granularity} partitions, {premake} ahead): {created}")
+    if moved:
+        print(f"Moved {moved} transactions out of {default_name('transactions')}.")
+    if retain is not None:
+        expired = apply_retention(cur, granularity, retain, action)
+        print(f"Retention ({action}, keep {retain}): {len(expired)} expired periods {expired}")
+        for start in expired_defaults:
+            rows = retire_default(cur, start, granularity, action)
+            print(f"Retention ({action}): {rows} transactions of expired period "
+                  f"{partition_name('transactions', start, granularity)} found in {default_name('transactions')}")
+    conn.commit()
+    cur.close()
+    conn.close()
@@ -0,0 +1,392 @@
+# rules.py
+#
+# Rule registry shared by the Python detectors (fraud_alerts.py,
+# fraud_generate.py, fraud_generate_advanced.py, ingest_service.py).
+# Rules and thresholds are declared per detector profile in rules.json; the
+# shared thresholds live in its "base" profile, which the detector profiles
+# (and the triggers in fraud_detect.py) extend.
+# A profile is compiled once into a RuleEngine. The engine evaluates every
+# rule in a single pass per transaction over a shared per-account context,
+# so window counts and distances are computed at most once per transaction
+# and reused by every rule that needs them.
+#
+#   engine = RuleEngine.load("fraud_alerts")
+#   engine.observe(txn)            # history: update the context only
+#   alerts = engine.evaluate(txn)  # score, then update the context
+#   print(engine.summary())        # per-rule hits and time
+
+import copy
+import json
+import os
+import random
+import time
+from collections import deque, namedtuple
+from datetime import timedelta
+
+import numpy as np
+import metrics
+from geo_distance import distances_km
+from windows import WINDOWS, WindowCounters
+
+RULES_CONFIG = os.environ.get("FRAUD_RULES_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+
+Txn = namedtuple("Txn", "txn_id account_id amount txn_timestamp geo_lat geo_lng device_id")
+
+
+# ---------------------------
+# 1️⃣ Per-account context
+# ---------------------------
+class AccountContext:
+    # Recent transactions of one account, oldest first: (timestamp, lat, lng, device_id)
+
+    __slots__ = ("recent", "last_location", "prior_location", "windows")
+
+    def __init__(self, history_size, with_windows=False):
+        self.recent = deque(maxlen=history_size)
+        # Event-time count / amount windows (windows.py), when a rule reads them
+        self.windows = WindowCounters() if with_windows else None
+        # (timestamp, lat, lng) of the latest located txn, kept beyond `recent`,
+        # and of the latest one strictly before it
+        self.last_location = None
+        self.prior_location = None
+
+
+class TxnView:
+    # One transaction against its account context; shared values are computed on first use
+
+    def __init__(self, txn, ctx, located, same_time_visible, devices=None, distances=None):
+        self.txn = txn
+        self.ctx = ctx
+        self.located = located
+        self.devices = devices   # DeviceIndex (account_devices.py), for new_device with source "account_devices"
+        # False: earlier rows with the same timestamp are treated as concurrent and not seen
+        self.same_time_visible = same_time_visible
+        self._counts = {}
+        self._windows = {}
+        self._recent_points = None
+        # Distances already measured for the whole batch (RuleEngine.last_distances)
+        self._distances = dict(distances or {})
+
+    def count_within(self, window):
+        # Earlier transactions no more than `window` before this one
+        if window not in self._counts:
+            since = self.txn.txn_timestamp - window
+            n = 0
+            for entry in reversed(self.ctx.recent):
+                if entry[0] < since:
+                    break
+                if self.same_time_visible or entry[0] < self.txn.txn_timestamp:
+                    n += 1
+            self._counts[window] = n
+        return self._counts[window]
+
+    def window(self, name):
+        # (count, amount sum) of the account's window `name` ("1m", "10m", "1h", "24h")
+        # before this transaction, at bucket granularity; same-timestamp rows already
+        # seen are included whatever same_time_visible says
+        if name not in self._windows:
+            self._windows[name] = self.ctx.windows.get(name, self.txn.txn_timestamp)
+        return self._windows[name]
+
+    def recent_points(self):
+        if self._recent_points is None:
+            self._recent_points = [(e[1], e[2]) for e in self.ctx.recent
+                                   if e[1] is not None and e[2] is not None
+                                   and (self.same_time_visible or e[0] < self.txn.txn_timestamp)]
+        return self._recent_points
+
+    def distances(self, compare, threshold_km, exact):
+        # km from this txn to the last location ("last") or to every recent located txn ("recent")
+        key = (compare, threshold_km, exact)
+        if key not in self._distances:
+            if not self.located:
+                points = []
+            elif compare == "last":
+                last = self.ctx.last_location
+                if last and not self.same_time_visible and last[0] >= self.txn.txn_timestamp:
+                    last = self.ctx.prior_location
+                points = [last[1:]] if last else []
+            else:
+                points = self.recent_points()
+            self._distances[key] = (distances_km(points, (self.txn.geo_lat, self.txn.geo_lng),
+                                                 threshold_km=threshold_km, exact=exact)
+                                    if points else np.empty(0))
+        return self._distances[key]
+
+
+# ---------------------------
+# 2️⃣ Rule kinds
+# ---------------------------
+# Each kind takes the rule's params and returns a check(view) that gives the
+# values for the reason template when the rule fires, or None.
+def high_value(threshold):
+    def check(view):
+        if view.txn.amount > threshold:
+            return {"amount": view.txn.amount, "threshold": threshold}
+    return check
+
+def velocity(window_minutes, min_count):
+    window = timedelta(minutes=window_minutes)
+    def check(view):
+        count = view.count_within(window) + 1   # this transaction included
+        if count >= min_count:
+            return {"count": count, "window_minutes": window_minutes}
+    return check
+
+def window(window, min_count=None, min_amount=None):
+    # Count and/or amount sum in an event-time window, this transaction included
+    def check(view):
+        count, amount = view.window(window)
+        count += 1
+        amount += float(view.txn.amount or 0)
+        if (min_count is not None and count >= min_count) or (min_amount is not None and amount >= min_amount):
+            return {"count": count, "amount": amount, "window": window}
+    return check
+
+def geo_mismatch(max_km, compare="recent", exact=True):
+    def check(view):
+        distances = view.distances(compare, max_km, exact)
+        far = np.flatnonzero(distances > max_km)
+        if far.size:
+            return {"distance_km": float(distances[far[0]])}
+    return check
+
+def new_device(source="recent"):
+    # source "recent": not among the devices of the recent transactions;
+    # "account_devices": never used by the account before (DeviceIndex).
+    # Either way an account's first device is not flagged.
+    if source == "account_devices":
+        def check(view):
+            txn = view.txn
+            if view.devices is None:
+                raise RuntimeError("new_device with source 'account_devices' needs engine.attach_devices()")
+            if (txn.device_id is not None
+                    and not view.devices.seen_before(txn.account_id, txn.device_id, txn.txn_timestamp)
+                    and view.devices.account_seen_before(txn.account_id, txn.txn_timestamp)):
+                return {"device_id": txn.device_id}
+        return check
+    def check(view):
+        devices = [e[3] for e in view.ctx.recent]
+        if devices and view.txn.device_id not in devices:
+            return {"device_id": view.txn.device_id}
+    return check
+
+def random_sample(probability):
+    # Simulation only: flags a random share of transactions
+    def check(view):
+        if random.random() < probability:
+            return {}
+    return check
+
+RULE_KINDS = {
+    "high_value": high_value,
+    "velocity": velocity,
+    "window": window,
+    "geo_mismatch": geo_mismatch,
+    "new_device": new_device,
+    "random_sample": random_sample,
+}
+
+
+# ---------------------------
+# 3️⃣ Engine
+# ---------------------------
+class RuleEngine:
+
+    def __init__(self, profile, rules, history_size=None, zero_is_missing=False, same_time_visible=True):
+        self.profile = profile
+        # (rule_id, severity, score, reason template, check)
+        self.rules = [(r["rule_id"], r["severity"], r["score"], r["reason"],
+                       RULE_KINDS[r["kind"]](**r.get("params", {})))
+                      for r in rules]
+        # Without a fixed history size, keep what the longest window needs
+        windows = [timedelta(minutes=r["params"]["window_minutes"]) for r in rules if r["kind"] == "velocity"]
+        self.max_age = max(windows) if history_size is None and windows else None
+        # Window counters are kept per account only when a rule reads them
+        self.uses_windows = any(r["kind"] == "window" for r in rules)
+        spans = {name: timedelta(seconds=seconds) for name, seconds, _ in WINDOWS}
+        # How far back a detector has to load history for these rules
+        self.lookback = max(windows + [spans[r["params"]["window"]] for r in rules if r["kind"] == "window"],
+                            default=timedelta(0))
+        self.history_size = history_size
+        self.zero_is_missing = zero_is_missing
+        self.same_time_visible = same_time_visible
+        # Rules that read account_devices need a DeviceIndex (attach_devices)
+        self.uses_devices = any(r["kind"] == "new_device" and r.get("params", {}).get("source") == "account_devices"
+                                for r in rules)
+        # (max_km, exact) of the geo rules comparing with the last location,
+        # measured per batch by replay() (last_distances)
+        self.last_geo = sorted({(r["params"]["max_km"], r["params"].get("exact", True)) for r in rules
+                                if r["kind"] == "geo_mismatch" and r["params"].get("compare") == "last"})
+        self.devices = None
+        self.contexts = {}
+        self.hits = {r[0]: 0 for r in self.rules}
+        self.seconds = {r[0]: 0.0 for r in self.rules}
+        self.evaluated = 0
+        # Prometheus children per rule (latency, alerts); None while metrics are off
+        self.rule_metrics = ([(metrics.RULE_SECONDS.labels(r[0]), metrics.ALERTS.labels(r[0])) for r in self.rules]
+                             if metrics.enabled() else None)
+
+    @classmethod
+    def load(cls, profile, path=None):
+        config = profile_config(profile, path)
+        return cls(profile, config["rules"], **config.get("context", {}))
+
+    def attach_devices(self, devices):
+        self.devices = devices
+
+    def knows(self, account_id):
+        return account_id in self.contexts
+
+    def forget(self, account_id):
+        # Drop an account's context, e.g. after its transactions failed to be
+        # written; a caller that warms contexts rebuilds it when next seen
+        self.contexts.pop(account_id, None)
+
+    def context(self, account_id):
+        ctx = self.contexts.get(account_id)
+        if ctx is None:
+            ctx = self.contexts[account_id] = AccountContext(self.history_size, self.uses_windows)
+        return ctx
+
+    def _located(self, txn):
+        if self.zero_is_missing:
+            return bool(txn.geo_lat) and bool(txn.geo_lng)
+        return txn.geo_lat is not None and txn.geo_lng is not None
+
+    def observe(self, txn, located=None):
+        # Fold txn into its account context (transactions arrive in time order)
+        ctx = self.context(txn.account_id)
+        if located is None:
+            located = self._located(txn)
+        ctx.recent.append((txn.txn_timestamp, txn.geo_lat if located else None,
+                           txn.geo_lng if located else None, txn.device_id))
+        if located:
+            last = ctx.last_location
+            if last and last[0] < txn.txn_timestamp:
+                ctx.prior_location = last
+            ctx.last_location = (txn.txn_timestamp, txn.geo_lat, txn.geo_lng)
+        if ctx.windows is not None:
+            ctx.windows.add(txn.txn_timestamp, txn.amount)
+        if self.devices is not None and txn.device_id is not None:
+            self.devices.add(txn.account_id, txn.device_id, txn.txn_timestamp)
+        if self.max_age is not None:
+            since = txn.txn_timestamp - self.max_age
+            while ctx.recent and ctx.recent[0][0] < since:
+                ctx.recent.popleft()
+
+    def last_distances(self, rows):
+        # km from every new located row to the account's last location before
+        # it, one distances_km call per "last" geo rule for the whole batch.
+        # rows: (txn, is_new) in time order, as replay() walks them; follows
+        # observe() for last_location / prior_location.
+        # -> {txn_id: {("last", max_km, exact): distances}}
+        locations = {account_id: (ctx.last_location, ctx.prior_location)
+                     for account_id, ctx in self.contexts.items()}
+        txn_ids, prev_points, cur_points = [], [], []
+        for txn, is_new in rows:
+            if not self._located(txn):
+                continue
+            last, prior = locations.get(txn.account_id, (None, None))
+            if is_new:
+                point = last
+                if point and not self.same_time_visible and point[0] >= txn.txn_timestamp:
+                    point = prior
+                if point:
+                    txn_ids.append(txn.txn_id)
+                    prev_points.append(point[1:])
+                    cur_points.append((txn.geo_lat, txn.geo_lng))
+            if last and last[0] < txn.txn_timestamp:
+                prior = last
+            locations[txn.account_id] = ((txn.txn_timestamp, txn.geo_lat, txn.geo_lng), prior)
+        measured = {}
+        if txn_ids:
+            for max_km, exact in self.last_geo:
+                distances = distances_km(prev_points, cur_points, threshold_km=max_km, exact=exact)
+                for i, txn_id in enumerate(txn_ids):
+                    measured.setdefault(txn_id, {})[("last", max_km, exact)] = distances[i:i + 1]
+        return measured
+
+    def evaluate(self, txn, distances=None):
+        # All rules for txn in one pass; returns alert dicts and records txn.
+        # distances: measured beforehand for the batch (last_distances)
+        located = self._located(txn)
+        view = TxnView(txn, self.context(txn.account_id), located, self.same_time_visible, self.devices,
+                       distances)
+        alerts = []
+        for i, (rule_id, severity, score, reason, check) in enumerate(self.rules):
+            start = time.perf_counter()
+            values = check(view)
+            elapsed = time.perf_counter() - start
+            self.seconds[rule_id] += elapsed
+            if self.rule_metrics:
+                self.rule_metrics[i][0].observe(elapsed)
+            if values is not None:
+                self.hits[rule_id] += 1
+                if self.rule_metrics:
+                    self.rule_metrics[i][1].inc()
+                alerts.append({
+                    'rule_id': rule_id,
+                    'reason': reason.format(**values),
+                    'severity': severity,
+                    'score': score
+                })
+        self.evaluated += 1
+        self.observe(txn, located)
+        return alerts
+
+    def stats(self):
+        return {rule_id: (self.hits[rule_id], self.seconds[rule_id]) for rule_id in self.hits}
+
+    def summary(self, stats=None, evaluated=None):
+        # One line per rule; pass merged stats to summarise several engines (shards)
+        stats = stats or self.stats()
+        evaluated = self.evaluated if evaluated is None else evaluated
+        lines = [f"Rule profile '{self.profile}': {evaluated} transactions evaluated"]
+        for rule_id, (hits, seconds) in stats.items():
+            per_txn_us = seconds / evaluated * 1e6 if evaluated else 0.0
+            lines.append(f"  {rule_id:<20} {hits:>8} hits  {seconds:8.3f}s  ({per_txn_us:.1f} us/txn)")
+        return "\n".join(lines)
+
+
+def profile_config(profile, path=None):
+    # A profile's context and rules with "extends" resolved: the base
+    # profile's rules minus those in "exclude", with the profile's own rules
+    # merged over them by rule_id (params key by key) and new rule_ids appended
+    with open(path or RULES_CONFIG) as f:
+        config = json.load(f)
+    if profile not in config:
+        raise KeyError(f"No rule profile '{profile}' in {path or RULES_CONFIG}")
+    own = config[profile]
+    if "extends" not in own:
+        return own
+    base = profile_config(own["extends"], path)
+    rules = {r["rule_id"]: copy.deepcopy(r) for r in base["rules"] if r["rule_id"] not in own.get("exclude", ())}
+    for r in own.get("rules", []):
+        merged = rules.setdefault(r["rule_id"], {})
+        merged.update({k: v for k, v in r.items() if k != "params"})
+        merged["params"] = {**merged.get("params", {}), **r.get("params", {})}
+    return {"context": {**base.get("context", {}), **own.get("context", {})}, "rules": list(rules.values())}
+
+
+def merge_stats(stats_list):
+    # Sum per-rule (hits, seconds) from several engines, e.g. one per shard
+    merged = {}
+    for stats in stats_list:
+        for rule_id, (hits, seconds) in stats.items():
+            h, t = merged.get(rule_id, (0, 0.0))
+            merged[rule_id] = (h + hits, t + seconds)
+    return merged
+
+
+def replay(engine, history, transactions):
+    # Batch detectors: already-scored history rows and new rows in one time
+    # ordered pass; yields (txn, alerts) for the new rows only
+    rows = sorted([(Txn._make(t), False) for t in history] + [(Txn._make(t), True) for t in transactions],
+                  key=lambda r: (r[0].txn_timestamp, r[0].txn_id))
+    measured = engine.last_distances(rows) if engine.last_geo else {}
+    for txn, is_new in rows:
+        if is_new:
+            yield txn, engine.evaluate(txn, measured.get(txn.txn_id))
+        else:
+            engine.observe(txn)
@@ -0,0 +1,44 @@
+# stage_timer.py
+#
+# Wall time per detector stage (fetch / score / write). Stages can nest and
+# are exclusive: time spent in an inner stage (an alert flush triggered while
+# scoring) is counted only for the inner one. When FRAUD_STAGE_TIMINGS names
+# a file, dump() writes the totals there as JSON; benchmark.py sets it.
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.seconds = {}
+        self._inner = []   # time spent in nested stages, per open stage
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._inner.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, elapsed - self._inner.pop())
+            if self._inner:
+                self._inner[-1] += elapsed
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def merge(self, seconds):
+        # Fold in another timer's totals, e.g. from a worker process
+        for name, s in seconds.items():
+            self.add(name, s)
+
+    def dump(self, path=None):
+        path = path or os.environ.get("FRAUD_STAGE_TIMINGS")
+        if path:
+            with open(path, "w") as f:
+                json.dump(self.seconds, f, indent=2)
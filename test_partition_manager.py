@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+from partition_manager import add_periods, plan_periods
+
+
+def month(year, m):
+    return datetime(year, m, 1, tzinfo=timezone.utc)
+
+
+def test_rows_reloaded_into_a_retired_period_are_not_partitioned_again():
+    # 2025-01..2025-03 were retired (detached); rows for 2025-02 come back
+    # and land in the default partition
+    now = month(2025, 6)
+    cutoff = add_periods(now, -3, "month")
+    existing = {month(2025, m): f"transactions_p2025{m:02d}" for m in range(4, 10)}
+    create, expired = plan_periods(existing, [month(2025, 2)], now, 3, "month", cutoff)
+    assert month(2025, 2) not in create
+    assert expired == [month(2025, 2)]
+
+
+def test_default_periods_inside_retention_get_a_partition():
+    now = month(2025, 6)
+    cutoff = add_periods(now, -3, "month")
+    existing = {month(2025, m): f"transactions_p2025{m:02d}" for m in range(4, 10)}
+    create, expired = plan_periods(existing, [month(2025, 3)], now, 3, "month", cutoff)
+    assert create == [month(2025, 3)]
+    assert expired == []
+
+
+def test_without_retention_every_default_period_gets_a_partition():
+    now = month(2025, 6)
+    create, expired = plan_periods({}, [month(2020, 1)], now, 1, "month")
+    assert create == [month(2020, 1), month(2025, 6), month(2025, 7)]
+    assert expired == []
@@ -0,0 +1,186 @@
+# windows.py
+#
+# Event-time window counters per account: transaction count and amount sum
+# over several windows at once (WINDOWS: 1m, 10m, 1h, 24h). Each window is a
+# ring of fixed-width buckets keyed by the transaction's own timestamp, not
+# the clock, so backfilled and replayed rows land in the windows they
+# belong to. An update touches one slot per window (O(1)); memory is a
+# fixed SLOTS buckets per account.
+#
+# A window read "as of" a timestamp sums the buckets in (at - window, at]
+# at bucket granularity (at most one bucket width early). Transactions older
+# than a window's ring when they arrive are left out of that window only,
+# and a read as of a time the ring has already moved past is incomplete:
+# txn_windows_get() reports that, and the triggers then count the
+# transactions table directly.
+#
+# Two sides with the same layout:
+#   - SQL: composite type txn_windows with txn_windows_push() / txn_windows_get()
+#     and the txn_windows_agg() aggregate. account_txn_state (account_state.py)
+#     stores one per account and the fraud triggers read it.
+#   - Python: WindowCounters, which rules.py keeps per account for rules of
+#     kind "window" and exposes to any rule as TxnView.window(name).
+#
+# Changing WINDOWS changes the layout: rebuild afterwards with
+#   python account_state.py --rebuild
+
+import math
+
+# (name, window seconds, buckets); each width divides the next, so one
+# finest bucket falls into a single bucket of every window
+WINDOWS = (
+    ("1m", 60, 6),        # 10 s buckets
+    ("10m", 600, 10),     # 1 min
+    ("1h", 3600, 6),      # 10 min
+    ("24h", 86400, 24),   # 1 h
+)
+WINDOW_NAMES = tuple(w[0] for w in WINDOWS)
+WIDTHS = tuple(seconds // buckets for _, seconds, buckets in WINDOWS)
+SIZES = tuple(buckets for _, _, buckets in WINDOWS)
+OFFSETS = tuple(sum(SIZES[:i]) for i in range(len(WINDOWS)))
+SLOTS = sum(SIZES)
+FINEST_WIDTH = min(WIDTHS)
+
+
+# ---------------------------
+# 1️⃣ SQL type and functions
+# ---------------------------
+def _sql_array(values, quote=False):
+    return "ARRAY[" + ", ".join(f"'{v}'" if quote else str(v) for v in values) + "]"
+
+
+WINDOWS_SQL = f"""
+DO $$
+BEGIN
+    IF to_regtype('txn_windows') IS NULL THEN
+        -- Rings of every window back to back ({SLOTS} slots); epoch -1 = empty
+        CREATE TYPE txn_windows AS (epochs BIGINT[], counts INT[], amounts NUMERIC[]);
+    END IF;
+END;
+$$;
+
+-- Fold p_count transactions (p_amount in total) at p_ts into the windows
+CREATE OR REPLACE FUNCTION txn_windows_push(
+    w        txn_windows,
+    p_ts     TIMESTAMPTZ,
+    p_amount NUMERIC,
+    p_count  INT DEFAULT 1
+) RETURNS txn_windows LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    widths  INT[] := {_sql_array(WIDTHS)};
+    sizes   INT[] := {_sql_array(SIZES)};
+    epoch   DOUBLE PRECISION := extract(epoch FROM p_ts);
+    epochs  BIGINT[] := COALESCE(w.epochs, array_fill(-1::BIGINT, ARRAY[{SLOTS}]));
+    counts  INT[] := COALESCE(w.counts, array_fill(0, ARRAY[{SLOTS}]));
+    amounts NUMERIC[] := COALESCE(w.amounts, array_fill(0::NUMERIC, ARRAY[{SLOTS}]));
+    base    INT := 0;
+    bucket  BIGINT;
+    slot    INT;
+BEGIN
+    FOR r IN 1 .. {len(WINDOWS)} LOOP
+        bucket := floor(epoch / widths[r]);
+        slot := base + (bucket % sizes[r]) + 1;
+        IF epochs[slot] = bucket THEN
+            counts[slot] := counts[slot] + p_count;
+            amounts[slot] := amounts[slot] + COALESCE(p_amount, 0);
+        ELSIF epochs[slot] < bucket THEN
+            epochs[slot] := bucket;
+            counts[slot] := p_count;
+            amounts[slot] := COALESCE(p_amount, 0);
+        END IF;   -- older than the ring: dropped from this window
+        base := base + sizes[r];
+    END LOOP;
+    RETURN ROW(epochs, counts, amounts)::txn_windows;
+END;
+$$;
+
+-- Count and amount sum of one window as of p_at, e.g.
+--   (txn_windows_get(s.windows, '1h', NEW.txn_timestamp)).txn_count
+-- complete is false when the ring holds buckets after p_at, which may have
+-- overwritten some inside the window
+CREATE OR REPLACE FUNCTION txn_windows_get(
+    w        txn_windows,
+    p_window TEXT,
+    p_at     TIMESTAMPTZ,
+    OUT txn_count INT,
+    OUT amount    NUMERIC,
+    OUT complete  BOOLEAN
+) LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    r       INT := array_position({_sql_array(WINDOW_NAMES, quote=True)}::TEXT[], p_window);
+    widths  INT[] := {_sql_array(WIDTHS)};
+    sizes   INT[] := {_sql_array(SIZES)};
+    offsets INT[] := {_sql_array(OFFSETS)};
+    upper   BIGINT;
+BEGIN
+    IF r IS NULL THEN
+        RAISE EXCEPTION 'unknown window %', p_window;
+    END IF;
+    txn_count := 0;
+    amount := 0;
+    complete := true;
+    IF w.epochs IS NULL THEN
+        RETURN;
+    END IF;
+    upper := floor(extract(epoch FROM p_at) / widths[r]);
+    FOR i IN offsets[r] + 1 .. offsets[r] + sizes[r] LOOP
+        IF w.epochs[i] > upper - sizes[r] AND w.epochs[i] <= upper THEN
+            txn_count := txn_count + w.counts[i];
+            amount := amount + w.amounts[i];
+        ELSIF w.epochs[i] > upper THEN
+            complete := false;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- Windows of a set of transactions (in any order), e.g. for a rebuild
+CREATE OR REPLACE AGGREGATE txn_windows_agg(TIMESTAMPTZ, NUMERIC, INT) (
+    SFUNC = txn_windows_push,
+    STYPE = txn_windows
+);
+"""
+
+
+def install_windows(cur):
+    cur.execute(WINDOWS_SQL)
+
+
+# ---------------------------
+# 2️⃣ Python counters
+# ---------------------------
+class WindowCounters:
+    # One account's rings, same layout and bucket numbers as txn_windows
+
+    __slots__ = ("epochs", "counts", "amounts")
+
+    def __init__(self):
+        self.epochs = [-1] * SLOTS
+        self.counts = [0] * SLOTS
+        self.amounts = [0.0] * SLOTS
+
+    def add(self, ts, amount, n=1):
+        epoch = ts.timestamp()
+        amount = float(amount or 0)
+        for width, size, base in zip(WIDTHS, SIZES, OFFSETS):
+            bucket = math.floor(epoch / width)
+            slot = base + bucket % size
+            if self.epochs[slot] == bucket:
+                self.counts[slot] += n
+                self.amounts[slot] += amount
+            elif self.epochs[slot] < bucket:
+                self.epochs[slot] = bucket
+                self.counts[slot] = n
+                self.amounts[slot] = amount
+
+    def get(self, name, at):
+        # (count, amount sum) of window `name` as of timestamp `at`
+        r = WINDOW_NAMES.index(name)
+        width, size, base = WIDTHS[r], SIZES[r], OFFSETS[r]
+        upper = math.floor(at.timestamp() / width)
+        count, amount = 0, 0.0
+        for i in range(base, base + size):
+            if upper - size < self.epochs[i] <= upper:
+                count += self.counts[i]
+                amount += self.amounts[i]
+        return count, amount